@@ -0,0 +1,120 @@
+import time
+import logging
+import threading
+
+from six.moves.queue import Queue, Empty, Full
+
+log = logging.getLogger(__name__)
+
+
+class _Pending:
+
+    def __init__(self, record):
+        self.record = record
+        self.result = (False, 'Not sent')
+        self.done = threading.Event()
+
+
+class RequestBatcher:
+    """
+    Coalesces records submitted by concurrent callers into batches.
+
+    A batch is sent once it holds ``batch_size`` records or ``max_wait``
+    seconds after its first record arrived, whichever comes first. The
+    queue is bounded: when it is full, ``submit`` waits up to
+    ``enqueue_timeout`` seconds and then fails, pushing back on callers
+    instead of buffering without limit.
+
+    ``send_batch`` receives a list of records and must return one
+    ``(result, message)`` tuple per record, in order.
+
+    When ``key`` is given, each worker has its own queue and records are
+    routed to them by key, so the records of one key are sent in the
+    order they were submitted, as the spool delivers them.
+    """
+
+    def __init__(self, send_batch, batch_size=100, max_wait=0.05,
+                 queue_size=10000, enqueue_timeout=1.0, result_timeout=30,
+                 workers=2, key=None):
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.enqueue_timeout = enqueue_timeout
+        self.result_timeout = result_timeout
+        self.workers = workers
+        self.key = key
+        if key and workers > 1:
+            size = max(1, queue_size // workers)
+            self.queues = [Queue(maxsize=size) for _ in range(workers)]
+        else:
+            self.queues = [Queue(maxsize=queue_size)]
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            for index in range(self.workers):
+                thread = self.threads.get(index)
+                if thread and thread.is_alive():
+                    continue
+                queue = self.queues[index % len(self.queues)]
+                thread = threading.Thread(target=self._run, args=(queue,),
+                                          name='swift-cloud-batcher')
+                thread.daemon = True
+                thread.start()
+                self.threads[index] = thread
+
+    def _queue(self, record):
+        if len(self.queues) == 1:
+            return self.queues[0]
+        return self.queues[hash(self.key(record)) % len(self.queues)]
+
+    def submit(self, record):
+        if len(self.threads) < self.workers:
+            self._start()
+
+        pending = _Pending(record)
+
+        try:
+            self._queue(record).put(pending, timeout=self.enqueue_timeout)
+        except Full:
+            return False, 'Batch queue full'
+
+        if not pending.done.wait(self.result_timeout):
+            return False, 'Timed out waiting for batch'
+
+        return pending.result
+
+    def _collect(self, queue):
+        batch = [queue.get()]
+        deadline = time.time() + self.max_wait
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(queue.get(timeout=remaining))
+            except Empty:
+                break
+
+        return batch
+
+    def _run(self, queue):
+        while True:
+            batch = self._collect(queue)
+            try:
+                results = self.send_batch([p.record for p in batch])
+            except Exception as err:
+                log.error(err)
+                results = [(False, str(err))] * len(batch)
+
+            if len(results) != len(batch):
+                log.error('Batch returned %d results for %d records',
+                          len(results), len(batch))
+                results = list(results) + [(False, 'Missing batch result')] * (
+                    len(batch) - len(results))
+
+            for pending, result in zip(batch, results):
+                pending.result = result
+                pending.done.set()
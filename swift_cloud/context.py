@@ -0,0 +1,37 @@
+"""
+State of the request served by the current (green)thread: metric tags,
+recorded spans and the active trace span.
+
+Greenthreads spawned to fan work out (listing partitions, bulk deletes,
+shard listings) start with empty locals, so the callable they run is
+wrapped with :func:`propagate` to carry the caller's state over.
+"""
+import threading
+
+_local = threading.local()
+
+
+def get(key, default=None):
+    return getattr(_local, key, default)
+
+
+def update(**values):
+    for key, value in values.items():
+        setattr(_local, key, value)
+
+
+def capture():
+    return dict(_local.__dict__)
+
+
+def propagate(func):
+    """
+    Wraps ``func`` to run with the state of the calling greenthread.
+    """
+    values = capture()
+
+    def wrapper(*args, **kwargs):
+        _local.__dict__.update(values)
+        return func(*args, **kwargs)
+
+    return wrapper
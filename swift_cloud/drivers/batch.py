@@ -0,0 +1,45 @@
+from google.cloud.storage.batch import Batch
+
+# GCS accepts at most 100 calls in a single batch request
+MAX_BATCH_SIZE = 100
+
+
+def chunks(items, size=MAX_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class TolerantBatch(Batch):
+    """
+    GCS batch that records the status of every deferred call instead of
+    raising on the first failed one, so callers can report per item.
+
+    ``statuses`` holds one HTTP status code per call, in the order the
+    calls were made.
+    """
+
+    _MAX_BATCH_SIZE = MAX_BATCH_SIZE
+
+    def __init__(self, client):
+        super(TolerantBatch, self).__init__(client)
+        self.statuses = []
+
+    def _finish_futures(self, responses):
+        self.statuses = []
+
+        for target_object, subresponse in zip(self._target_objects, responses):
+            self.statuses.append(subresponse.status_code)
+
+            if not 200 <= subresponse.status_code < 300:
+                continue
+
+            if target_object is not None:
+                try:
+                    target_object._properties = subresponse.json()
+                except ValueError:
+                    target_object._properties = subresponse.content
+
+    def finish(self):
+        if not self._requests:
+            return []
+        return super(TolerantBatch, self).finish()
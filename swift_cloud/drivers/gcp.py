@@ -1,26 +1,53 @@
 import io
 import os
+import zlib
+import tarfile
+import functools
+import heapq
+import itertools
 import json
 import pytz
+import collections
 import logging
 import datetime
 import mimetypes
 import urllib
 import time
 
-from swift.common.swob import Response, wsgi_to_str
-from swift.common.utils import split_path, Timestamp
+from swift.common import constraints
+from swift.common.swob import Response, HTTPException, HTTPOk, \
+    HTTPBadRequest, HTTPBadGateway, HTTPNotAcceptable, HTTPNotFound, \
+    HTTPLengthRequired, HTTPRequestEntityTooLarge, HTTPServerError, \
+    HTTPCreated, HTTPPreconditionFailed, \
+    RESPONSE_REASONS, wsgi_to_str, wsgi_quote, wsgi_unquote, str_to_wsgi, \
+    bytes_to_wsgi
+from swift.common.middleware.bulk import ACCEPTABLE_FORMATS, \
+    get_response_body, pax_key_to_swift_header
+from swift.common.utils import split_path, Timestamp, config_true_value
 from swift.common.header_key_dict import HeaderKeyDict
 from swift.common.exceptions import ChunkReadError
 
 from google.cloud import storage
-from google.cloud.exceptions import NotFound, Conflict
+from google.cloud.exceptions import NotFound, Conflict, PreconditionFailed
 from google.oauth2.service_account import Credentials
-from google.api_core.retry import Retry
+
+from eventlet import GreenPool, GreenPile
 
 from swift_cloud.drivers.base import BaseDriver
+from swift_cloud.drivers.batch import TolerantBatch, chunks
+from swift_cloud.drivers import purge
+from swift_cloud.drivers.listing import list_partitioned, PageTokenCache
+from swift_cloud.drivers import sharding
+from swift_cloud.drivers import versioning
+from swift_cloud.drivers.projection import ProjectedClient
+from swift_cloud.drivers.index import ListingIndex
+from swift_cloud.drivers.generations import GenerationCache
+from swift_cloud import context
 from swift_cloud.tools import SwiftCloudTools
+from swift_cloud.metrics import get_metrics, set_context
+from swift_cloud.retry import get_retry_policy
 from swift_cloud.decorators import cors_validation
+from swift_cloud.expirer import ExpirySweeper
 
 log = logging.getLogger(__name__)
 
@@ -32,8 +59,50 @@ RESERVED_META = [
     'x-history-location',
     'x-undelete-enabled',
     'x-container-sysmeta-undelete-enabled',
-    'content-encoding'
+    'content-encoding',
+    sharding.SHARD_COUNT_META
+]
+EXPIRATION_HEADERS = [
+    'x-delete-at',
+    'x-delete-after',
+    'x-remove-delete-at',
+    'x-remove-delete-after'
 ]
+EXPIRATION_RULE = {
+    'action': {'type': 'Delete'},
+    'condition': {'daysSinceCustomTime': 0}
+}
+
+# process-wide expiration state
+_sweeper = None
+_expiration_buckets = set()
+
+# GCS cursors of recently returned listing pages
+_page_tokens = None
+
+# node local listing index, when enabled
+_listing_index = None
+
+# generation and size of recently written objects
+_generations = None
+
+# conditional metadata patches tried before giving up on a hot resource
+METADATA_UPDATE_ATTEMPTS = 10
+
+# conditional uploads tried before giving up on a hot object
+UPLOAD_ATTEMPTS = 5
+
+
+def _is_trash_rule(rule):
+    """
+    Whether a lifecycle rule is the one expiring the trash of undelete
+    containers, the only rule on noncurrent objects by prefix.
+    """
+    condition = rule.get('condition') or {}
+    return rule.get('action') == {'type': 'Delete'} and \
+        condition.get('isLive') is False and \
+        'matchesPrefix' in condition and \
+        'daysSinceNoncurrentTime' in condition
 
 
 def is_object(blob):
@@ -54,6 +123,194 @@ def blobs_size(blob_list):
     return size
 
 
+def is_expired(blob, now=None):
+    metadata = blob.metadata or {}
+    delete_at = metadata.get('x-delete-at')
+
+    if not delete_at:
+        return False
+
+    try:
+        return int(float(delete_at)) <= (now or time.time())
+    except (TypeError, ValueError):
+        return False
+
+
+def patch(resource, **kwargs):
+    """
+    Sends the changed properties of a bucket or blob, retried under the
+    process-wide :class:`swift_cloud.retry.RetryPolicy`.
+    """
+    get_retry_policy().call(resource.patch, timeout=10, retry=None, **kwargs)
+
+
+def retried(func, *args, **kwargs):
+    """
+    Calls any other GCS mutation under the same policy. Callers pass
+    ``retry=None`` where the client supports it, so failures are not
+    retried twice.
+    """
+    return get_retry_policy().call(func, *args, **kwargs)
+
+
+def retried_delete(func, *args, **kwargs):
+    """
+    :func:`retried` for deletes. An attempt that timed out or failed
+    with a server error may still have deleted the object, so a retry
+    finding it gone counts as success; a first attempt raises NotFound.
+    """
+    attempts = []
+
+    def delete():
+        attempts.append(True)
+        try:
+            return func(*args, **kwargs)
+        except NotFound:
+            if len(attempts) == 1:
+                raise
+
+    delete.__name__ = getattr(func, '__name__', 'delete')
+    return retried(delete)
+
+
+def metadata_changes(current, values):
+    """
+    :returns: the keys of ``values`` that differ from ``current``, with
+              None for the keys ``values`` removed or set to None
+    """
+    def text(value):
+        return str(value) if isinstance(value, int) else value
+
+    changes = dict((key, None) for key in current if values.get(key) is None)
+
+    for key, value in values.items():
+        if value is not None and text(current.get(key)) != text(value):
+            changes[key] = value
+
+    return changes
+
+
+def update_metadata(resource, update, field='metadata'):
+    """
+    Read-modify-write of a blob's metadata or a bucket's labels.
+
+    ``update`` gets a copy of the current values and returns the new
+    ones; only the keys it changed are patched, on the condition that
+    the resource's metageneration did not move since it was read. When a
+    concurrent update wins, the resource is reloaded and ``update``
+    applied again to the fresh values.
+
+    :param field: ``'metadata'`` for blobs, ``'labels'`` for buckets
+    :returns: False when ``update`` changed nothing
+    """
+    for _ in range(METADATA_UPDATE_ATTEMPTS):
+        current = getattr(resource, field) or {}
+        values = update(dict(current))
+        changes = metadata_changes(current, values)
+
+        if not changes:
+            return False
+
+        if field == 'labels':
+            # the client sends bucket labels whole, removing the missing
+            # ones, so the precondition is what keeps this a merge
+            resource.labels = dict(
+                (key, value) for key, value in values.items()
+                if value is not None)
+        else:
+            resource.metadata = changes
+
+        try:
+            patch(resource, if_metageneration_match=resource.metageneration)
+            return True
+        except PreconditionFailed:
+            resource.reload(timeout=10)
+
+    raise PreconditionFailed(
+        'Too many concurrent updates to {}'.format(resource.name))
+
+
+def _add_counters(values, count, used):
+    values['object-count'] = max(0, int(values.get('object-count', 0)) + count)
+    values['bytes-used'] = max(0, int(values.get('bytes-used', 0)) + used)
+    return values
+
+
+def apply_counter_deltas(account_bucket, deltas, container_count=0):
+    """
+    Adds object count and bytes used deltas to the account labels and to
+    each container metadata, with a conditional patch of every resource.
+
+    :param deltas: list of ``(container_blob, count, bytes_used)`` tuples
+    :param container_count: delta for the account container count
+    """
+    def update_account(labels):
+        _add_counters(labels, sum(delta[1] for delta in deltas),
+                      sum(delta[2] for delta in deltas))
+        if container_count:
+            labels['container-count'] = max(
+                0, int(labels.get('container-count', 0)) + container_count)
+        return labels
+
+    update_metadata(account_bucket, update_account, 'labels')
+
+    for container_blob, count, used in deltas:
+        update_metadata(container_blob, functools.partial(
+            _add_counters, count=count, used=used))
+
+
+def update_counters(account_bucket,
+                    container_blob,
+                    bytes_used,
+                    has_obj,
+                    obj_size,
+                    remove=False):
+    if remove:
+        count = -1 if has_obj else 0
+        used = -bytes_used if has_obj else 0
+    else:
+        count = 1 if not has_obj else 0
+        used = bytes_used
+
+        if has_obj:
+            used = bytes_used - obj_size
+
+    apply_counter_deltas(account_bucket, [(container_blob, count, used)])
+
+
+def expire_object(client, account, container, obj_path, generation):
+    """
+    Deletes an expired object, unless it was overwritten or its deadline
+    changed since it was scheduled.
+    """
+    bucket = client.get_bucket(account, timeout=30)
+    blob = bucket.get_blob(obj_path)
+
+    if not blob or blob.generation != generation or not is_expired(blob):
+        return False
+
+    container_blob = bucket.get_blob(container + '/')
+
+    try:
+        retried_delete(blob.delete, if_generation_match=generation, retry=None)
+    except (NotFound, PreconditionFailed):
+        return False
+
+    if container_blob:
+        update_counters(bucket, container_blob, blob.size, True, blob.size,
+                        remove=True)
+
+    if _listing_index:
+        try:
+            _listing_index.delete(
+                account, container,
+                sharding.unshard_name(obj_path).split('/', 1)[1])
+        except Exception as err:
+            log.error(err)
+
+    return True
+
+
 class SwiftGCPDriver(BaseDriver):
 
     def __init__(self, req, app, conf):
@@ -62,6 +319,8 @@ class SwiftGCPDriver(BaseDriver):
         self.conf = conf
 
         self.max_results = int(conf.get('max_results'))
+        self.metrics = get_metrics(conf)
+        self.retry = get_retry_policy(conf)
         self.client = self._get_client()
 
         self.account = None
@@ -70,6 +329,50 @@ class SwiftGCPDriver(BaseDriver):
 
         self.tools = SwiftCloudTools(conf)
 
+        # 'expirer' registers deadlines on the swift-cloud-tools API,
+        # 'lifecycle' stores them in the blob custom time
+        self.expiration_mode = conf.get('expiration_mode', 'expirer')
+
+        self.bulk_max_deletes = int(
+            conf.get('bulk_max_deletes_per_request', 10000))
+        self.bulk_concurrency = int(conf.get('bulk_concurrency', 4))
+        self.bulk_yield_frequency = int(conf.get('bulk_yield_frequency', 10))
+        self.bulk_max_containers = int(
+            conf.get('bulk_max_containers_per_extraction', 10000))
+        self.bulk_max_failed_extractions = int(
+            conf.get('bulk_max_failed_extractions', 1000))
+        # larger archive members are streamed instead of buffered
+        self.bulk_buffer_size = int(conf.get('bulk_buffer_size', 1048576))
+
+        # recursive delete, requested with "X-Recursive-Delete: true"
+        self.purge_enabled = config_true_value(
+            conf.get('purge_enabled', 'false'))
+        self.purge_concurrency = int(conf.get('purge_concurrency', 4))
+        self.purge_rate = float(conf.get('purge_rate', 1000))
+        self.purge_save_interval = float(
+            conf.get('purge_save_interval', 10))
+
+        # whole listings page through key ranges concurrently
+        self.listing_partitions = int(conf.get('listing_partitions', 16))
+        # containers with fewer objects are listed with a single call
+        self.listing_partition_threshold = int(
+            conf.get('listing_partition_threshold', 100000))
+        self.listing_concurrency = int(conf.get('listing_concurrency', 8))
+
+        # containers with x-container-sharding spread objects over this
+        # many hashed prefixes
+        self.sharding_shards = int(conf.get('sharding_shards', 16))
+        # cleared when a listing finds objects the counters miss yet
+        self._sharding_changeable = True
+        # days deleted objects of undelete enabled containers are kept
+        self.undelete_retention_days = int(
+            conf.get('undelete_retention_days', 90))
+        self.sharding_cache_ttl = int(conf.get('sharding_cache_ttl', 60))
+
+        # delimiter listings answered from a local index when it is warm
+        self.listing_index = config_true_value(
+            conf.get('listing_index', 'false'))
+
         self.headers = {
             'Content-Type': 'text/html; charset=utf-8',
             'X-Timestamp': Timestamp.now().normal,
@@ -92,21 +395,44 @@ class SwiftGCPDriver(BaseDriver):
         self.container = container
         self.obj = obj
 
+        if account and self.req.method == 'PUT' and \
+                'extract-archive' in self.req.params:
+            aresp = self._is_authorized()
+            if aresp:
+                return aresp
+            return self._timed('bulk_upload', self.bulk_upload)
+
         if account and container and obj:
-            return self.handle_object()
+            return self._timed('object', self.handle_object)
         elif account and container:
-            return self.handle_container()
+            return self._timed('container', self.handle_container)
         elif account and not container and not obj:
-            return self.handle_account()
+            return self._timed('account', self.handle_account)
 
         return self._error_response(b'Invalid request path')
 
+    def _timed(self, handler, func):
+        set_context(self.req.method, handler)
+        start = time.time()
+        with self.metrics.tracer.span('driver.' + handler) as span:
+            resp = func()
+            status = getattr(resp, 'status_int', 'app')
+            if span:
+                span.attributes['http.status_code'] = status
+        self.metrics.record('driver', handler, status, start, trace=False)
+        return resp
+
     def _get_client(self):
         try:
             credentials_path = self.conf.get('gcp_credentials')
             credentials = Credentials.from_service_account_file(
                 credentials_path)
-            return storage.Client(credentials=credentials)
+            # partial responses holding only the blob fields the driver uses
+            if config_true_value(self.conf.get('fields_projection', 'true')):
+                client = ProjectedClient(credentials=credentials)
+            else:
+                client = storage.Client(credentials=credentials)
+            return self.metrics.instrument(client)
         except Exception as err:
             log.error(err)
             return None
@@ -171,9 +497,16 @@ class SwiftGCPDriver(BaseDriver):
         if self.req.method == 'HEAD':
             return self.head_account()
 
+        if self.req.method == 'GET' and 'purge-status' in self.req.params:
+            return self.purge_status()
+
         if self.req.method == 'GET':
             return self.get_account()
 
+        if self.req.method in ['POST', 'DELETE'] and \
+                'bulk-delete' in self.req.params:
+            return self.bulk_delete()
+
         if self.req.method in ['POST']:
             return self.post_account()
 
@@ -190,8 +523,7 @@ class SwiftGCPDriver(BaseDriver):
             bucket = self.client.create_bucket(
                 bucket_name, location=BUCKET_LOCATION)
             # bucket.iam_configuration.uniform_bucket_level_access_enabled = False
-            deadline = Retry(deadline=60)
-            bucket.patch(timeout=10, retry=deadline)
+            patch(bucket)
             return bucket
         except Exception as err:
             log.error(err)
@@ -226,12 +558,24 @@ class SwiftGCPDriver(BaseDriver):
 
         marker = self.req.params.get('marker')
         end_marker = self.req.params.get('end_marker')
-        limit = self.req.params.get('limit')
+        limit = constraints.ACCOUNT_LISTING_LIMIT
 
+        try:
+            if self.req.params.get('limit'):
+                limit = int(self.req.params['limit'])
+        except ValueError:
+            return self._error_response('Invalid limit.', 412)
+
+        if limit < 0 or limit > constraints.ACCOUNT_LISTING_LIMIT:
+            return self._error_response(
+                'Maximum limit is %d' % constraints.ACCOUNT_LISTING_LIMIT, 412)
+
+        # the whole page is requested from GCS in one listing call
         params = {
-            'prefix': '',
+            'prefix': self.prefix,
             'delimiter': '/',
-            'include_trailing_delimiter': True
+            'include_trailing_delimiter': True,
+            'max_results': limit + (1 if marker else 0)
         }
 
         if marker:
@@ -243,12 +587,17 @@ class SwiftGCPDriver(BaseDriver):
         containers = []
 
         try:
-            account_blobs = account_bucket.list_blobs(**params)
+            account_blobs, includes_marker = [], False
+            if limit:
+                account_blobs, includes_marker = self._list_page(
+                    account_bucket, params, marker,
+                    lambda blob: blob.name.replace('/', ''))
+
             for index, blob in enumerate(account_blobs):
-                if marker and index == 0:  # start_offset is inclusive
+                if includes_marker and index == 0:  # start_offset is inclusive
                     continue
                 containers.append(blob)
-                if limit and (len(containers) >= int(limit)):
+                if len(containers) >= limit:
                     break
         except Exception as err:
             log.error(err)
@@ -286,14 +635,7 @@ class SwiftGCPDriver(BaseDriver):
 
         return self._json_response(container_list, status, headers)
 
-    def post_account(self):
-        account_bucket = self._get_or_create_bucket(self.account)
-
-        if not account_bucket:
-            return self._error_response('Get Account Error.')
-
-        labels = account_bucket.labels
-
+    def _set_account_labels(self, labels):
         for item in self.req.headers.iteritems():
             key, value = item
             key = key.lower()
@@ -318,19 +660,33 @@ class SwiftGCPDriver(BaseDriver):
                     del labels[meta]
                 continue
 
-        account_bucket.labels = labels
-        deadline = Retry(deadline=60)
-        account_bucket.patch(timeout=10, retry=deadline)
+        return labels
+
+    def post_account(self):
+        account_bucket = self._get_or_create_bucket(self.account)
+
+        if not account_bucket:
+            return self._error_response('Get Account Error.')
+
+        update_metadata(account_bucket, self._set_account_labels, 'labels')
 
         return self._default_response('', 204)
 
     def delete_account(self):
+        if self._is_recursive_delete():
+            return self.purge()
+
         try:
             account_bucket = self.client.get_bucket(
                 self.account,
                 timeout=30
             )
-            account_bucket.delete()
+            try:
+                account_bucket.delete()
+            except Conflict:
+                if not self._delete_noncurrent(account_bucket):
+                    raise
+                account_bucket.delete()
         except NotFound:
             return self._default_response('Account not found.', 404)
         except Conflict:
@@ -338,6 +694,802 @@ class SwiftGCPDriver(BaseDriver):
 
         return self._default_response('', 204)
 
+    def _delete_noncurrent(self, bucket):
+        """
+        Deletes the noncurrent generations GCS keeps for the versions and
+        trash of an account without containers, which block the deletion
+        of its bucket.
+
+        :returns: False when the bucket still has live blobs
+        """
+        if not bucket.versioning_enabled or \
+                list(bucket.list_blobs(max_results=1)):
+            return False
+
+        for blobs in chunks(list(bucket.list_blobs(versions=True))):
+            with TolerantBatch(self.client):
+                for blob in blobs:
+                    bucket.delete_blob(blob.name, generation=blob.generation)
+
+        return True
+
+    def _is_recursive_delete(self):
+        return self.purge_enabled and config_true_value(
+            self.req.headers.get('X-Recursive-Delete', 'false'))
+
+    def purge(self):
+        try:
+            bucket = self.client.get_bucket(self.account, timeout=30)
+        except NotFound:
+            return self._default_response('Account not found.', 404)
+        except Exception as err:
+            log.error(err)
+            return self._error_response(err)
+
+        container_blob = None
+        if self.container:
+            container_blob = bucket.get_blob(self.container + '/')
+            if not container_blob:
+                return self._default_response('', 404)
+
+        # a job running in another process keeps saving its state
+        state = purge.load_state(bucket, self.account, self.container)
+        if state and state['status'] == 'running' and \
+                state.get('updated_at', 0) > \
+                time.time() - 3 * self.purge_save_interval:
+            local = purge.get_job(self.account, self.container)
+            if not local or local.status not in ('pending', 'running'):
+                return self._json_response(state, 202)
+
+        job = purge.PurgeJob(self.client, self.account, self.container,
+                             concurrency=self.purge_concurrency,
+                             rate=self.purge_rate,
+                             list_blobs=self._list_all,
+                             save_interval=self.purge_save_interval)
+        job = purge.start_job(job)
+
+        # the purge removes the trash too
+        if self._undelete_enabled(container_blob):
+            self._update_trash_rule(bucket, self.container, False)
+
+        index = self._index()
+        if index and self.container:
+            index.drop(self.account, self.container)
+
+        return self._json_response(job.to_dict(), 202)
+
+    def _list_all(self, bucket, prefix, object_count=None, **params):
+        """
+        Lists every blob under ``prefix``, through parallel key ranges
+        unless ``object_count`` is known to be below the threshold.
+        """
+        if object_count is not None and \
+                object_count < self.listing_partition_threshold:
+            return bucket.list_blobs(prefix=prefix, **params)
+
+        return list_partitioned(bucket, prefix,
+                                count=self.listing_partitions,
+                                concurrency=self.listing_concurrency,
+                                **params)
+
+    def _shards(self, bucket, container_blob=None):
+        """
+        Shard count of the current container, read from ``container_blob``
+        when given and from a short-lived cache otherwise.
+        """
+        if container_blob:
+            count = sharding.shard_count(container_blob.metadata)
+            sharding.set_count(self.account, self.container, count,
+                               self.sharding_cache_ttl)
+            return count
+
+        def load():
+            blob = bucket.get_blob(self.container + '/')
+            return sharding.shard_count(blob.metadata if blob else None)
+
+        return sharding.cached_shard_count(
+            self.account, self.container, load, self.sharding_cache_ttl)
+
+    def _get_object_blob(self, bucket):
+        """
+        Reads the current object at the path given by the cached shard
+        count. Another worker may have changed the count since, so on a
+        miss the count is read again from the container marker.
+        """
+        shards = self._shards(bucket)
+        blob = bucket.get_blob(self._obj_path(shards))
+
+        if blob is None:
+            count = self._shards(bucket, bucket.get_blob(self.container + '/'))
+            if count != shards:
+                blob = bucket.get_blob(self._obj_path(count))
+
+        return blob
+
+    def _container_empty(self, bucket):
+        prefix = self.container + '/'
+        for blob in bucket.list_blobs(prefix=prefix, max_results=2):
+            if blob.name != prefix:
+                return False
+        return True
+
+    def _index(self):
+        global _listing_index
+
+        if not self.listing_index:
+            return None
+
+        if _listing_index is None:
+            _listing_index = ListingIndex(
+                self.conf.get('listing_index_path',
+                              '/var/cache/swift/swift_cloud_index.db'),
+                max_age=int(self.conf.get('listing_index_max_age', 300)))
+
+        return _listing_index
+
+    def _list_container(self, bucket):
+        """
+        Full listing of the current container, with unsharded names, read
+        as it is consumed. Shards are listed one after the other, so the
+        blobs of sharded containers are not in name order.
+        """
+        prefix = self.container + '/'
+        shards = self._shards(bucket)
+
+        if not shards:
+            return self._list_all(bucket, prefix)
+
+        return (sharding.UnshardedBlob(blob) for shard in range(shards)
+                for blob in bucket.list_blobs(
+                    prefix=sharding.shard_prefix(self.container, shard)))
+
+    def _index_put(self, name, size, hash, content_type, last_modified):
+        index = self._index()
+        if not index:
+            return
+
+        try:
+            index.put(self.account, self.container, name, size, hash,
+                      content_type, last_modified)
+        except Exception as err:
+            log.error(err)
+
+    def _index_delete(self, name):
+        index = self._index()
+        if not index:
+            return
+
+        try:
+            index.delete(self.account, self.container, name)
+        except Exception as err:
+            log.error(err)
+
+    def _index_drop(self, container):
+        """
+        Forgets the indexed listing of a container changed in bulk; the
+        next listing is served from GCS and indexes it again.
+        """
+        index = self._index()
+        if not index:
+            return
+
+        try:
+            index.drop(self.account, container)
+        except Exception as err:
+            log.error(err)
+
+    def _list_page(self, bucket, params, marker, name_of=None):
+        """
+        Lists one page of ``params['max_results']`` blobs. A ``marker``
+        returned as the last name of a previous page continues its GCS
+        cursor; otherwise the listing seeks to ``start_offset`` and the
+        marker itself comes back first.
+
+        :returns: tuple of ``(blobs, includes_marker)``
+        """
+        global _page_tokens
+
+        if _page_tokens is None:
+            _page_tokens = PageTokenCache(
+                ttl=int(self.conf.get('page_token_ttl', 60)),
+                max_entries=int(self.conf.get('page_token_max_entries',
+                                              10000)))
+
+        memcache = self.req.environ.get('swift.cache')
+        listing = (self.account, params.get('prefix'),
+                   params.get('delimiter'), params.get('end_offset'))
+        params = dict(params)
+        token = None
+
+        if marker:
+            token = _page_tokens.get(listing, marker, memcache)
+
+        if token:
+            params.pop('start_offset', None)
+            params['page_token'] = token
+            params['max_results'] -= 1
+
+        iterator = bucket.list_blobs(**params)
+        blobs = list(iterator)
+
+        if blobs and iterator.next_page_token:
+            name = name_of(blobs[-1]) if name_of else blobs[-1].name
+            _page_tokens.set(listing, name, iterator.next_page_token,
+                             memcache)
+
+        return blobs, bool(marker and not token)
+
+    def _obj_path(self, shards=0):
+        return sharding.blob_name(self.container, self.obj, shards)
+
+    def purge_status(self):
+        """
+        State of the purge of the current account or container, from this
+        process or as saved by the process running it. A finished purge
+        removed what held its state, other processes answer 404.
+        """
+        job = purge.get_job(self.account, self.container)
+        if job:
+            return self._json_response(job.to_dict(), 200)
+
+        try:
+            bucket = self.client.get_bucket(self.account, timeout=30)
+            state = purge.load_state(bucket, self.account, self.container)
+        except NotFound:
+            return self._default_response('', 404)
+        except Exception as err:
+            log.error(err)
+            return self._error_response(err)
+
+        if not state:
+            return self._default_response('', 404)
+        return self._json_response(state, 200)
+
+    def _bulk_response(self, handler, *args):
+        try:
+            out_content_type = self.req.accept.best_match(ACCEPTABLE_FORMATS)
+        except ValueError:
+            out_content_type = None  # Ignore invalid header
+
+        resp = HTTPOk(request=self.req)
+        if out_content_type:
+            resp.content_type = out_content_type
+        resp.app_iter = handler(out_content_type, *args)
+        return resp
+
+    def _get_bulk_names(self):
+        max_path_length = constraints.MAX_OBJECT_NAME_LENGTH \
+            + constraints.MAX_CONTAINER_NAME_LENGTH + 2
+
+        if self.req.content_length is None and \
+                self.req.headers.get('transfer-encoding', '').lower() != 'chunked':
+            raise HTTPLengthRequired(request=self.req)
+
+        names = []
+        line = b''
+
+        while True:
+            data = self.req.body_file.read(max_path_length)
+            lines = (line + data).split(b'\n')
+            line = lines.pop()
+
+            if not data:
+                lines.append(line)
+
+            for item in lines:
+                name = wsgi_to_str(wsgi_unquote(bytes_to_wsgi(item.strip())))
+                if name:
+                    names.append(name)
+
+            if len(names) > self.bulk_max_deletes:
+                raise HTTPRequestEntityTooLarge(
+                    'Maximum Bulk Deletes: %d per request' %
+                    self.bulk_max_deletes)
+
+            if len(line) > max_path_length * 2:
+                raise HTTPBadRequest('Invalid File Name')
+
+            if not data:
+                return names
+
+    def _status_line(self, status):
+        reason = RESPONSE_REASONS.get(status, ('Unknown',))[0]
+        return '%d %s' % (status, reason)
+
+    def _bulk_delete_chunk(self, bucket, container_blob, container, shards,
+                           items):
+        """
+        Deletes up to one GCS batch worth of objects of a container, using
+        one batch request to fetch their metadata and another to delete
+        them. Objects are deleted as ``delete_object`` does in the
+        container's versioning mode: stack mode restores the previous
+        version of each object, one at a time, while history mode and
+        undelete keep the deleted objects as noncurrent generations.
+
+        :param items: list of ``(name, object name)`` tuples
+        :returns: dict with the deleted, restored and not found counts,
+                  bytes removed and failed names
+        """
+        result = {'deleted': 0, 'restored': 0, 'not_found': 0, 'bytes': 0,
+                  'errors': []}
+        blobs = [bucket.blob(sharding.blob_name(container, obj, shards))
+                 for _, obj in items]
+
+        with TolerantBatch(self.client) as batch:
+            for blob in blobs:
+                blob.reload()
+
+        found = []
+        for item, blob, status in zip(items, blobs, batch.statuses):
+            if status == 404:
+                result['not_found'] += 1
+            elif 200 <= status < 300:
+                found.append((item, blob))
+            else:
+                result['errors'].append(
+                    [wsgi_quote(str_to_wsgi(item[0])), self._status_line(status)])
+
+        def deleted(item, blob):
+            result['deleted'] += 1
+            result['bytes'] += blob.size or 0
+            self._generations().forget(self.account, blob.name)
+            metadata = blob.metadata or {}
+            if metadata.get('x-delete-at') and \
+                    self.expiration_mode != 'lifecycle':
+                self.tools.remove_delete_at(self.account, container, item[1])
+
+        mode = self._versioning_mode(container_blob)
+
+        if mode == versioning.STACK:
+            remaining = []
+            for item, blob in found:
+                try:
+                    restored = self._restore_previous(bucket, blob)
+                except PreconditionFailed:
+                    result['errors'].append(
+                        [wsgi_quote(str_to_wsgi(item[0])),
+                         self._status_line(409)])
+                    continue
+
+                if not restored:
+                    remaining.append((item, blob))
+                    continue
+
+                deleted(item, blob)
+                result['restored'] += 1
+                result['bytes'] -= restored.size or 0
+            found = remaining
+
+        if not found:
+            return result
+
+        archive = mode == versioning.HISTORY or \
+            (not mode and self._undelete_enabled(container_blob))
+
+        with TolerantBatch(self.client) as batch:
+            for _, blob in found:
+                if archive:
+                    # without a generation GCS keeps the object as noncurrent
+                    bucket.delete_blob(blob.name,
+                                       if_generation_match=blob.generation)
+                else:
+                    blob.delete(if_generation_match=blob.generation)
+
+        for (item, blob), status in zip(found, batch.statuses):
+            if status == 404:
+                result['not_found'] += 1
+            elif 200 <= status < 300:
+                deleted(item, blob)
+            else:
+                result['errors'].append(
+                    [wsgi_quote(str_to_wsgi(item[0])), self._status_line(status)])
+
+        return result
+
+    def _bulk_delete_container(self, bucket, container):
+        blob = bucket.get_blob(container + '/')
+        if not blob:
+            return 404
+
+        blobs = list(bucket.list_blobs(prefix=container + '/', max_results=2))
+        if len(blobs) > 1:
+            return 409
+
+        retried_delete(blob.delete, retry=None)
+        return 204
+
+    def bulk_delete(self):
+        return self._bulk_response(self._bulk_delete_iter)
+
+    def _bulk_delete_iter(self, out_content_type):
+        """
+        Swift bulk delete on top of GCS batch requests. Objects are grouped
+        by container and deleted up to 100 per batch, counters are updated
+        once at the end, and whitespace is yielded while the request is
+        processed, as the Swift bulk middleware does.
+        """
+        last_yield = time.time()
+        if out_content_type and out_content_type.endswith('/xml'):
+            to_yield = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        else:
+            to_yield = b' '
+        separator = b''
+        failed_files = []
+        failed_type = HTTPBadRequest
+        resp_dict = {'Response Status': HTTPOk().status,
+                     'Response Body': '',
+                     'Number Deleted': 0,
+                     'Number Not Found': 0}
+        self.req.environ['eventlet.minimum_write_chunk_size'] = 0
+
+        try:
+            if not out_content_type:
+                raise HTTPNotAcceptable(request=self.req)
+
+            incoming_format = self.req.headers.get('Content-Type')
+            if incoming_format and \
+                    not incoming_format.startswith('text/plain'):
+                raise HTTPNotAcceptable(request=self.req)
+
+            names = self._get_bulk_names()
+
+            try:
+                bucket = self.client.get_bucket(self.account, timeout=30)
+            except NotFound:
+                raise HTTPNotFound(request=self.req)
+
+            objects = collections.OrderedDict()
+            containers = []
+
+            for name in names:
+                container, _, obj = name.strip('/').partition('/')
+                if obj:
+                    objects.setdefault(container, []).append((name, obj))
+                elif container:
+                    containers.append((name, container))
+
+            deltas = []
+            pool = GreenPool(self.bulk_concurrency)
+
+            for container, items in objects.items():
+                container_blob = bucket.get_blob(container + '/')
+
+                if not container_blob:
+                    resp_dict['Number Not Found'] += len(items)
+                    continue
+
+                shards = sharding.shard_count(container_blob.metadata)
+                delete_chunk = context.propagate(functools.partial(
+                    self._bulk_delete_chunk, bucket, container_blob,
+                    container, shards))
+                count = used = deleted = 0
+
+                for result in pool.imap(delete_chunk, list(chunks(items))):
+                    resp_dict['Number Deleted'] += result['deleted']
+                    resp_dict['Number Not Found'] += result['not_found']
+                    failed_files.extend(result['errors'])
+                    count += result['deleted'] - result['restored']
+                    used += result['bytes']
+                    deleted += result['deleted']
+
+                    if last_yield + self.bulk_yield_frequency < time.time():
+                        last_yield = time.time()
+                        yield to_yield
+                        to_yield, separator = b' ', b'\r\n\r\n'
+
+                if count or used:
+                    deltas.append((container_blob, -count, -used))
+                if deleted:
+                    self._index_drop(container)
+
+            if deltas:
+                apply_counter_deltas(bucket, deltas)
+
+            removed = 0
+            for name, container in containers:
+                status = self._bulk_delete_container(bucket, container)
+                if status == 404:
+                    resp_dict['Number Not Found'] += 1
+                elif status == 204:
+                    resp_dict['Number Deleted'] += 1
+                    removed += 1
+                    self._index_drop(container)
+                else:
+                    failed_files.append(
+                        [wsgi_quote(str_to_wsgi(name)), self._status_line(status)])
+
+            if removed:
+                apply_counter_deltas(bucket, [], container_count=-removed)
+
+            if any(error[1].startswith('5') for error in failed_files):
+                failed_type = HTTPBadGateway
+
+            if failed_files:
+                resp_dict['Response Status'] = failed_type().status
+            elif not (resp_dict['Number Deleted'] or
+                      resp_dict['Number Not Found']):
+                resp_dict['Response Status'] = HTTPBadRequest().status
+                resp_dict['Response Body'] = 'Invalid bulk delete.'
+
+        except HTTPException as err:
+            resp_dict['Response Status'] = err.status
+            resp_dict['Response Body'] = err.body.decode('utf-8')
+        except Exception:
+            log.exception('Error in bulk delete.')
+            resp_dict['Response Status'] = HTTPServerError().status
+
+        yield separator + get_response_body(out_content_type,
+                                            resp_dict, failed_files, 'delete')
+
+    def _bulk_container(self, bucket, container):
+        """
+        Returns the marker blob of a container used by an extraction,
+        creating the container when it does not exist.
+
+        :returns: tuple of ``(container_blob, created)``
+        """
+        blob = bucket.get_blob(container + '/')
+        if blob:
+            return blob, False
+
+        blob = bucket.blob(container + '/')
+        blob.metadata = {'object-count': 0, 'bytes-used': 0}
+        retried(blob.upload_from_string,
+                '', content_type='application/directory;charset=UTF-8')
+        return blob, True
+
+    def _bulk_folder(self, bucket, container, path, shards=0):
+        folder = bucket.blob(sharding.blob_name(container, path + '/', shards))
+        try:
+            # existing markers are kept, overwriting them would leave
+            # noncurrent generations behind in versioned buckets
+            folder.upload_from_string('',
+                content_type='application/directory',
+                num_retries=3,
+                timeout=30,
+                if_generation_match=0
+            )
+        except PreconditionFailed:
+            pass
+
+    def _bulk_upload_member(self, bucket, container, obj_path, data,
+                            metadata, shards=0, size=None, versioned=False):
+        """
+        Uploads one archive member, given as bytes or, when ``size`` is
+        set, as a file object streamed from the archive. Buffered members
+        are uploaded only if the object does not exist yet, so new objects
+        cost a single call; overwrites, and streamed members which cannot
+        be sent twice, read the previous size to compute the counter delta.
+        Unless the container is ``versioned``, the overwritten generation
+        is deleted.
+
+        :returns: tuple of ``(obj_path, status, container, count, bytes)``
+        """
+        name = '{}/{}'.format(container, obj_path)
+        blob_name = sharding.blob_name(container, obj_path, shards)
+        content_type = mimetypes.guess_type(obj_path)[0]
+
+        blob = bucket.blob(blob_name)
+        if metadata:
+            blob.metadata = metadata
+
+        try:
+            if size is None:
+                size = len(data)
+                try:
+                    retried(blob.upload_from_string, data,
+                            content_type=content_type, if_generation_match=0)
+                    return name, 201, container, 1, size
+                except PreconditionFailed:
+                    pass
+
+            old_blob = bucket.get_blob(blob_name)
+            old_size = old_blob.size if old_blob else 0
+            if isinstance(data, bytes):
+                retried(blob.upload_from_string, data,
+                        content_type=content_type)
+            else:
+                blob.upload_from_file(data, size=size,
+                                      content_type=content_type)
+
+            if old_blob:
+                self._generations().forget(self.account, blob_name)
+                if bucket.versioning_enabled and not versioned:
+                    self._delete_generation(bucket, blob_name,
+                                            old_blob.generation)
+
+            return name, 201, container, 0 if old_blob else 1, \
+                size - old_size
+        except Exception as err:
+            log.error(err)
+            return name, getattr(err, 'code', None) or 500, container, 0, 0
+
+    def bulk_upload(self):
+        extract_type = self.req.params.get('extract-archive')
+        archive_type = {
+            'tar': '', 'tar.gz': 'gz',
+            'tar.bz2': 'bz2'}.get(extract_type.lower().strip('.'))
+
+        if archive_type is None:
+            return HTTPBadRequest('Unsupported archive format')
+
+        return self._bulk_response(self._bulk_upload_iter, archive_type)
+
+    def _bulk_upload_iter(self, out_content_type, compress_type):
+        """
+        Swift extract-archive on top of GCS. The archive is streamed from
+        the request body and its members up to ``bulk_buffer_size`` are
+        uploaded by a bounded pool of greenthreads; reading stops while the
+        pool is full. Larger members are streamed from the archive before
+        reading on. Containers and folder markers are created once, and
+        counters are updated once at the end with the aggregated delta,
+        also when the extraction stops early.
+        """
+        resp_dict = {'Response Status': HTTPCreated().status,
+                     'Response Body': '', 'Number Files Created': 0}
+        failed_files = []
+        last_yield = time.time()
+        if out_content_type and out_content_type.endswith('/xml'):
+            to_yield = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        else:
+            to_yield = b' '
+        separator = b''
+        self.req.environ['eventlet.minimum_write_chunk_size'] = 0
+
+        try:
+            if not out_content_type:
+                raise HTTPNotAcceptable(request=self.req)
+
+            if self.req.content_length is None and \
+                    self.req.headers.get('transfer-encoding',
+                                         '').lower() != 'chunked':
+                raise HTTPLengthRequired(request=self.req)
+
+            bucket = self._get_or_create_bucket(self.account)
+            if not bucket:
+                raise HTTPServerError(request=self.req)
+
+            extract_base = '/'.join(
+                [p for p in [self.container, self.obj] if p]).rstrip('/')
+            max_path_length = constraints.MAX_OBJECT_NAME_LENGTH \
+                + constraints.MAX_CONTAINER_NAME_LENGTH + 2
+
+            tar = tarfile.open(mode='r|' + compress_type,
+                               fileobj=self.req.body_file)
+            failed_response_type = HTTPBadRequest
+
+            containers = {}
+            folders = set()
+            containers_created = 0
+            pile = GreenPile(GreenPool(self.bulk_concurrency))
+            streamed = []
+            deltas = collections.defaultdict(lambda: [0, 0])
+
+            try:
+                while True:
+                    if last_yield + self.bulk_yield_frequency < time.time():
+                        last_yield = time.time()
+                        yield to_yield
+                        to_yield, separator = b' ', b'\r\n\r\n'
+
+                    tar_info = tar.next()
+                    if tar_info is None or \
+                            len(failed_files) >= self.bulk_max_failed_extractions:
+                        break
+
+                    if not tar_info.isfile():
+                        continue
+
+                    obj_path = tar_info.name
+                    if obj_path.startswith('./'):
+                        obj_path = obj_path[2:]
+                    obj_path = obj_path.lstrip('/')
+                    if extract_base:
+                        obj_path = extract_base + '/' + obj_path
+                    if '/' not in obj_path:
+                        continue  # ignore base level file
+
+                    quoted_path = wsgi_quote(obj_path[:max_path_length])
+                    container, _, obj = obj_path.partition('/')
+
+                    if not constraints.check_utf8(obj_path):
+                        failed_files.append(
+                            [quoted_path, HTTPPreconditionFailed().status])
+                        continue
+
+                    if tar_info.size > constraints.MAX_FILE_SIZE:
+                        failed_files.append(
+                            [quoted_path, HTTPRequestEntityTooLarge().status])
+                        continue
+
+                    if container not in containers:
+                        containers[container], created = self._bulk_container(
+                            bucket, container)
+                        if created:
+                            containers_created += 1
+                            if containers_created > self.bulk_max_containers:
+                                raise HTTPBadRequest(
+                                    'More than %d containers to create '
+                                    'from tar.' % self.bulk_max_containers)
+
+                    shards = sharding.shard_count(containers[container].metadata)
+                    versioned = bool(
+                        self._versioning_mode(containers[container]))
+                    path = ''
+                    for folder in obj.split('/')[:-1]:
+                        if not folder:
+                            continue
+                        path += folder
+                        if (container, path) not in folders:
+                            folders.add((container, path))
+                            pile.spawn(context.propagate(self._bulk_folder),
+                                       bucket, container, path, shards)
+                        path += '/'
+
+                    metadata = {}
+                    for pax_key, pax_value in tar_info.pax_headers.items():
+                        header_name = pax_key_to_swift_header(pax_key)
+                        if header_name and header_name.startswith('x-object-meta-'):
+                            metadata[header_name[len('x-object-meta-'):]] = \
+                                pax_value
+
+                    member = tar.extractfile(tar_info)
+                    if tar_info.size > self.bulk_buffer_size:
+                        # the archive is read on once the member is uploaded
+                        streamed.append(self._bulk_upload_member(
+                            bucket, container, obj, member, metadata, shards,
+                            tar_info.size, versioned))
+                    else:
+                        pile.spawn(context.propagate(self._bulk_upload_member),
+                                   bucket, container, obj, member.read(),
+                                   metadata, shards, None, versioned)
+
+            finally:
+                # members uploaded before an error are counted too
+                for result in itertools.chain(streamed, pile):
+                    if not result:
+                        continue  # folder marker
+                    name, status, container, count, used = result
+                    if 200 <= status < 300:
+                        resp_dict['Number Files Created'] += 1
+                        deltas[container][0] += count
+                        deltas[container][1] += used
+                    else:
+                        if status // 100 == 5:
+                            failed_response_type = HTTPBadGateway
+                        failed_files.append([
+                            wsgi_quote(name[:max_path_length]),
+                            self._status_line(status)])
+
+                for container in deltas:
+                    self._index_drop(container)
+
+                if deltas or containers_created:
+                    apply_counter_deltas(
+                        bucket,
+                        [(containers[c], d[0], d[1])
+                         for c, d in deltas.items()],
+                        container_count=containers_created)
+
+            if failed_files:
+                resp_dict['Response Status'] = failed_response_type().status
+            elif not resp_dict['Number Files Created']:
+                resp_dict['Response Status'] = HTTPBadRequest().status
+                resp_dict['Response Body'] = 'Invalid Tar File: No Valid Files'
+
+        except HTTPException as err:
+            resp_dict['Response Status'] = err.status
+            resp_dict['Response Body'] = err.body.decode('utf-8')
+        except (tarfile.TarError, zlib.error) as tar_error:
+            resp_dict['Response Status'] = HTTPBadRequest().status
+            resp_dict['Response Body'] = 'Invalid Tar File: %s' % tar_error
+        except Exception:
+            log.exception('Error in extract archive.')
+            resp_dict['Response Status'] = HTTPServerError().status
+
+        yield separator + get_response_body(
+            out_content_type, resp_dict, failed_files, 'extract')
+
     def handle_container(self):
         if self.req.method == 'OPTIONS':
             return self.options_container(self.req)
@@ -346,9 +1498,22 @@ class SwiftGCPDriver(BaseDriver):
         if aresp:
             return aresp
 
+        if versioning.versioned_container(self.container):
+            resp = self.handle_versions_container()
+            if resp is not None:
+                return resp
+
+        if versioning.trashed_container(self.container):
+            resp = self.handle_trash_container()
+            if resp is not None:
+                return resp
+
         if self.req.method == 'HEAD':
             return self.head_container(self.req)
 
+        if self.req.method == 'GET' and 'purge-status' in self.req.params:
+            return self.purge_status()
+
         if self.req.method == 'GET':
             return self.get_container(self.req)
 
@@ -380,18 +1545,91 @@ class SwiftGCPDriver(BaseDriver):
             log.error(err)
             return self._error_response(err)
 
-        headers = {}
-        if blob and blob.metadata:
-            for key, value in blob.metadata.items():
-                if key.lower() not in RESERVED_META:
-                    headers['X-Container-{}'.format(key)] = value
-                else:
-                    headers[key] = value
+        headers = self._container_headers(blob)
 
         return self._default_response('', 204, headers)
 
+    def _container_headers(self, blob):
+        metadata = dict(blob.metadata or {}) if blob else {}
+        location = metadata.pop(versioning.LOCATION_META, None)
+        mode = metadata.pop(versioning.MODE_META, None)
+
+        headers = {}
+        for key, value in metadata.items():
+            if key.lower() not in RESERVED_META:
+                headers['X-Container-{}'.format(key)] = value
+            else:
+                headers[key] = value
+
+        # GCS keeps versions and deleted objects, so neither
+        # versioned_writes nor undelete must see them
+        if self.req.environ.get('swift.source') in versioning.INFO_SOURCES:
+            headers.pop(versioning.SYSMETA_UNDELETE, None)
+            headers.pop(versioning.UNDELETE_META, None)
+        elif location:
+            if mode == versioning.HISTORY:
+                headers['X-History-Location'] = location
+            else:
+                headers['X-Versions-Location'] = location
+
+        return headers
+
+    def _get_indexed_container(self, req, bucket=None):
+        """
+        Answers a delimiter listing from the local index, or returns None
+        when the container is not indexed or its index is too old. Indexes
+        close to ``listing_index_max_age`` are refreshed in the background.
+        """
+        index = self._index()
+
+        try:
+            if not bucket:
+                bucket = self.client.get_bucket(self.account, timeout=30)
+
+            if index.needs_sync(self.account, self.container):
+                index.sync_async(self.account, self.container,
+                                 functools.partial(self._list_container,
+                                                   bucket))
+
+            if not index.is_warm(self.account, self.container):
+                return None
+
+            blob = bucket.get_blob(self.container + '/')
+            if not blob:
+                return None
+
+            # folder prefixes, as the GCS listing uses them
+            prefix = self.prefix
+            if prefix and not prefix.endswith('/'):
+                prefix += '/'
+
+            object_list = index.list(
+                self.account, self.container,
+                prefix=prefix,
+                delimiter=req.params.get('delimiter'),
+                marker=req.params.get('marker', ''),
+                end_marker=req.params.get('end_marker'),
+                limit=int(req.params.get('limit') or
+                          constraints.CONTAINER_LISTING_LIMIT))
+        except Exception as err:
+            log.error(err)
+            return None
+
+        headers = self._container_headers(blob)
+
+        if not object_list:
+            headers['Content-Length'] = 0
+            return self._json_response(None, 204, headers)
+
+        return self._json_response(object_list, 200, headers)
+
     @cors_validation
     def get_container(self, req, bucket=None, obj=None):
+        if req.params.get('delimiter') and self.listing_index:
+            resp = self._get_indexed_container(req, bucket)
+            if resp:
+                return resp
+
         marker = req.params.get('marker')
         end_marker = req.params.get('end_marker')
         limit = req.params.get('limit')
@@ -421,12 +1659,31 @@ class SwiftGCPDriver(BaseDriver):
             if not bucket:
                 bucket = self.client.get_bucket(self.account, timeout=30)
 
-            blobs = list(bucket.list_blobs(**params))
+            container_blob = bucket.get_blob(self.container + '/')
+            shards = self._shards(bucket, container_blob)
+            includes_marker = bool(marker)
+
+            if shards:
+                blobs = self._list_shards(bucket, shards, params, end_marker)
+                if limit:
+                    blobs = blobs[:int(limit) + (1 if marker else 0)]
+            elif limit:
+                blobs, includes_marker = self._list_page(
+                    bucket, params, marker)
+            else:
+                metadata = (container_blob.metadata if container_blob
+                            else None) or {}
+                blobs = list(self._list_all(
+                    bucket, object_count=int(
+                        metadata.get('object-count') or 0), **params))
 
-            if marker:
+            if includes_marker:
                 blobs = blobs[1:]  # start_offset is inclusive
 
-            blob = bucket.get_blob(prefix)
+            if prefix == self.container + '/':
+                blob = container_blob
+            else:
+                blob = bucket.get_blob(prefix)
 
             if blob:
                 level = len(blob.name.split('/')) - 1
@@ -462,14 +1719,7 @@ class SwiftGCPDriver(BaseDriver):
                     'last_modified': item.updated.isoformat()
                 })
 
-        headers = {}
-
-        if blob and blob.metadata:
-            for key, value in blob.metadata.items():
-                if key.lower() not in RESERVED_META:
-                    headers['X-Container-{}'.format(key)] = value
-                else:
-                    headers[key] = value
+        headers = self._container_headers(blob)
 
         status = 200
         if len(object_list) == 0:
@@ -479,8 +1729,122 @@ class SwiftGCPDriver(BaseDriver):
 
         return self._json_response(object_list, status, headers)
 
+    def _list_shards(self, bucket, shards, params, end_marker=None):
+        """
+        Lists every shard of the current container concurrently and merges
+        the results in name order, as one unsharded listing.
+        """
+        base = self.container + '/'
+
+        def list_shard(shard):
+            shard_prefix = sharding.shard_prefix(self.container, shard)
+            shard_params = dict(params)
+            shard_params['prefix'] = shard_prefix + params['prefix'][len(base):]
+            if params.get('start_offset'):
+                shard_params['start_offset'] = \
+                    shard_prefix + params['start_offset'][len(base):]
+            if end_marker:
+                shard_params['end_offset'] = shard_prefix + end_marker
+            return list(bucket.list_blobs(**shard_params))
+
+        pool = GreenPool(self.listing_concurrency)
+        listings = list(pool.imap(context.propagate(list_shard),
+                                  range(shards)))
+        return list(sharding.merge_listings(listings))
+
     def _set_container_metadata(self, blob):
+        return self._container_metadata(blob.metadata or {})
+
+    def _versioning_metadata(self, metadata):
+        """
+        Sets the versions location and mode from the client headers, or
+        from the sysmeta versioned_writes translates them to. The location
+        is always the virtual ``_version_<container>``.
+        """
+        headers = self.req.headers
+        location = headers.get(versioning.SYSMETA_LOCATION)
+        mode = headers.get(versioning.SYSMETA_MODE) or versioning.STACK
+
+        if location is None:
+            if headers.get('x-versions-location'):
+                location, mode = 'x', versioning.STACK
+            elif headers.get('x-history-location'):
+                location, mode = 'x', versioning.HISTORY
+            elif any(header in headers for header in (
+                    'x-versions-location', 'x-history-location',
+                    'x-remove-versions-location',
+                    'x-remove-history-location')):
+                location = ''
+
+        if location:
+            metadata[versioning.LOCATION_META] = \
+                versioning.versions_container(self.container)
+            metadata[versioning.MODE_META] = mode
+        elif location is not None:
+            metadata[versioning.LOCATION_META] = None
+            metadata[versioning.MODE_META] = None
+
+        return metadata
+
+    def _enable_versioning(self, bucket, blob):
+        """
+        Turns GCS object versioning on for the account bucket once one of
+        its containers is versioned or has undelete enabled, and expires
+        the trash of the latter.
+        """
         metadata = blob.metadata or {}
+        undelete = self._undelete_enabled(blob)
+
+        if undelete or any(header in self.req.headers for header in (
+                versioning.UNDELETE_META, versioning.SYSMETA_UNDELETE)):
+            self._update_trash_rule(bucket, self.container, undelete)
+
+        if not metadata.get(versioning.LOCATION_META) and not undelete:
+            return
+
+        if not bucket.versioning_enabled:
+            bucket.versioning_enabled = True
+            patch(bucket)
+
+    def _update_trash_rule(self, bucket, container, undelete):
+        """
+        Keeps a single lifecycle rule expiring the noncurrent objects of
+        the containers with undelete enabled, listed by prefix, so that
+        the bucket stays far below the GCS limit of 100 rules. Disabled
+        and deleted containers are dropped from it, as otherwise the
+        versions of a container later using versioned_writes under the
+        same name would expire, and the retention follows
+        ``undelete_retention_days``. Rules written one per container by
+        earlier versions are merged into it.
+        """
+        rules = [dict(rule) for rule in bucket.lifecycle_rules]
+        kept = [rule for rule in rules if not _is_trash_rule(rule)]
+        prefixes = set()
+
+        for rule in rules:
+            if _is_trash_rule(rule):
+                prefixes.update(rule['condition']['matchesPrefix'])
+
+        if undelete:
+            prefixes.add(container + '/')
+        else:
+            prefixes.discard(container + '/')
+
+        if prefixes and self.undelete_retention_days:
+            kept.append({
+                'action': {'type': 'Delete'},
+                'condition': {
+                    'isLive': False,
+                    'matchesPrefix': sorted(prefixes),
+                    'daysSinceNoncurrentTime': self.undelete_retention_days
+                }
+            })
+
+        if kept != rules:
+            bucket.lifecycle_rules = kept
+            patch(bucket)
+
+    def _container_metadata(self, metadata):
 
         if not metadata.get('object-count'):
             metadata['object-count'] = 0
@@ -515,15 +1879,6 @@ class SwiftGCPDriver(BaseDriver):
                     metadata["read"] = None
                 continue
 
-            if key == 'x-versions-location' or key == 'x-history-location':
-                metadata["x-versions-location"] = '_version_{}'.format(self.container)
-                continue
-
-            if key == 'x-remove-versions-location' or key == 'x-remove-history-location':
-                if metadata.get('x-versions-location'):
-                    metadata["x-versions-location"] = None
-                continue
-
             if key == 'x-undelete-enabled':
                 metadata["x-container-sysmeta-undelete-enabled"] = value
                 metadata["x-undelete-enabled"] = value
@@ -531,9 +1886,18 @@ class SwiftGCPDriver(BaseDriver):
 
             if key == 'x-container-sharding':
                 metadata["x-container-sharding"] = value
+                # the shard count only changes while the container is
+                # empty, existing objects are never moved
+                if not int(metadata.get('object-count') or 0) and \
+                        self._sharding_changeable:
+                    if config_true_value(value):
+                        metadata[sharding.SHARD_COUNT_META] = \
+                            self.sharding_shards
+                    else:
+                        metadata[sharding.SHARD_COUNT_META] = None
                 continue
 
-        return metadata
+        return self._versioning_metadata(metadata)
 
     @cors_validation
     def put_container(self, req, bucket=None, obj=None):
@@ -547,33 +1911,33 @@ class SwiftGCPDriver(BaseDriver):
             bucket = self.client.create_bucket(
                 self.account, location=BUCKET_LOCATION)
             # bucket.iam_configuration.uniform_bucket_level_access_enabled = False
-            deadline = Retry(deadline=60)
-            bucket.patch(timeout=10, retry=deadline)
+            patch(bucket)
         except Exception as err:
             log.error(err)
             return self._error_response(err)
 
         blob = bucket.get_blob(self.container + '/')
+        created = not blob
 
-        if not blob:
+        # an existing marker is only patched, uploading it again would
+        # leave a noncurrent generation behind in versioned buckets
+        if created:
             blob = bucket.blob(self.container + '/')
+            retried(blob.upload_from_string,
+                    '', content_type='application/directory;charset=UTF-8')
 
-        blob.upload_from_string(
-            '', content_type='application/directory;charset=UTF-8')
+        if 'x-container-sharding' in self.req.headers:
+            self._sharding_changeable = self._container_empty(bucket)
 
-        metadata = self._set_container_metadata(blob)
+        update_metadata(blob, self._container_metadata)
+        self._enable_versioning(bucket, blob)
+        self._shards(bucket, blob)
 
-        blob.metadata = metadata
-        deadline = Retry(deadline=60)
-        blob.patch(timeout=10, retry=deadline)
+        if not created:
+            return self._default_response('', 202)
 
         # updates account container count
-        labels = bucket.labels
-        container_count = int(labels.get('container-count', 0))
-        labels['container-count'] = container_count + 1
-        bucket.labels = labels
-        deadline = Retry(deadline=60)
-        bucket.patch(timeout=10, retry=deadline)
+        apply_counter_deltas(bucket, [], container_count=1)
 
         return self._default_response('', 201)
 
@@ -594,16 +1958,20 @@ class SwiftGCPDriver(BaseDriver):
         if not blob:
             return self._default_response('', 404)
 
-        metadata = self._set_container_metadata(blob)
+        if 'x-container-sharding' in self.req.headers:
+            self._sharding_changeable = self._container_empty(bucket)
 
-        blob.metadata = metadata
-        deadline = Retry(deadline=60)
-        blob.patch(timeout=10, retry=deadline)
+        update_metadata(blob, self._container_metadata)
+        self._enable_versioning(bucket, blob)
+        self._shards(bucket, blob)
 
         return self._default_response('', 204)
 
     @cors_validation
     def delete_container(self, req, bucket=None, obj=None):
+        if self._is_recursive_delete():
+            return self.purge()
+
         try:
             if not bucket:
                 bucket = self.client.get_bucket(
@@ -626,40 +1994,412 @@ class SwiftGCPDriver(BaseDriver):
         if len(blobs) > 1:
             return self._default_response('', 409)
 
-        blob.delete()
+        retried_delete(blob.delete, retry=None)
+
+        if self._undelete_enabled(blob):
+            self._update_trash_rule(bucket, self.container, False)
+
+        index = self._index()
+        if index:
+            index.drop(self.account, self.container)
 
         # updates account container count
-        labels = bucket.labels
-        container_count = int(labels.get('container-count', 0))
-        labels['container-count'] = max(0, container_count - 1)
-        bucket.labels = labels
-        deadline = Retry(deadline=60)
-        bucket.patch(timeout=10, retry=deadline)
+        apply_counter_deltas(bucket, [], container_count=-1)
 
         return self._default_response('', 204)
 
+    def handle_versions_container(self):
+        """
+        The virtual ``_version_<container>`` container: GET lists the
+        archived versions, PUT and POST are accepted so that clients
+        creating it before enabling versioning keep working.
+
+        :returns: None for regular containers with such a name, created
+                  before GCS versioning or without a ``<container>``,
+                  which are served as such
+        """
+        container = versioning.versioned_container(self.container)
+
+        try:
+            bucket = self.client.get_bucket(self.account, timeout=30)
+            if bucket.get_blob(self.container + '/'):
+                return None
+            container_blob = bucket.get_blob(container + '/')
+        except NotFound:
+            return self._default_response('', 404)
+        except Exception as err:
+            log.error(err)
+            return self._error_response(err)
+
+        if not container_blob:
+            return None
+
+        if self.req.method in ('PUT', 'POST'):
+            return self._default_response('', 202)
+
+        if self.req.method == 'HEAD':
+            return self._default_response('', 204)
+
+        if self.req.method == 'GET':
+            return self.get_versions(bucket, container_blob, container)
+
+        return self._default_response('', 405,
+                                      {'Allow': 'HEAD, GET, PUT, POST'})
+
+    def get_versions(self, bucket, container_blob, container):
+        """
+        Lists the noncurrent generations of the objects of ``container``
+        as a Swift versions container listing, ordered by version name.
+
+        Version names start with the length of the object name, so GCS
+        lists them in version name order only among objects of the same
+        name length. When the prefix sets that length, as the prefixes
+        versioned_writes lists with do, the prefix and markers are pushed
+        to GCS, once per shard of sharded containers, and listing stops
+        once the page is full. Other listings read every generation of
+        the container, keeping only the first ``limit`` names.
+        """
+        prefix = self.req.params.get('prefix', '')
+        marker = self.req.params.get('marker', '')
+        end_marker = self.req.params.get('end_marker')
+        limit = int(self.req.params.get('limit') or
+                    constraints.CONTAINER_LISTING_LIMIT)
+
+        shards = sharding.shard_count(container_blob.metadata)
+        if shards:
+            bases = [sharding.shard_prefix(container, shard)
+                     for shard in range(shards)]
+        else:
+            bases = [container + '/']
+
+        length = versioning.version_length(prefix)
+        marker_length = versioning.version_length(marker)
+        end_length = versioning.version_length(end_marker)
+
+        if length is not None and (
+                (marker_length is not None and marker_length > length) or
+                (end_length is not None and end_length < length)):
+            return self._json_response(None, 204, {'Content-Length': 0})
+
+        def list_versions(base):
+            params = {'prefix': base, 'versions': True}
+            if length is not None:
+                params['prefix'] = base + prefix[3:3 + length]
+                if marker_length == length:
+                    params['start_offset'] = base + marker[3:3 + length]
+                if end_length == length:
+                    obj = end_marker[3:3 + length]
+                    # the versions of the end marker object are listed
+                    params['end_offset'] = base + obj + \
+                        ('\x00' if len(obj) == length else '')
+
+            for blob in bucket.list_blobs(**params):
+                if not versioning.is_noncurrent(blob) or not is_object(blob):
+                    continue
+
+                name = versioning.version_name(blob.name[len(base):],
+                                               blob.generation)
+                if not name.startswith(prefix) or name <= marker or \
+                        (end_marker and name >= end_marker):
+                    continue
+                yield name, blob
+
+        def list_page(base):
+            if length is None:
+                return heapq.nsmallest(limit, list_versions(base),
+                                       key=lambda item: item[0])
+            # names come in order, the page is full
+            return list(itertools.islice(list_versions(base), limit))
+
+        versions = []
+        try:
+            pool = GreenPool(self.listing_concurrency)
+            for page in pool.imap(context.propagate(list_page), bases):
+                versions.extend(page)
+        except Exception as err:
+            log.error(err)
+            return self._error_response(err)
+
+        object_list = [{
+            'name': name,
+            'bytes': blob.size,
+            'hash': blob.md5_hash,
+            'content_type': blob.content_type,
+            'last_modified': blob.updated.isoformat()
+        } for name, blob in sorted(versions, key=lambda item: item[0])[:limit]]
+
+        if not object_list:
+            return self._json_response(None, 204, {'Content-Length': 0})
+
+        return self._json_response(object_list, 200)
+
+    def handle_version_object(self, bucket):
+        """
+        An archived version: GET and HEAD read the noncurrent generation
+        and DELETE removes it for good.
+
+        :returns: None for objects of regular containers with a versions
+                  container name, see :meth:`handle_versions_container`
+        """
+        container = versioning.versioned_container(self.container)
+
+        if bucket.get_blob(self.container + '/'):
+            return None
+
+        container_blob = bucket.get_blob(container + '/')
+        if not container_blob:
+            return None
+
+        parsed = versioning.parse_version_name(urllib.unquote(self.obj))
+        if not parsed:
+            return self._default_response('', 404)
+
+        obj, generation = parsed
+
+        name = sharding.blob_name(
+            container, obj, sharding.shard_count(container_blob.metadata))
+
+        if self.req.method == 'DELETE':
+            try:
+                retried_delete(bucket.delete_blob, name,
+                               generation=generation, retry=None)
+            except NotFound:
+                return self._default_response('', 404)
+            return self._default_response('', 204)
+
+        if self.req.method not in ('GET', 'HEAD'):
+            return self._default_response('', 405,
+                                          {'Allow': 'HEAD, GET, DELETE'})
+
+        blob = bucket.get_blob(name, generation=generation)
+        if not blob:
+            return self._default_response('', 404)
+
+        headers = self.get_object_headers(blob)
+        if self.req.method == 'HEAD':
+            return self._default_response('', 200, headers)
+
+        return self._default_response(blob.download_as_bytes(), 200, headers)
+
+    def handle_trash_container(self):
+        """
+        The virtual ``.trash-<container>`` container of an undelete
+        enabled container: GET lists the deleted objects, kept by GCS as
+        noncurrent generations.
+
+        :returns: None for trash containers undelete created as regular
+                  containers, which are served as such
+        """
+        container = versioning.trashed_container(self.container)
+
+        try:
+            bucket = self.client.get_bucket(self.account, timeout=30)
+            if bucket.get_blob(self.container + '/'):
+                return None
+            container_blob = bucket.get_blob(container + '/')
+        except NotFound:
+            return self._default_response('', 404)
+        except Exception as err:
+            log.error(err)
+            return self._error_response(err)
+
+        if self.req.method in ('PUT', 'POST'):
+            return self._default_response('', 202)
+
+        if not container_blob:
+            return self._default_response('', 404)
+
+        if self.req.method == 'HEAD':
+            return self._default_response('', 204)
+
+        if self.req.method == 'GET':
+            return self.get_trash(bucket, container_blob, container)
+
+        return self._default_response('', 405,
+                                      {'Allow': 'HEAD, GET, PUT, POST'})
+
+    def get_trash(self, bucket, container_blob, container):
+        """
+        Lists the newest noncurrent generation of each deleted object of
+        ``container``, under the object name. The prefix and markers are
+        pushed to GCS, once per shard of sharded containers.
+        """
+        prefix = self.req.params.get('prefix', '')
+        marker = self.req.params.get('marker', '')
+        end_marker = self.req.params.get('end_marker')
+        limit = int(self.req.params.get('limit') or
+                    constraints.CONTAINER_LISTING_LIMIT)
+
+        shards = sharding.shard_count(container_blob.metadata)
+        if shards:
+            bases = [sharding.shard_prefix(container, shard)
+                     for shard in range(shards)]
+        else:
+            bases = [container + '/']
+
+        def list_deleted(base):
+            params = {'prefix': base + prefix, 'versions': True}
+            if marker:
+                params['start_offset'] = base + marker
+            if end_marker:
+                params['end_offset'] = base + end_marker
+
+            deleted = {}
+            for blob in bucket.list_blobs(**params):
+                if not versioning.is_noncurrent(blob) or not is_object(blob):
+                    continue
+
+                name = blob.name[len(base):]
+                if name == marker:
+                    continue
+                # names come in order, the page is full
+                if name not in deleted and len(deleted) >= limit:
+                    break
+
+                current = deleted.get(name)
+                if not current or blob.generation > current.generation:
+                    deleted[name] = blob
+            return deleted
+
+        deleted = {}
+        try:
+            pool = GreenPool(self.listing_concurrency)
+            for listing in pool.imap(context.propagate(list_deleted), bases):
+                deleted.update(listing)
+        except Exception as err:
+            log.error(err)
+            return self._error_response(err)
+
+        object_list = [{
+            'name': name,
+            'bytes': deleted[name].size,
+            'hash': deleted[name].md5_hash,
+            'content_type': deleted[name].content_type,
+            'last_modified': deleted[name].time_deleted.isoformat()
+        } for name in sorted(deleted)[:limit]]
+
+        if not object_list:
+            return self._json_response(None, 204, {'Content-Length': 0})
+
+        return self._json_response(object_list, 200)
+
+    def handle_trash_object(self, bucket):
+        """
+        A deleted object: GET and HEAD read its newest noncurrent
+        generation, POST restores it and DELETE purges it for good.
+
+        :returns: None for objects of trash containers undelete created
+                  as regular containers
+        """
+        container = versioning.trashed_container(self.container)
+
+        if bucket.get_blob(self.container + '/'):
+            return None
+
+        container_blob = bucket.get_blob(container + '/')
+        if not container_blob:
+            return self._default_response('', 404)
+
+        # from here on the request acts on the trashed container
+        self.container = container
+        self.obj = urllib.unquote(self.obj)
+        name = self._obj_path(self._shards(bucket, container_blob))
+
+        versions = self._noncurrent_versions(bucket, name)
+        if not versions:
+            return self._default_response('', 404)
+
+        deleted = versions[-1]
+
+        if self.req.method == 'POST':
+            return self.restore_object(bucket, container_blob, deleted)
+
+        if self.req.method == 'DELETE':
+            for version in versions:
+                self._delete_generation(bucket, name, version.generation)
+            return self._default_response('', 204)
+
+        if self.req.method not in ('GET', 'HEAD'):
+            return self._default_response('', 405,
+                                          {'Allow': 'HEAD, GET, POST, DELETE'})
+
+        headers = self.get_object_headers(deleted)
+        if self.req.method == 'HEAD':
+            return self._default_response('', 200, headers)
+
+        return self._default_response(deleted.download_as_bytes(), 200,
+                                      headers)
+
+    def restore_object(self, bucket, container_blob, deleted):
+        """
+        Undeletes an object by copying its noncurrent generation back
+        within GCS, unless the object was created again meanwhile.
+        """
+        try:
+            restored = retried(
+                bucket.copy_blob, deleted, bucket, deleted.name,
+                source_generation=deleted.generation,
+                if_generation_match=0, retry=None)
+        except PreconditionFailed:
+            return self._default_response('', 409)
+
+        self._delete_generation(bucket, deleted.name, deleted.generation)
+        self._generations().set(self.account, restored.name,
+                                restored.generation, restored.size)
+
+        self._update_counters(bucket, container_blob, restored.size, False, 0)
+        self._index_put(self.obj, restored.size, restored.md5_hash,
+                        restored.content_type, restored.updated.isoformat())
+
+        return self._default_response('', 201)
+
     def handle_object(self):
         if self.req.method == 'OPTIONS':
             return self.options_object(self.req)
 
+        bucket = None
+        versions = versioning.versioned_container(self.container)
+        trash = versioning.trashed_container(self.container)
+
+        if versions or trash:
+            aresp = self._is_authorized()
+            if aresp:
+                return aresp
+
+            # read once, the regular object path below reuses it
+            try:
+                bucket = self.client.get_bucket(self.account, timeout=30)
+            except NotFound:
+                return self._default_response('', 404)
+            except Exception as err:
+                log.error(err)
+                return self._error_response(err)
+
+            if versions:
+                resp = self.handle_version_object(bucket)
+            else:
+                resp = self.handle_trash_object(bucket)
+            if resp is not None:
+                return resp
+
         if self.req.method == 'HEAD':
-            return self.head_object(self.req)
+            return self.head_object(self.req, bucket)
 
         if self.req.method == 'GET':
-            return self.get_object(self.req)
+            return self.get_object(self.req, bucket)
 
         aresp = self._is_authorized()
         if aresp:
             return aresp
 
         if self.req.method == 'PUT':
-            return self.put_object(self.req)
+            return self.put_object(self.req, bucket)
 
         if self.req.method == 'POST':
-            return self.post_object(self.req)
+            return self.post_object(self.req, bucket)
 
         if self.req.method == 'DELETE':
-            return self.delete_object(self.req)
+            return self.delete_object(self.req, bucket)
 
     def get_object_headers(self, blob):
         headers = {
@@ -741,12 +2481,14 @@ class SwiftGCPDriver(BaseDriver):
             )
 
         self.obj = urllib.unquote(self.obj)
-        obj_path = "{}/{}".format(self.container, self.obj)
-        blob = bucket.get_blob(obj_path)
+        blob = self._get_object_blob(bucket)
 
-        if not blob or not blob.exists():
+        if not blob or not blob.exists() or is_expired(blob):
             return self._default_response('', 404)
 
+        self._generations().set(self.account, blob.name, blob.generation,
+                                blob.size)
+
         metadata = blob.metadata or {}
         read = metadata.get('read')
 
@@ -782,10 +2524,10 @@ class SwiftGCPDriver(BaseDriver):
                 return self._default_response('', 401)
 
         self.obj = urllib.unquote(self.obj)
-        obj_path = "%s/%s" % (self.container, self.obj)
+        obj_path = self._obj_path(self._shards(bucket, blob))
         blob = bucket.get_blob(obj_path)
 
-        if not blob or not blob.exists():
+        if not blob or not blob.exists() or is_expired(blob):
             return self._default_response('', 404)
 
         headers = self.get_object_headers(blob)
@@ -793,6 +2535,104 @@ class SwiftGCPDriver(BaseDriver):
         return self._default_response(
             blob.download_as_bytes(), 200, headers)
 
+    def _expiration_deadline(self):
+        delete_at = self.req.headers.get('x-delete-at')
+        delete_after = self.req.headers.get('x-delete-after')
+
+        try:
+            if delete_after:
+                return True, int(time.time()) + int(delete_after)
+            if delete_at:
+                return True, int(float(delete_at))
+        except ValueError:
+            return False, None
+
+        return True, None
+
+    def _ensure_expiration_rule(self, bucket):
+        if bucket.name in _expiration_buckets:
+            return
+
+        rules = list(bucket.lifecycle_rules)
+
+        if EXPIRATION_RULE not in [dict(rule) for rule in rules]:
+            rules.append(EXPIRATION_RULE)
+            bucket.lifecycle_rules = rules
+            patch(bucket)
+
+        _expiration_buckets.add(bucket.name)
+
+    def _schedule_expiration(self, blob, delete_at):
+        global _sweeper
+
+        if _sweeper is None:
+            _sweeper = ExpirySweeper(
+                functools.partial(expire_object, self.client),
+                horizon=int(self.conf.get('expiration_sweep_horizon', 86400)),
+                max_entries=int(self.conf.get('expiration_sweep_max_entries',
+                                              100000)))
+
+        _sweeper.schedule(delete_at, self.account, self.container, blob.name,
+                          blob.generation)
+
+    def update_custom_time(self, bucket, blob):
+        """
+        Lifecycle expiration mode: stores the deadline as ``x-delete-at``
+        metadata and as the blob custom time, which the bucket lifecycle
+        rule uses to delete the object.
+
+        GCS only lets the custom time move forward, so clearing it or moving
+        it back on an existing object rewrites the object onto itself.
+        """
+        remove = (self.req.headers.get('x-delete-at') == ''
+                  or self.req.headers.get('x-delete-after') == ''
+                  or self.req.headers.get('x-remove-delete-at')
+                  or self.req.headers.get('x-remove-delete-after'))
+
+        result, delete_at = self._expiration_deadline()
+
+        if not result:
+            return False, blob
+
+        metadata = blob.metadata or {}
+
+        if 'x-delete-after' in metadata:
+            metadata['x-delete-after'] = None
+
+        if remove:
+            custom_time = None
+            metadata['x-delete-at'] = None
+        elif delete_at:
+            custom_time = datetime.datetime.utcfromtimestamp(delete_at)
+            metadata['x-delete-at'] = str(delete_at)
+            self._ensure_expiration_rule(bucket)
+        else:
+            return True, blob
+
+        current = blob.custom_time
+        blob.metadata = metadata
+        blob.custom_time = custom_time
+
+        if blob.generation and current:
+            current = current.replace(tzinfo=None)
+            if not custom_time or custom_time < current:
+                previous = blob.generation
+                token, _, _ = retried(blob.rewrite, blob, retry=None)
+                while token:
+                    token, _, _ = retried(blob.rewrite, blob, token=token,
+                                          retry=None)
+
+                # the rewritten generation is no version of the object
+                if bucket.versioning_enabled:
+                    self._delete_generation(bucket, blob.name, previous)
+                self._generations().set(self.account, blob.name,
+                                        blob.generation, blob.size)
+
+        if blob.generation and delete_at and not remove:
+            self._schedule_expiration(blob, delete_at)
+
+        return True, blob
+
     def update_delete_at(self, blob):
         result = True
         delete_at = self.req.headers.get('x-delete-at')
@@ -854,52 +2694,112 @@ class SwiftGCPDriver(BaseDriver):
                          has_obj,
                          obj_size,
                          remove=False):
-        labels = account_bucket.labels or {}
-        metadata = container_blob.metadata or {}
-
-        account_obj_count = int(labels.get('object-count', 0))
-        account_bytes_used = int(labels.get('bytes-used', 0))
-        container_obj_count = int(metadata.get('object-count', 0))
-        container_bytes_used = int(metadata.get('bytes-used', 0))
-
-        if remove:
-            count = 1 if has_obj else 0
-            used = bytes_used if has_obj else 0
-
-            labels['object-count'] = max(0, account_obj_count - count)
-            labels['bytes-used'] = max(0, account_bytes_used - used)
-            metadata['object-count'] = max(0, container_obj_count - count)
-            metadata['bytes-used'] = max(0, container_bytes_used - used)
-        else:
-            count = 1 if not has_obj else 0
-            used = bytes_used
-
-            if has_obj:
-                used = bytes_used - obj_size
-
-            labels['object-count'] = account_obj_count + count
-            labels['bytes-used'] = account_bytes_used + used
-            metadata['object-count'] = container_obj_count + count
-            metadata['bytes-used'] = container_bytes_used + used
-
-        account_bucket.labels = labels
-        container_blob.metadata = metadata
-
-        while True:
-            try:
-                deadline = Retry(deadline=60)
-                account_bucket.patch(timeout=10, retry=deadline)
-                break
-            except Conflict:
-                time.sleep(5)
+        update_counters(account_bucket, container_blob, bytes_used, has_obj,
+                        obj_size, remove=remove)
+
+    def _versioning_mode(self, container_blob):
+        """
+        :returns: versioning mode of a container, None when unversioned
+        """
+        metadata = (container_blob.metadata if container_blob else None) or {}
+        if not metadata.get(versioning.LOCATION_META):
+            return None
+        return metadata.get(versioning.MODE_META) or versioning.STACK
+
+    def _undelete_enabled(self, container_blob):
+        metadata = (container_blob.metadata if container_blob else None) or {}
+        return config_true_value(metadata.get(versioning.UNDELETE_META))
+
+    def _noncurrent_versions(self, bucket, name):
+        """
+        :returns: noncurrent generations of a blob, oldest first
+        """
+        versions = [version for version in
+                    bucket.list_blobs(prefix=name, versions=True)
+                    if version.name == name and
+                    versioning.is_noncurrent(version)]
+        return sorted(versions, key=lambda version: version.generation)
+
+    def _delete_generation(self, bucket, name, generation):
+        try:
+            retried_delete(bucket.delete_blob, name,
+                           generation=generation, retry=None)
+        except NotFound:
+            pass
+
+    def _restore_previous(self, bucket, blob):
+        """
+        Stack mode DELETE: replaces the object with its newest noncurrent
+        generation, copied within GCS, and removes both from the archive.
+
+        :returns: the restored blob, or None when there is no version
+        :raises PreconditionFailed: the object changed meanwhile
+        """
+        versions = self._noncurrent_versions(bucket, blob.name)
+        if not versions:
+            return None
 
-        while True:
+        previous = versions[-1]
+        restored = retried(
+            bucket.copy_blob, previous, bucket, blob.name,
+            source_generation=previous.generation,
+            if_generation_match=blob.generation, retry=None)
+
+        # the copy archived the deleted generation, neither is kept
+        self._delete_generation(bucket, blob.name, blob.generation)
+        self._delete_generation(bucket, blob.name, previous.generation)
+        return restored
+
+    def _generations(self):
+        global _generations
+
+        if _generations is None:
+            _generations = GenerationCache(int(
+                self.conf.get('generation_cache_entries', 100000)))
+        return _generations
+
+    def _upload_object(self, bucket, blob, data, content_type):
+        """
+        Uploads an object with a generation precondition, which tells
+        whether it overwrote an object: the upload is conditional on the
+        generation cached for the object or, on a cache miss, on the one
+        read before sending the body. ``If-None-Match: *`` uploads are
+        conditional on the object not existing. When the object changed
+        meanwhile, its generation is read again and the upload retried.
+
+        :returns: tuple of ``(generation, size)`` of the overwritten
+                  object, or None when the upload created it
+        :raises PreconditionFailed: the object exists and the request
+                                    has ``If-None-Match: *``
+        """
+        def read_current():
+            old_blob = bucket.get_blob(blob.name)
+            return (old_blob.generation, old_blob.size) if old_blob else None
+
+        generations = self._generations()
+        create_only = self.req.headers.get('If-None-Match') == '*'
+        current = None
+        if not create_only:
+            current = generations.get(self.account, blob.name) or \
+                read_current()
+
+        for _ in range(UPLOAD_ATTEMPTS):
             try:
-                deadline = Retry(deadline=60)
-                container_blob.patch(timeout=10, retry=deadline)
-                break
-            except Conflict:
-                time.sleep(5)
+                retried(blob.upload_from_string,
+                        data, content_type=content_type,
+                        if_generation_match=current[0] if current else 0)
+                generations.set(self.account, blob.name, blob.generation,
+                                len(data))
+                return current
+            except PreconditionFailed:
+                generations.forget(self.account, blob.name)
+                if create_only:
+                    raise
+
+            current = read_current()
+
+        raise PreconditionFailed(
+            'Too many concurrent uploads to {}'.format(blob.name))
 
     @cors_validation
     def put_object(self, req, bucket=None, obj=None):
@@ -915,24 +2815,20 @@ class SwiftGCPDriver(BaseDriver):
             return self._default_response('The resource could not be found', 404)
 
         self.obj = urllib.unquote(self.obj)
-        obj_path = "{}/{}".format(self.container, self.obj)
+        shards = self._shards(bucket, container_blob)
+        obj_path = self._obj_path(shards)
         blob = bucket.blob(obj_path)
         content_type = self.req.headers.get('Content-Type')
         delete_at = self.req.headers.get('x-delete-at')
         delete_after = self.req.headers.get('x-delete-after')
 
-        has_obj = False
-        obj_size = 0
-        has_blob = bucket.get_blob(obj_path)
-
-        if has_blob and has_blob.exists():
-            has_obj = True
-            obj_size = has_blob.size
-
         _, blob = self.update_object_headers(blob)
 
         if delete_at or delete_after:
-            delete_at_result, blob = self.update_delete_at(blob)
+            if self.expiration_mode == 'lifecycle':
+                delete_at_result, blob = self.update_custom_time(bucket, blob)
+            else:
+                delete_at_result, blob = self.update_delete_at(blob)
             if not delete_at_result:
                 return self._error_response('X-Delete Error')
 
@@ -953,7 +2849,7 @@ class SwiftGCPDriver(BaseDriver):
             obj_data += chunk
 
         objs =  self.obj.split('/')
-        path = self.container
+        path = ''
 
         is_folder = len(obj_data) == 0
 
@@ -963,13 +2859,21 @@ class SwiftGCPDriver(BaseDriver):
         for obj in objs:
             if not obj:
                 continue
-            path += '/' + obj
-            folder = bucket.blob(path + '/')
-            folder.upload_from_string('',
-                content_type='application/directory',
-                num_retries=3,
-                timeout=30
-            )
+            path += obj + '/'
+            folder = bucket.blob(
+                sharding.blob_name(self.container, path, shards))
+            try:
+                # see _bulk_folder
+                folder.upload_from_string('',
+                    content_type='application/directory',
+                    num_retries=3,
+                    timeout=30,
+                    if_generation_match=0
+                )
+            except PreconditionFailed:
+                continue
+            self._index_put(path, 0, folder.md5_hash, folder.content_type,
+                            folder.updated.isoformat())
 
         if is_folder:
             headers = {
@@ -981,20 +2885,39 @@ class SwiftGCPDriver(BaseDriver):
         if not content_type:
             content_type = mimetypes.guess_type(req.path)[0]
 
-        blob.upload_from_string(obj_data, content_type=content_type)
+        try:
+            previous = self._upload_object(bucket, blob, obj_data,
+                                           content_type)
+        except PreconditionFailed:
+            return self._default_response('', 412)
+
+        has_obj = previous is not None
+        obj_size = previous[1] if has_obj else 0
+
+        # only versioned containers keep overwritten generations
+        if has_obj and bucket.versioning_enabled and \
+                not self._versioning_mode(container_blob):
+            self._delete_generation(bucket, blob.name, previous[0])
+
+        if self.expiration_mode == 'lifecycle' and blob.custom_time:
+            _, delete_at = self._expiration_deadline()
+            if delete_at:
+                self._schedule_expiration(blob, delete_at)
 
         if blob.content_encoding:
             metadata = blob.metadata or {}
             metadata['Content-Encoding'] = blob.content_encoding
             blob.content_encoding = None
             blob.metadata = metadata
-            deadline = Retry(deadline=60)
-            blob.patch(timeout=10, retry=deadline)
+            patch(blob)
 
         headers = self.get_object_headers(blob)
         headers['Content-Length'] = 0
 
-        self._update_counters(bucket, container_blob, len(obj_data), has_obj, obj_size)
+        self._update_counters(bucket, container_blob, len(obj_data), has_obj,
+                              obj_size)
+        self._index_put(self.obj, len(obj_data), blob.md5_hash,
+                        blob.content_type, blob.updated.isoformat())
 
         return self._default_response('', 201, headers)
 
@@ -1007,22 +2930,29 @@ class SwiftGCPDriver(BaseDriver):
             )
 
         self.obj = urllib.unquote(self.obj)
-        obj_path = "{}/{}".format(self.container, self.obj)
-        blob = bucket.get_blob(obj_path)
+        blob = self._get_object_blob(bucket)
 
-        if not blob or not blob.exists():
+        if not blob:
             return self._default_response('', 404)
 
+        metadata = blob.metadata or {}
         updated, blob = self.update_object_headers(blob)
 
-        delete_at_result, blob = self.update_delete_at(blob)
+        if self.expiration_mode == 'lifecycle':
+            delete_at_result, blob = self.update_custom_time(bucket, blob)
+            updated = updated or any(
+                h in self.req.headers for h in EXPIRATION_HEADERS)
+        else:
+            delete_at_result, blob = self.update_delete_at(blob)
 
         if not delete_at_result:
             return self._error_response('X-Delete Error')
 
         if updated:
-            deadline = Retry(deadline=60)
-            blob.patch(timeout=10, retry=deadline)
+            # only the changed keys are sent and GCS merges them, so keys
+            # set by concurrent requests are kept
+            blob.metadata = metadata_changes(metadata, blob.metadata or {})
+            patch(blob)
 
         return self._default_response('', 202)  # Accepted
 
@@ -1035,9 +2965,9 @@ class SwiftGCPDriver(BaseDriver):
             )
 
         self.obj = urllib.unquote(self.obj)
-        obj_path = "{}/{}".format(self.container, self.obj)
 
         container_blob = bucket.get_blob(self.container + '/')
+        obj_path = self._obj_path(self._shards(bucket, container_blob))
         blob = bucket.get_blob(obj_path)
 
         if not blob or not blob.exists():
@@ -1049,15 +2979,38 @@ class SwiftGCPDriver(BaseDriver):
         headers = self.get_object_headers(blob)
         delete_at = headers.get('x-delete-at')
 
-        if delete_at:
+        if delete_at and self.expiration_mode != 'lifecycle':
             result, msg = self.tools.remove_delete_at(
                 self.account, self.container, self.obj)
 
             if not result:
                 return self._error_response(msg)
 
-        blob.delete()
+        self._generations().forget(self.account, blob.name)
+        mode = self._versioning_mode(container_blob)
+
+        if mode == versioning.STACK:
+            try:
+                restored = self._restore_previous(bucket, blob)
+            except PreconditionFailed:
+                return self._default_response('', 409)
+
+            if restored:
+                self._update_counters(bucket, container_blob, restored.size,
+                                      True, blob.size)
+                self._index_put(self.obj, restored.size, restored.md5_hash,
+                                restored.content_type,
+                                restored.updated.isoformat())
+                return self._default_response('', 204)
+
+        if mode == versioning.HISTORY or \
+                (not mode and self._undelete_enabled(container_blob)):
+            # without a generation GCS keeps the object as noncurrent
+            retried_delete(bucket.delete_blob, blob.name, retry=None)
+        else:
+            retried_delete(blob.delete, retry=None)
 
         self._update_counters(bucket, container_blob, blob.size, has_obj, obj_size, remove=True)
+        self._index_delete(self.obj)
 
         return self._default_response('', 204)
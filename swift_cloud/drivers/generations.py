@@ -0,0 +1,41 @@
+import threading
+import collections
+
+
+class GenerationCache:
+    """
+    In-process LRU of the generation and size of objects this worker
+    recently wrote or read, keyed by account and blob name.
+
+    Entries are only hints: a PUT uploads with the cached generation as
+    precondition, so a stale entry costs a retry, never a wrong counter.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, account, name):
+        """
+        :returns: tuple of ``(generation, size)`` or None
+        """
+        with self.lock:
+            entry = self.entries.pop((account, name), None)
+            if entry:
+                self.entries[(account, name)] = entry
+            return entry
+
+    def set(self, account, name, generation, size):
+        if not generation:
+            return
+
+        with self.lock:
+            self.entries.pop((account, name), None)
+            self.entries[(account, name)] = (generation, size)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def forget(self, account, name):
+        with self.lock:
+            self.entries.pop((account, name), None)
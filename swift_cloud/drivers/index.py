@@ -0,0 +1,253 @@
+import os
+import time
+import logging
+import sqlite3
+import itertools
+import contextlib
+import threading
+
+import six
+
+from swift.common.utils import mkdirs
+
+log = logging.getLogger(__name__)
+
+# listed blobs written to SQLite at once while syncing a container
+SYNC_CHUNK_SIZE = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS object (
+    account TEXT NOT NULL,
+    container TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    hash TEXT,
+    content_type TEXT,
+    last_modified TEXT,
+    PRIMARY KEY (account, container, name)
+);
+CREATE TABLE IF NOT EXISTS container_sync (
+    account TEXT NOT NULL,
+    container TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (account, container)
+);
+'''
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class ListingIndex:
+    """
+    Node local SQLite mirror of container listings.
+
+    A container is indexed once a full GCS listing of it was loaded with
+    ``sync``; from then on the driver's own PUTs and DELETEs keep it
+    current, and it is considered warm for ``max_age`` seconds after the
+    last sync. Changes made through other nodes are only picked up by the
+    next sync, so ``max_age`` bounds how stale a local listing can be.
+    """
+
+    def __init__(self, path, max_age=300, timeout=10):
+        self.path = path
+        self.max_age = max_age
+        self.timeout = timeout
+        self.syncing = set()
+        self.lock = threading.Lock()
+
+        mkdirs(os.path.dirname(path))
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def synced_at(self, account, container):
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT synced_at FROM container_sync '
+                'WHERE account = ? AND container = ?',
+                (_text(account), _text(container))).fetchone()
+        return row[0] if row else None
+
+    def is_warm(self, account, container):
+        synced_at = self.synced_at(account, container)
+        return bool(synced_at) and time.time() - synced_at < self.max_age
+
+    def needs_sync(self, account, container):
+        """
+        True when a container is not indexed or is past half its
+        ``max_age``, so it can be refreshed before it goes cold.
+        """
+        synced_at = self.synced_at(account, container)
+        return not synced_at or time.time() - synced_at > self.max_age / 2.0
+
+    def sync(self, account, container, blobs, started_at=None):
+        """
+        Replaces the indexed listing of a container with ``blobs``, the
+        result of a full GCS listing started at ``started_at``.
+
+        Rows are written ``SYNC_CHUNK_SIZE`` at a time to a temporary
+        table while the listing is read, then swapped in at the end of
+        the same transaction, so neither the listing is held in memory
+        nor the index locked for writes while GCS is listed.
+        """
+        account, container = _text(account), _text(container)
+        prefix = container + u'/'
+
+        def rows():
+            for blob in blobs:
+                name = _text(blob.name)[len(prefix):]
+                if not name:
+                    continue  # container marker
+                yield (name, blob.size, blob.md5_hash, blob.content_type,
+                       blob.updated.isoformat())
+
+        with self._connect() as conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS listing ('
+                         'name TEXT PRIMARY KEY, size INTEGER, hash TEXT, '
+                         'content_type TEXT, last_modified TEXT)')
+
+            listing = rows()
+            while True:
+                chunk = list(itertools.islice(listing, SYNC_CHUNK_SIZE))
+                if not chunk:
+                    break
+                conn.executemany('INSERT OR REPLACE INTO temp.listing '
+                                 'VALUES (?, ?, ?, ?, ?)', chunk)
+
+            conn.execute('DELETE FROM object WHERE account = ? AND '
+                         'container = ?', (account, container))
+            conn.execute('INSERT INTO object SELECT ?, ?, name, size, hash, '
+                         'content_type, last_modified FROM temp.listing',
+                         (account, container))
+            conn.execute('INSERT OR REPLACE INTO container_sync '
+                         'VALUES (?, ?, ?)',
+                         (account, container, started_at or time.time()))
+
+    def sync_async(self, account, container, list_blobs):
+        """
+        Runs ``sync`` with the result of ``list_blobs()`` in a background
+        thread, unless that container is already being synced.
+        """
+        key = (account, container)
+
+        with self.lock:
+            if key in self.syncing:
+                return False
+            self.syncing.add(key)
+
+        def run():
+            try:
+                started_at = time.time()
+                self.sync(account, container, list_blobs(), started_at)
+            except Exception:
+                log.exception('Error indexing %s/%s', account, container)
+            finally:
+                with self.lock:
+                    self.syncing.discard(key)
+
+        thread = threading.Thread(target=run, name='swift-cloud-index')
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def put(self, account, container, name, size, hash, content_type,
+            last_modified):
+        account, container = _text(account), _text(container)
+
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO object '
+                'SELECT ?, ?, ?, ?, ?, ?, ? FROM container_sync '
+                'WHERE account = ? AND container = ?',
+                (account, container, _text(name), size, hash, content_type,
+                 last_modified, account, container))
+
+    def delete(self, account, container, name):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM object WHERE account = ? AND '
+                         'container = ? AND name = ?',
+                         (_text(account), _text(container), _text(name)))
+
+    def drop(self, account, container):
+        account, container = _text(account), _text(container)
+
+        with self._connect() as conn:
+            conn.execute('DELETE FROM object WHERE account = ? AND '
+                         'container = ?', (account, container))
+            conn.execute('DELETE FROM container_sync WHERE account = ? AND '
+                         'container = ?', (account, container))
+
+    def list(self, account, container, prefix='', delimiter=None,
+             marker='', end_marker=None, limit=10000):
+        """
+        Container listing in Swift format, with ``subdir`` entries for
+        names rolled up by ``delimiter``.
+        """
+        account, container = _text(account), _text(container)
+        prefix, delimiter = _text(prefix) or u'', _text(delimiter)
+        orig_marker = marker = _text(marker) or u''
+        end_marker = _text(end_marker)
+        results = []
+
+        with self._connect() as conn:
+            while len(results) < limit:
+                query = ('SELECT name, size, hash, content_type, '
+                         'last_modified FROM object WHERE account = ? AND '
+                         'container = ? AND name > ?')
+                args = [account, container, marker]
+                if prefix:
+                    query += ' AND name >= ?'
+                    args.append(prefix)
+                if end_marker:
+                    query += ' AND name < ?'
+                    args.append(end_marker)
+                query += ' ORDER BY name LIMIT ?'
+                args.append(limit - len(results))
+
+                rows = conn.execute(query, args).fetchall()
+                if not rows:
+                    break
+
+                for name, size, hash, content_type, last_modified in rows:
+                    marker = name
+
+                    if not name.startswith(prefix):
+                        return results
+
+                    if delimiter:
+                        end = name.find(delimiter, len(prefix))
+                        if end >= 0:
+                            subdir = name[:end + len(delimiter)]
+                            if subdir != orig_marker:
+                                results.append({'subdir': subdir})
+                            # continue after everything under subdir
+                            marker = subdir[:-1] + six.unichr(
+                                ord(subdir[-1]) + 1)
+                            break
+
+                    results.append({
+                        'name': name,
+                        'bytes': size,
+                        'hash': hash,
+                        'content_type': content_type,
+                        'last_modified': last_modified
+                    })
+
+                    if len(results) >= limit:
+                        break
+
+        return results
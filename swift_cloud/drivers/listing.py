@@ -0,0 +1,165 @@
+import json
+import time
+import hashlib
+import threading
+import collections
+
+from eventlet import GreenPool
+
+from swift_cloud import context
+
+# characters object names commonly start with, in GCS (byte) order; range
+# boundaries are picked from them so partitions get similar shares of keys
+BOUNDARY_CHARS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+def partitions(prefix, count, start_offset=None, end_offset=None):
+    """
+    Splits the names under ``prefix`` into at most ``count`` contiguous
+    ``(start_offset, end_offset)`` ranges, clipped to the given offsets.
+    ``None`` means the range is open on that side.
+    """
+    step = float(len(BOUNDARY_CHARS)) / max(count, 1)
+    boundaries = sorted(set(
+        prefix + BOUNDARY_CHARS[int(i * step)] for i in range(1, count)))
+
+    ranges = []
+    lower = None
+
+    for upper in boundaries + [None]:
+        start, end = lower, upper
+        lower = upper
+
+        if start_offset is not None and (start is None or start < start_offset):
+            start = start_offset
+        if end_offset is not None and (end is None or end > end_offset):
+            end = end_offset
+        if start is not None and end is not None and start >= end:
+            continue
+
+        ranges.append((start, end))
+
+    return ranges or [(start_offset, end_offset)]
+
+
+def _list_range(bucket, params, start, end):
+    params = dict(params)
+    if start is not None:
+        params['start_offset'] = start
+    if end is not None:
+        params['end_offset'] = end
+    return list(bucket.list_blobs(**params))
+
+
+def list_partitioned(bucket, prefix, count=16, concurrency=8,
+                     start_offset=None, end_offset=None, **params):
+    """
+    Lists the blobs under ``prefix`` like ``bucket.list_blobs`` would, but
+    pages through ``count`` key ranges concurrently. Blobs are yielded in
+    name order; ranges are listed ahead of the consumer as far as
+    ``concurrency`` allows.
+    """
+    params['prefix'] = prefix
+    ranges = partitions(prefix, count, start_offset, end_offset)
+
+    if len(ranges) == 1 or concurrency <= 1:
+        start, end = ranges[0][0], ranges[-1][1]
+        for blob in _list_range(bucket, params, start, end):
+            yield blob
+        return
+
+    pool = GreenPool(concurrency)
+    pages = pool.imap(
+        context.propagate(lambda r: _list_range(bucket, params, *r)), ranges)
+
+    for page in pages:
+        for blob in page:
+            yield blob
+
+
+def _usage_range(bucket, params, start, end, predicate, throttle=None):
+    count = size = 0
+    params = dict(params)
+    if start is not None:
+        params['start_offset'] = start
+    if end is not None:
+        params['end_offset'] = end
+
+    for blob in bucket.list_blobs(**params):
+        if throttle:
+            throttle()
+        if predicate(blob):
+            count += 1
+            size += blob.size or 0
+
+    return count, size
+
+
+def usage_partitioned(bucket, prefix, predicate, count=16, concurrency=8,
+                      throttle=None):
+    """
+    Returns the number and total size of blobs under ``prefix`` matching
+    ``predicate``, summing key ranges concurrently without keeping the
+    listing in memory. ``throttle`` is called once per listed blob.
+    """
+    ranges = partitions(prefix, count)
+    pool = GreenPool(max(concurrency, 1))
+    totals = pool.imap(context.propagate(
+        lambda r: _usage_range(bucket, {'prefix': prefix}, r[0], r[1],
+                               predicate, throttle)), ranges)
+
+    object_count = bytes_used = 0
+    for count, size in totals:
+        object_count += count
+        bytes_used += size
+
+    return object_count, bytes_used
+
+
+class PageTokenCache:
+    """
+    Short-lived map from the last name returned by a listing page to the
+    GCS ``nextPageToken`` that continues it, so the next marker request
+    resumes the GCS cursor instead of seeking with ``start_offset``.
+
+    Entries are kept in memcache when the proxy has one (``swift.cache``)
+    and in a small in-process LRU otherwise.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _key(self, listing, name):
+        data = json.dumps([list(listing), name])
+        return 'swift_cloud/page_token/' + \
+            hashlib.md5(data.encode('utf-8')).hexdigest()
+
+    def get(self, listing, name, memcache=None):
+        key = self._key(listing, name)
+
+        if memcache:
+            return memcache.get(key)
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry and entry[1] > time.time():
+                self.entries[key] = entry
+                return entry[0]
+
+        return None
+
+    def set(self, listing, name, token, memcache=None):
+        key = self._key(listing, name)
+
+        if memcache:
+            memcache.set(key, token, time=self.ttl)
+            return
+
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (token, time.time() + self.ttl)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,86 @@
+from google.cloud import storage
+from google.cloud.exceptions import NotFound
+from google.cloud.storage.blob import Blob
+from google.cloud.storage.bucket import Bucket
+from google.cloud.storage.constants import _DEFAULT_TIMEOUT
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+# blob properties the driver reads; everything else (ACLs, owner, links,
+# checksums other than md5, ...) is left out of GCS responses
+BLOB_FIELDS = ','.join([
+    'name',
+    'bucket',
+    'generation',
+    'metageneration',
+    'size',
+    'md5Hash',
+    'etag',
+    'contentType',
+    'contentEncoding',
+    'contentDisposition',
+    'cacheControl',
+    'updated',
+    'timeDeleted',
+    'customTime',
+    'metadata'
+])
+LIST_FIELDS = 'items({}),prefixes,nextPageToken'.format(BLOB_FIELDS)
+
+
+class ProjectedBlob(Blob):
+    """
+    Blob whose metadata requests ask GCS for ``fields`` only.
+    """
+
+    fields = None
+
+    @property
+    def _query_params(self):
+        params = super(ProjectedBlob, self)._query_params
+        if self.fields:
+            params['fields'] = self.fields
+        return params
+
+
+class ProjectedBucket(Bucket):
+    """
+    Bucket that applies partial response projections to ``get_blob`` and
+    ``list_blobs``, unless the caller passes its own ``fields``.
+    """
+
+    def get_blob(self, blob_name, client=None, encryption_key=None,
+                 generation=None, timeout=_DEFAULT_TIMEOUT,
+                 retry=DEFAULT_RETRY, fields=BLOB_FIELDS, **kwargs):
+        blob = ProjectedBlob(bucket=self, name=blob_name,
+                             encryption_key=encryption_key,
+                             generation=generation)
+        blob.fields = fields
+
+        try:
+            blob.reload(client=client, timeout=timeout, retry=retry, **kwargs)
+        except NotFound:
+            return None
+        finally:
+            blob.fields = None
+
+        return blob
+
+    def list_blobs(self, *args, **kwargs):
+        if kwargs.get('fields') is None:
+            kwargs['fields'] = LIST_FIELDS
+        return super(ProjectedBucket, self).list_blobs(*args, **kwargs)
+
+
+class ProjectedClient(storage.Client):
+    """
+    Storage client handing out :class:`ProjectedBucket` instances.
+    """
+
+    def _bucket_arg_to_bucket(self, bucket_or_name):
+        if isinstance(bucket_or_name, Bucket):
+            return bucket_or_name
+        return ProjectedBucket(self, name=bucket_or_name)
+
+    def bucket(self, bucket_name, user_project=None):
+        return ProjectedBucket(client=self, name=bucket_name,
+                               user_project=user_project)
@@ -0,0 +1,265 @@
+import time
+import json
+import logging
+import threading
+
+from eventlet import GreenPool
+
+from swift.common.utils import ratelimit_sleep
+
+from swift_cloud.drivers.batch import TolerantBatch, chunks, MAX_BATCH_SIZE
+
+log = logging.getLogger(__name__)
+
+# purge jobs of this process, by (account, container)
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+# where jobs save their state for the other processes: the container
+# marker metadata, or the account bucket labels
+STATE_META = 'purge-job'
+STATUS_LABEL = 'purge-status'
+DELETED_LABEL = 'purge-deleted'
+UPDATED_LABEL = 'purge-updated'
+
+
+def get_job(account, container=None):
+    return _jobs.get((account, container))
+
+
+def load_state(bucket, account, container=None):
+    """
+    Reads the state saved by a purge job run by any process.
+
+    :returns: a dict like :meth:`PurgeJob.to_dict`, or None
+    """
+    if container:
+        marker = bucket.get_blob(container + '/')
+        metadata = (marker.metadata if marker else None) or {}
+        try:
+            return json.loads(metadata[STATE_META])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    labels = bucket.labels or {}
+    if not labels.get(STATUS_LABEL):
+        return None
+
+    return {
+        'account': account,
+        'container': None,
+        'status': labels[STATUS_LABEL],
+        'deleted': int(labels.get(DELETED_LABEL) or 0),
+        'updated_at': int(labels.get(UPDATED_LABEL) or 0)
+    }
+
+
+def start_job(job):
+    """
+    Starts ``job`` unless a job for the same account and container is
+    already running, in which case the running one is returned.
+    """
+    key = (job.account, job.container)
+
+    with _jobs_lock:
+        current = _jobs.get(key)
+        if current and current.status in ('pending', 'running'):
+            return current
+        _jobs[key] = job
+
+    thread = threading.Thread(target=job.run, name='swift-cloud-purge')
+    thread.daemon = True
+    thread.start()
+    return job
+
+
+class PurgeJob:
+    """
+    Recursive delete of a container, or of a whole account when
+    ``container`` is None.
+
+    Blobs are enumerated by prefix and deleted in GCS batches, several
+    batches at a time, limited to ``rate`` deletes per second. Container
+    markers are removed only after everything under them is gone; counters
+    are reconciled once when the job finishes.
+    """
+
+    def __init__(self, client, account, container=None, concurrency=4,
+                 rate=1000, list_blobs=None, save_interval=10):
+        self.client = client
+        self.account = account
+        self.container = container
+        self.concurrency = concurrency
+        self.rate = rate
+        self.list_blobs = list_blobs
+        self.save_interval = save_interval
+        self.saved_at = 0
+
+        self.status = 'pending'
+        self.error = None
+        self.listed = 0
+        self.deleted = 0
+        self.not_found = 0
+        self.failed = 0
+        self.bytes_deleted = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'account': self.account,
+            'container': self.container,
+            'status': self.status,
+            'error': self.error,
+            'listed': self.listed,
+            'deleted': self.deleted,
+            'not_found': self.not_found,
+            'failed': self.failed,
+            'bytes_deleted': self.bytes_deleted,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'updated_at': int(time.time())
+        }
+
+    def save(self, bucket, force=False):
+        """
+        Saves the job state where :func:`load_state` finds it, at most
+        once every ``save_interval`` seconds unless ``force`` is set.
+        Once done, the marker or bucket holding it is gone.
+        """
+        if not force and time.time() - self.saved_at < self.save_interval:
+            return
+        self.saved_at = time.time()
+
+        # gcp imports this module
+        from swift_cloud.drivers.gcp import patch, update_metadata
+
+        def update(labels):
+            labels[STATUS_LABEL] = self.status
+            labels[DELETED_LABEL] = str(self.deleted)
+            labels[UPDATED_LABEL] = str(int(time.time()))
+            return labels
+
+        try:
+            if self.container:
+                marker = bucket.blob(self.container + '/')
+                # metadata keys are merged, counters are left alone
+                marker.metadata = {STATE_META: json.dumps(self.to_dict())}
+                patch(marker)
+            else:
+                # the counters the labels hold move while purging
+                update_metadata(bucket, update, 'labels')
+        except Exception as err:
+            log.warning('Error saving purge state of %s/%s: %s',
+                        self.account, self.container, err)
+
+    def _delete_batch(self, bucket, blobs):
+        # explicit generations, so versioned buckets keep nothing
+        with TolerantBatch(self.client) as batch:
+            for blob in blobs:
+                bucket.delete_blob(blob.name, generation=blob.generation)
+
+        for blob, status in zip(blobs, batch.statuses):
+            if 200 <= status < 300:
+                if getattr(blob, 'time_deleted', None) is None:
+                    self.deleted += 1
+                    self.bytes_deleted += blob.size or 0
+            elif status == 404:
+                self.not_found += 1
+            else:
+                self.failed += 1
+
+    def _batches(self, bucket, prefix, markers):
+        running_time = 0
+        batch = []
+
+        # noncurrent generations too, left by versions and the trash
+        params = {'versions': True} if bucket.versioning_enabled else {}
+        if self.list_blobs:
+            blobs = self.list_blobs(bucket, prefix, **params)
+        else:
+            blobs = bucket.list_blobs(prefix=prefix, **params)
+
+        for blob in blobs:
+            self.listed += 1
+
+            if blob.name.endswith('/') and blob.name.count('/') == 1:
+                markers.append(blob)  # container marker, deleted last
+                continue
+
+            batch.append(blob)
+            if len(batch) >= MAX_BATCH_SIZE:
+                running_time = ratelimit_sleep(running_time, self.rate,
+                                               incr_by=len(batch))
+                yield batch
+                batch = []
+
+        if batch:
+            running_time = ratelimit_sleep(running_time, self.rate,
+                                           incr_by=len(batch))
+            yield batch
+
+    def _reconcile(self, bucket):
+        # gcp imports this module
+        from swift_cloud.drivers.gcp import update_metadata
+
+        containers = bucket.list_blobs(prefix='', delimiter='/',
+                                       include_trailing_delimiter=True)
+        container_count = object_count = bytes_used = 0
+
+        for blob in containers:
+            if not blob.name.endswith('/'):
+                continue
+            metadata = blob.metadata or {}
+            container_count += 1
+            object_count += int(metadata.get('object-count', 0))
+            bytes_used += int(metadata.get('bytes-used', 0))
+
+        def update(labels):
+            labels['container-count'] = container_count
+            labels['object-count'] = object_count
+            labels['bytes-used'] = bytes_used
+            return labels
+
+        update_metadata(bucket, update, 'labels')
+
+    def run(self):
+        self.status = 'running'
+        self.started_at = time.time()
+        bucket = None
+
+        try:
+            bucket = self.client.get_bucket(self.account, timeout=30)
+            prefix = self.container + '/' if self.container else ''
+            markers = []
+            pool = GreenPool(self.concurrency)
+
+            self.save(bucket, force=True)
+
+            for blobs in self._batches(bucket, prefix, markers):
+                pool.spawn_n(self._delete_batch, bucket, blobs)
+                self.save(bucket)
+            pool.waitall()
+
+            if self.failed:
+                raise Exception('{} objects could not be deleted'.format(
+                    self.failed))
+
+            for blobs in chunks(markers):
+                self._delete_batch(bucket, blobs)
+
+            if self.container:
+                self._reconcile(bucket)
+            else:
+                bucket.delete()
+
+            self.status = 'done'
+        except Exception as err:
+            log.exception('Error purging %s/%s', self.account, self.container)
+            self.status = 'failed'
+            self.error = str(err)
+        finally:
+            self.finished_at = time.time()
+
+        if self.status == 'failed' and bucket:
+            self.save(bucket, force=True)
@@ -0,0 +1,118 @@
+import time
+import heapq
+import hashlib
+
+# objects of a sharded container live under <container>/.shard-XX/<object>
+SHARD_PREFIX = '.shard-'
+SHARD_COUNT_META = 'x-container-shard-count'
+
+# shard counts of recently seen containers, by (account, container)
+_counts = {}
+
+
+def shard_count(metadata):
+    """
+    Number of shards of a container, 0 when it is not sharded. The count
+    is fixed when sharding is enabled on an empty container, so routing
+    never changes for existing objects.
+    """
+    metadata = metadata or {}
+    try:
+        return int(metadata.get(SHARD_COUNT_META) or 0)
+    except ValueError:
+        return 0
+
+
+def cached_shard_count(account, container, load, ttl=60):
+    """
+    Returns the shard count of a container, calling ``load`` to read it
+    from the container marker at most once every ``ttl`` seconds.
+    """
+    key = (account, container)
+    entry = _counts.get(key)
+    now = time.time()
+
+    if entry and entry[1] > now:
+        return entry[0]
+
+    count = load()
+    _counts[key] = (count, now + ttl)
+    return count
+
+
+def set_count(account, container, count, ttl=60):
+    """
+    Caches the shard count of a container just read from its marker.
+    """
+    _counts[(account, container)] = (count, time.time() + ttl)
+
+
+def forget(account, container):
+    _counts.pop((account, container), None)
+
+
+def shard_of(obj, shards):
+    if isinstance(obj, type(u'')):
+        obj = obj.encode('utf-8')
+    return int(hashlib.md5(obj).hexdigest()[:8], 16) % shards
+
+
+def shard_prefix(container, shard):
+    return '{}/{}{:02x}/'.format(container, SHARD_PREFIX, shard)
+
+
+def blob_name(container, obj, shards=0):
+    """
+    GCS name of an object; objects of sharded containers are spread over
+    ``shards`` hashed prefixes.
+    """
+    if not shards:
+        return '{}/{}'.format(container, obj)
+    return shard_prefix(container, shard_of(obj, shards)) + obj
+
+
+def unshard_name(name):
+    """
+    Maps the GCS name of a sharded object back to ``<container>/<object>``.
+    """
+    container, _, rest = name.partition('/')
+    if rest.startswith(SHARD_PREFIX):
+        shard, _, obj = rest.partition('/')
+        return '{}/{}'.format(container, obj)
+    return name
+
+
+class UnshardedBlob:
+    """
+    A listed blob seen under its unsharded name. Everything else is read
+    from the GCS blob, which keeps its name, so calls such as
+    ``reload()`` or ``delete()`` still target the sharded object.
+    """
+
+    def __init__(self, blob):
+        self.blob = blob
+        self.name = unshard_name(blob.name)
+
+    def __getattr__(self, attr):
+        return getattr(self.blob, attr)
+
+
+def merge_listings(listings):
+    """
+    Merges per shard listings, each already in name order, into
+    :class:`UnshardedBlob` views of their blobs. Names present in several
+    shards, such as pseudo folders, are returned once.
+    """
+    def unsharded(shard, blobs):
+        for blob in blobs:
+            view = UnshardedBlob(blob)
+            yield view.name, shard, view
+
+    last = None
+    merged = heapq.merge(*[unsharded(shard, blobs)
+                           for shard, blobs in enumerate(listings)])
+    for name, _, blob in merged:
+        if name == last:
+            continue
+        last = name
+        yield blob
@@ -0,0 +1,117 @@
+"""
+Swift object versioning on top of GCS object versioning.
+
+A versioned container turns versioning on for the account bucket, so an
+overwritten or deleted object is kept by GCS as a noncurrent generation
+instead of being copied to the versions container. The versions
+container ``_version_<container>`` is virtual: listing it lists the
+noncurrent generations of the container's objects, named the way Swift
+names archived versions, ``<3 hex digits name length><name>/<suffix>``,
+with the GCS generation as suffix.
+
+Containers with ``x-undelete-enabled`` use the same mechanism for their
+trash: a deleted object stays as a noncurrent generation, listed by the
+virtual ``.trash-<container>`` container under its own name, and is
+restored by copying that generation back within GCS.
+"""
+VERSIONS_PREFIX = '_version_'
+TRASH_PREFIX = '.trash-'
+
+# container metadata holding the versions location and mode
+LOCATION_META = 'x-versions-location'
+MODE_META = 'x-versions-mode'
+STACK = 'stack'
+HISTORY = 'history'
+
+# versioned_writes translates the client headers to these, when it runs
+# before swift_cloud
+SYSMETA_LOCATION = 'x-container-sysmeta-versions-location'
+SYSMETA_MODE = 'x-container-sysmeta-versions-mode'
+
+# container metadata enabling the trash
+UNDELETE_META = 'x-undelete-enabled'
+SYSMETA_UNDELETE = 'x-container-sysmeta-undelete-enabled'
+
+# container info requests, answered without the versions location and
+# undelete flag so that versioned_writes and undelete leave archiving
+# to GCS
+INFO_SOURCES = ('GET_CONTAINER_INFO', 'GET_INFO')
+
+
+def _utf8(value):
+    if isinstance(value, type(u'')):
+        return value.encode('utf-8')
+    return value
+
+
+def versions_container(container):
+    return VERSIONS_PREFIX + container
+
+
+def versioned_container(container):
+    """
+    :returns: the container archived by a versions container, or None
+    """
+    if container and container.startswith(VERSIONS_PREFIX):
+        return container[len(VERSIONS_PREFIX):] or None
+    return None
+
+
+def trashed_container(container):
+    """
+    :returns: the container whose deleted objects a trash container
+              lists, or None
+    """
+    if container and container.startswith(TRASH_PREFIX):
+        return container[len(TRASH_PREFIX):] or None
+    return None
+
+
+def version_prefix(obj):
+    obj = _utf8(obj)
+    return '{:03x}{}/'.format(len(obj), obj)
+
+
+def version_name(obj, generation):
+    return '{}{:016d}'.format(version_prefix(obj), int(generation))
+
+
+def parse_version_name(name):
+    """
+    :returns: tuple of ``(obj, generation)``, or None when ``name`` is
+              not a version name
+    """
+    name = _utf8(name)
+    try:
+        length = int(name[:3], 16)
+        obj, rest = name[3:3 + length], name[3 + length:]
+        if len(obj) != length or not rest.startswith('/'):
+            return None
+        return obj, int(rest[1:])
+    except ValueError:
+        return None
+
+
+def version_length(name):
+    """
+    :returns: the object name length encoded by the first characters of a
+              version name, listing prefix or marker, or None when it has
+              none
+    """
+    name = _utf8(name or '')
+    if len(name) < 3 or any(c not in '0123456789abcdef' for c in name[:3]):
+        return None
+    return int(name[:3], 16)
+
+
+def parse_version_prefix(prefix):
+    """
+    :returns: the object whose versions a listing ``prefix`` selects, or
+              None when it does not select a single object
+    """
+    parsed = parse_version_name(_utf8(prefix or '') + '0')
+    return parsed[0] if parsed else None
+
+
+def is_noncurrent(blob):
+    return blob.time_deleted is not None
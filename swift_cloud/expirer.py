@@ -0,0 +1,64 @@
+import time
+import heapq
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class ExpirySweeper:
+    """
+    In-process sweeper for objects expiring soon.
+
+    Bucket lifecycle rules on ``daysSinceCustomTime`` only run about once a
+    day, so objects whose deadline falls within ``horizon`` seconds are also
+    kept in a heap here and handed to ``expire`` as soon as their deadline
+    passes. Anything not tracked (beyond the horizon, over ``max_entries``
+    or lost on restart) is still removed by the lifecycle rule.
+    """
+
+    def __init__(self, expire, horizon=86400, max_entries=100000):
+        self.expire = expire
+        self.horizon = horizon
+        self.max_entries = max_entries
+        self.heap = []
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def schedule(self, delete_at, *entry):
+        if delete_at - time.time() > self.horizon:
+            return False
+
+        with self.cond:
+            if len(self.heap) >= self.max_entries:
+                return False
+            heapq.heappush(self.heap, (delete_at,) + entry)
+            self.cond.notify()
+
+        if not self.thread or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run,
+                                           name='swift-cloud-sweeper')
+            self.thread.daemon = True
+            self.thread.start()
+
+        return True
+
+    def _next(self):
+        with self.cond:
+            while True:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                wait = self.heap[0][0] - time.time()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                return heapq.heappop(self.heap)
+
+    def _run(self):
+        while True:
+            entry = self._next()
+            try:
+                self.expire(*entry[1:])
+            except Exception as err:
+                log.error(err)
@@ -0,0 +1,217 @@
+import time
+
+from six.moves.urllib.parse import urlparse
+
+from swift.common.utils import StatsdClient, config_true_value
+
+from swift_cloud import context
+from swift_cloud.tracing import get_tracer
+
+# process-wide StatsD client, configured by the first caller
+_metrics = None
+
+
+def get_metrics(conf):
+    global _metrics
+
+    if _metrics is None:
+        _metrics = Metrics(conf)
+    return _metrics
+
+
+def set_context(verb, handler):
+    """
+    Sets the verb and handler naming the metrics of the calls made by the
+    request served by the current (green)thread.
+    """
+    context.update(verb=verb, handler=handler)
+
+
+def get_context():
+    return (context.get('verb') or 'NONE', context.get('handler') or 'none')
+
+
+def start_spans(max_spans=100):
+    """
+    Starts recording the calls made by the request served by the current
+    (green)thread.
+    """
+    spans = SpanRecorder(max_spans)
+    context.update(spans=spans)
+    return spans
+
+
+def get_spans():
+    return context.get('spans')
+
+
+class SpanRecorder:
+    """
+    Durations of the backend calls made while serving one request.
+    """
+
+    def __init__(self, max_spans=100):
+        self.start = time.time()
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+
+    def add(self, name, start, end=None):
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return
+        self.spans.append((name, ((end or time.time()) - start) * 1000))
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def header(self):
+        """
+        Server-Timing style list, ``name;dur=<ms>``, ending with the total.
+        """
+        items = ['{};dur={:.1f}'.format(name, duration)
+                 for name, duration in self.spans]
+        items.append('total;dur={:.1f}'.format(self.elapsed() * 1000))
+        return ', '.join(items)
+
+    def summary(self):
+        items = ['{}={:.1f}ms'.format(name, duration)
+                 for name, duration in self.spans]
+        if self.dropped:
+            items.append('dropped={}'.format(self.dropped))
+        return ' '.join(items)
+
+
+def gcs_operation(method, url):
+    """
+    Names the GCS JSON API call made with ``method`` on ``url``.
+    """
+    path = urlparse(url).path
+    parts = path.strip('/').split('/')
+
+    if parts[0] == 'upload':
+        return 'upload'
+    if parts[0] == 'download':
+        return 'download'
+    if parts[0] == 'batch':
+        return 'batch'
+
+    # storage/v1/b/<bucket>/o/<object>[/rewriteTo/...]
+    parts = parts[2:]
+    if len(parts) <= 1:
+        return 'list_buckets' if method == 'GET' else 'create_bucket'
+    if len(parts) == 2:
+        return {'GET': 'get_bucket', 'PATCH': 'patch_bucket',
+                'DELETE': 'delete_bucket'}.get(method, 'bucket')
+    if len(parts) == 3:
+        return 'list_blobs' if method == 'GET' else 'objects'
+    if len(parts) > 4:
+        return parts[4].lower()
+    if method == 'GET':
+        return 'download' if 'alt=media' in url else 'get_blob'
+    return {'PATCH': 'patch_blob', 'PUT': 'update_blob',
+            'DELETE': 'delete_blob'}.get(method, 'blob')
+
+
+class Metrics:
+    """
+    StatsD timers and counters named
+    ``<component>.<operation>.<verb>.<handler>``, sent with the
+    ``log_statsd_*`` options Swift uses for its own loggers. Nothing is
+    sent unless ``log_statsd_host`` is set and ``metrics_enabled`` is true.
+    """
+
+    def __init__(self, conf):
+        self.client = None
+        self.tracer = get_tracer(conf)
+        host = conf.get('log_statsd_host')
+
+        # per request span recording, see SwiftCloudMiddleware
+        self.spans_enabled = config_true_value(
+            conf.get('timing_header', 'false')) or \
+            float(conf.get('slow_request_threshold', 0)) > 0
+
+        if host and config_true_value(conf.get('metrics_enabled', 'true')):
+            self.client = StatsdClient(
+                host, int(conf.get('log_statsd_port', 8125)),
+                base_prefix=conf.get('log_statsd_metric_prefix', ''),
+                tail_prefix=conf.get('metrics_prefix', 'swift_cloud'),
+                default_sample_rate=float(
+                    conf.get('log_statsd_default_sample_rate', 1)),
+                sample_rate_factor=float(
+                    conf.get('log_statsd_sample_rate_factor', 1)))
+
+    def record(self, component, operation, status, start, size=0,
+               trace=True):
+        spans = get_spans()
+        if spans is not None:
+            spans.add('{}.{}'.format(component, operation), start)
+
+        if trace and self.tracer.enabled:
+            self.tracer.record('{}.{}'.format(component, operation), start,
+                               status)
+
+        if not self.client:
+            return
+
+        verb, handler = get_context()
+        name = '.'.join((component, operation, verb, handler))
+        self.client.timing_since(name + '.timing', start)
+        self.client.increment('{}.{}'.format(name, status))
+        if size:
+            self.client.update_stats(name + '.bytes', size)
+
+    def increment(self, component, operation, outcome):
+        if not self.client:
+            return
+
+        verb, handler = get_context()
+        self.client.increment('.'.join(
+            (component, operation, verb, handler, outcome)))
+
+    def timing(self, component, operation, value):
+        """
+        Sends ``value``, in milliseconds, as a timer not tied to a request.
+        """
+        if not self.client:
+            return
+
+        self.client.timing('{}.{}'.format(component, operation), value)
+
+    def instrument(self, client):
+        """
+        Times every HTTP request made by a GCS client. Uploads and
+        downloads bypass the JSON API connection, so the client's
+        authorized session is wrapped instead.
+        """
+        if client is None or not (self.client or self.spans_enabled or
+                                  self.tracer.enabled):
+            return client
+
+        session = client._http
+        request = session.request
+
+        def timed_request(method, url, *args, **kwargs):
+            start = time.time()
+            status = 'error'
+            size = 0
+            data = kwargs.get('data')
+            if isinstance(data, bytes):
+                size += len(data)
+
+            span = self.tracer.current()
+            if span:
+                headers = dict(kwargs.get('headers') or {})
+                headers['traceparent'] = span.traceparent()
+                kwargs['headers'] = headers
+            try:
+                resp = request(method, url, *args, **kwargs)
+                status = resp.status_code
+                size += int(resp.headers.get('content-length') or 0)
+                return resp
+            finally:
+                self.record('gcs', gcs_operation(method, url), status,
+                            start, size)
+
+        session.request = timed_request
+        return client
@@ -1,13 +1,22 @@
+import time
 import logging
 
-from swift.common.swob import Request
-from swift.common.utils import split_path
+from swift.common.http import is_success
+from swift.common.swob import Request, Response, wsgi_to_str
+from swift.common.utils import split_path, config_true_value, \
+    close_if_possible
 from swift.common.middleware.proxy_logging import ProxyLoggingMiddleware
 
 from google.oauth2.service_account import Credentials
 from google.cloud import storage
 
 from swift_cloud.drivers.gcp import SwiftGCPDriver
+from swift_cloud.metrics import get_metrics, set_context, start_spans
+from swift_cloud.migration import Promoter
+from swift_cloud.profiler import ProfilingMiddleware
+from swift_cloud.tracing import SpanIter
+from swift_cloud.replication import Replicator, DUAL_WRITE_LABEL, \
+    BACKENDS, REPLICATED_METHODS
 
 log = logging.getLogger(__name__)
 
@@ -27,7 +36,104 @@ class SwiftCloudMiddleware(object):
 
         credentials_path = conf.get('gcp_credentials')
         credentials = Credentials.from_service_account_file(credentials_path)
-        self.client = storage.Client(credentials=credentials)
+        self.metrics = get_metrics(conf)
+        self.tracer = self.metrics.tracer
+        self.client = self.metrics.instrument(
+            storage.Client(credentials=credentials))
+
+        # "X-Cloud-Timing: true" requests a breakdown of backend calls
+        self.timing_header = config_true_value(
+            conf.get('timing_header', 'false'))
+        self.slow_request_threshold = float(
+            conf.get('slow_request_threshold', 0))
+
+        self.read_through = config_true_value(
+            conf.get('migration_read_through', 'true'))
+        self.promoter = None
+        if config_true_value(conf.get('migration_promote', 'false')):
+            self.promoter = Promoter(
+                app,
+                concurrency=int(conf.get('migration_promote_concurrency', 4)),
+                max_size=int(conf.get('migration_promote_max_size',
+                                      100 * 1024 * 1024)),
+                chunk_size=int(conf.get('migration_promote_chunk_size',
+                                        32 * 1024 * 1024)))
+
+        self.replicator = None
+
+    def _get_replicator(self):
+        if not self.replicator:
+            self.replicator = Replicator(self.app, self.conf)
+        return self.replicator
+
+    def dual_write_handler(self, req, primary):
+        """
+        Writes to ``primary`` synchronously and spools the write to be
+        replicated to the other backend. Writes the GCP driver hands back
+        to the pipeline are written to Swift and replicated to GCP.
+        """
+        resp = None
+        if primary == 'gcp':
+            resp = SwiftGCPDriver(req, self.app, self.conf).response()
+            if not isinstance(resp, Response):
+                primary, resp = 'swift', None
+
+        if resp is None:
+            resp = req.get_response(self.app)
+
+        if is_success(resp.status_int):
+            target = [b for b in BACKENDS if b != primary][0]
+            try:
+                self._get_replicator().enqueue(req, target)
+            except (IOError, OSError) as err:
+                log.error('Error spooling %s %s for replication: %s',
+                          req.method, req.path, err)
+
+        return resp
+
+    def _read_through(self, req, resp):
+        """
+        Serves object reads missing from GCS during a migration from
+        Swift, promoting the object to GCS when enabled.
+        """
+        try:
+            _, account, container, obj = split_path(
+                wsgi_to_str(req.environ['PATH_INFO']), 4, 4, True)
+        except ValueError:
+            return resp
+
+        if not self.read_through or req.method not in ('HEAD', 'GET') or \
+                resp.status_int != 404 or container.startswith('.trash-'):
+            return resp
+
+        if self.promoter and req.method == 'GET':
+            bucket = self.client.bucket(account.lower())
+            self.promoter.promote(req.environ, bucket, container, obj)
+
+        return self.app
+
+    def _delete_through(self, req, resp):
+        """
+        Deletes objects from Swift as well during a migration, so the
+        migration worker does not copy them back to GCS. Objects not yet
+        copied are only in Swift, whose response is then returned.
+        """
+        try:
+            _, account, container, obj = split_path(
+                wsgi_to_str(req.environ['PATH_INFO']), 4, 4, True)
+        except ValueError:
+            return resp
+
+        if container.startswith('.trash-') or \
+                not (is_success(resp.status_int) or resp.status_int == 404):
+            return resp
+
+        swift_resp = req.get_response(self.app)
+        if resp.status_int == 404:
+            return swift_resp
+
+        close_if_possible(swift_resp.app_iter)
+        return resp
 
     def gcp_handler(self, req, labels):
         driver = SwiftGCPDriver(req, self.app, self.conf)
@@ -40,7 +146,9 @@ class SwiftCloudMiddleware(object):
         cloud_migration = labels.get('account-meta-cloud-migration')
 
         if cloud_migration:
-            return resp
+            if req.method == 'DELETE':
+                return self._delete_through(req, resp)
+            return self._read_through(req, resp)
 
         index = req.url.find('/.trash-')
 
@@ -49,6 +157,50 @@ class SwiftCloudMiddleware(object):
 
         return resp
 
+    def _timed_start_response(self, environ, start_response, spans):
+        def timed_start_response(status, headers, exc_info=None):
+            if self.timing_header and \
+                    config_true_value(environ.get('HTTP_X_CLOUD_TIMING')):
+                headers = list(headers) + [('X-Cloud-Timing', spans.header())]
+
+            elapsed = spans.elapsed()
+            if self.slow_request_threshold and \
+                    elapsed >= self.slow_request_threshold:
+                log.warning('Slow request %s %s (txn: %s) %.3fs: %s',
+                            environ.get('REQUEST_METHOD'),
+                            environ.get('PATH_INFO'),
+                            environ.get('swift.trans_id'), elapsed,
+                            spans.summary())
+
+            return start_response(status, headers, exc_info)
+
+        return timed_start_response
+
+    def _traced(self, environ, start_response, span):
+        """
+        Runs the request under its server span, ended when the response
+        body is closed.
+        """
+        statuses = []
+
+        def traced_start_response(status, headers, exc_info=None):
+            statuses.append(int(status.split(' ', 1)[0]))
+            return start_response(status, headers, exc_info)
+
+        try:
+            app_iter = self._route(environ, traced_start_response)
+        except Exception:
+            self.tracer.end(span, 500)
+            raise
+
+        return SpanIter(app_iter, lambda: self.tracer.end(
+            span, statuses[-1] if statuses else None))
+
+    def _set_backend(self, backend):
+        span = self.tracer.current()
+        if span:
+            span.attributes['swift_cloud.backend'] = backend
+
     def __call__(self, environ, start_response):
         try:
             (version, account, container, obj) = \
@@ -56,6 +208,17 @@ class SwiftCloudMiddleware(object):
         except ValueError as err:
             return self.app(environ, start_response)
 
+        if self.timing_header or self.slow_request_threshold:
+            start_response = self._timed_start_response(
+                environ, start_response, start_spans())
+
+        span = self.tracer.start_request(environ)
+        if span:
+            return self._traced(environ, start_response, span)
+
+        return self._route(environ, start_response)
+
+    def _route(self, environ, start_response):
         cloud_name = ''
         x_cloud_bypass = environ.get('HTTP_X_CLOUD_BYPASS')
         new_cloud_name = environ.get('HTTP_X_ACCOUNT_META_CLOUD')
@@ -63,27 +226,43 @@ class SwiftCloudMiddleware(object):
         path_info = environ.get('PATH_INFO')
         project = path_info.split('/')[2]
         labels = {}
+        set_context(environ.get('REQUEST_METHOD'), 'routing')
+        start = time.time()
+        status = 'ok'
 
-        try:
-            bucket = self.client.get_bucket(project.lower(), timeout=30)
-            labels = bucket.labels
-            cloud_name = labels.get('account-meta-cloud')
-        except Exception:
-            pass
+        with self.tracer.span('middleware.route', account=project):
+            try:
+                bucket = self.client.get_bucket(project.lower(), timeout=30)
+                labels = bucket.labels
+                cloud_name = labels.get('account-meta-cloud')
+            except Exception:
+                status = 'error'
+            self.metrics.record('middleware', 'label_lookup', status, start)
 
         if x_cloud_bypass == self.x_cloud_bypass:
+            self._set_backend('bypass')
             return self.app(environ, start_response)
 
+        dual_write = labels.get(DUAL_WRITE_LABEL)
+
+        if dual_write in BACKENDS and \
+                environ['REQUEST_METHOD'] in REPLICATED_METHODS:
+            self._set_backend('dual-write-' + dual_write)
+            handler = self.dual_write_handler(Request(environ), dual_write)
+            return handler(environ, start_response)
+
         if (new_cloud_name and new_cloud_name in self.providers) or \
             (cloud_name and cloud_name in self.providers):
             req = Request(environ)
             handler = self.app
 
             if cloud_name == 'gcp' or new_cloud_name == 'gcp':
+                self._set_backend('gcp')
                 handler = self.gcp_handler(req, labels)
 
             return handler(environ, start_response)
 
+        self._set_backend('swift')
         return self.app(environ, start_response)
 
 
@@ -91,7 +270,14 @@ def filter_factory(global_conf, **local_conf):
     conf = global_conf.copy()
     conf.update(local_conf)
 
+    # not wrapped at all unless profiling can be turned on
+    profile = config_true_value(conf.get('profile_enabled', 'false')) or \
+        conf.get('profile_signal')
+
     def swift_cloud_filter(app):
-        return SwiftCloudMiddleware(app, conf)
+        middleware = SwiftCloudMiddleware(app, conf)
+        if profile:
+            return ProfilingMiddleware(middleware, conf)
+        return middleware
 
     return swift_cloud_filter
@@ -0,0 +1,553 @@
+"""
+Copies Swift accounts flagged with account-meta-cloud-migration to GCS.
+
+Containers and objects are listed through the proxy pipeline (an internal
+client), objects are streamed to GCS by a pool of greenthreads and
+verified with MD5, and progress is checkpointed after every listing page.
+Uploads never replace a blob, since writes made to GCS during the
+migration are newer than Swift, and the copied objects are added to the
+GCS counters. Objects that fail to copy are recorded in the checkpoint and
+retried at the end of the account and on the next run. Once an account is
+complete its migration label is removed, which ends read-through and
+promotion; as for any GCS account, requests missing in GCS still fall back
+to Swift.
+
+Usage::
+
+    python -m swift_cloud.migration --credentials creds.json \\
+        --internal-client-conf /etc/swift/internal-client.conf [account ...]
+"""
+import os
+import json
+import base64
+import hashlib
+import logging
+import argparse
+import binascii
+
+from eventlet import GreenPool
+
+from six.moves.urllib.parse import quote
+
+from swift.common.utils import mkdirs, fsync, config_true_value, \
+    close_if_possible
+from swift.common.wsgi import make_pre_authed_request
+
+from google.cloud import storage
+from google.cloud.exceptions import NotFound, PreconditionFailed
+from google.oauth2.service_account import Credentials
+
+from swift_cloud.drivers.gcp import BUCKET_LOCATION, RESERVED_META, \
+    apply_counter_deltas, update_metadata
+from swift_cloud.drivers import sharding
+
+log = logging.getLogger(__name__)
+
+MIGRATION_LABEL = 'account-meta-cloud-migration'
+FOLDER_TYPE = 'application/directory'
+OBJECT_META_PREFIX = 'x-object-meta-'
+CONTAINER_META_PREFIX = 'x-container-meta-'
+
+
+class MigrationError(Exception):
+    pass
+
+
+class IterReader(object):
+    """
+    Read-only file over a Swift response body iterator, computing the MD5
+    of what was read. Seeking is only possible to the current position,
+    which is all resumable uploads need when nothing failed.
+    """
+
+    def __init__(self, app_iter):
+        self.app_iter = iter(app_iter)
+        self.buffer = b''
+        self.position = 0
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.app_iter)
+            except StopIteration:
+                break
+
+        if size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+
+        self.position += len(data)
+        self.md5.update(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if (whence, offset) not in ((0, self.position), (1, 0)):
+            raise IOError('Swift object streams can not be rewound')
+        return self.position
+
+    def close(self):
+        close = getattr(self.app_iter, 'close', None)
+        if close:
+            close()
+
+
+def object_metadata(headers):
+    """
+    Maps Swift object headers to GCS blob metadata, the way the driver
+    stores them on PUT.
+    """
+    metadata = {}
+
+    for key, value in headers.items():
+        key = key.lower()
+        if key.startswith(OBJECT_META_PREFIX):
+            metadata[key[len(OBJECT_META_PREFIX):]] = value
+        elif key in RESERVED_META and key != 'content-encoding':
+            metadata[key] = value
+
+    if headers.get('Content-Encoding'):
+        metadata['Content-Encoding'] = headers['Content-Encoding']
+
+    return metadata
+
+
+def container_metadata(headers):
+    metadata = {}
+
+    for key, value in headers.items():
+        key = key.lower()
+        if key.startswith(CONTAINER_META_PREFIX):
+            metadata['meta-{}'.format(key[len(CONTAINER_META_PREFIX):])] = value
+
+    if headers.get('X-Container-Read') == '.r:*':
+        metadata['read'] = '.r:*'
+
+    return metadata
+
+
+def md5_hex(blob):
+    if not blob.md5_hash:
+        return None
+    return binascii.hexlify(base64.b64decode(blob.md5_hash)).decode('ascii')
+
+
+def copy_object(bucket, name, headers, body, chunk_size=None):
+    """
+    Streams a Swift object body to the blob ``name``. The upload is
+    checked against the MD5 of the streamed data, and plain objects also
+    against their Swift ETag. Existing blobs are never replaced: during a
+    migration they were written to GCS, so they are newer than Swift.
+
+    :returns: the uploaded blob, None when the blob already exists
+    :raises MigrationError: when the checksums do not match
+    """
+    blob = bucket.blob(name, chunk_size=chunk_size)
+    blob.metadata = object_metadata(headers) or None
+    blob.cache_control = headers.get('Cache-Control')
+    blob.content_disposition = headers.get('Content-Disposition')
+
+    reader = IterReader(body)
+    try:
+        blob.upload_from_file(
+            reader, size=int(headers.get('Content-Length', 0)),
+            content_type=headers.get('Content-Type'),
+            checksum='md5', num_retries=3, if_generation_match=0)
+    except PreconditionFailed:
+        return None
+    finally:
+        reader.close()
+
+    etag = (headers.get('Etag') or '').strip('"')
+    manifest = config_true_value(headers.get('X-Static-Large-Object')) or \
+        headers.get('X-Object-Manifest')
+    expected = [reader.md5.hexdigest()]
+    if etag and not manifest:
+        expected.append(etag)
+
+    if any(md5_hex(blob) != md5 for md5 in expected):
+        blob.delete()
+        raise MigrationError('MD5 mismatch copying {}'.format(name))
+
+    return blob
+
+
+class Promoter:
+    """
+    Copies objects read from Swift during a migration to GCS in the
+    background, so frequently read objects move before the migration
+    worker reaches them. Promotions beyond ``concurrency`` are dropped
+    rather than queued.
+    """
+
+    def __init__(self, app, concurrency=4, max_size=100 * 1024 * 1024,
+                 chunk_size=32 * 1024 * 1024):
+        self.app = app
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.pool = GreenPool(concurrency)
+        self.running = set()
+
+    def promote(self, env, bucket, container, obj):
+        """
+        Schedules the copy of ``container/obj``. The Swift GET is pre
+        authorized from ``env``, so it must be built while the client
+        request is being handled.
+        """
+        key = (bucket.name, container, obj)
+        if key in self.running or not self.pool.free():
+            return False
+
+        req = make_pre_authed_request(
+            env, 'GET', quote(env['PATH_INFO']),
+            agent='%(orig)s SwiftCloudPromoter', swift_source='SCP')
+
+        self.running.add(key)
+        self.pool.spawn_n(self._promote, req, bucket, container, obj, key)
+        return True
+
+    def _promote(self, req, bucket, container, obj, key):
+        try:
+            container_blob = bucket.get_blob(container + '/')
+            if not container_blob:
+                return
+
+            resp = req.get_response(self.app)
+            if resp.status_int != 200 or \
+                    (resp.content_length or 0) > self.max_size:
+                close_if_possible(resp.app_iter)
+                return
+
+            name = sharding.blob_name(
+                container, obj, sharding.shard_count(container_blob.metadata))
+            blob = copy_object(bucket, name, resp.headers, resp.app_iter,
+                               self.chunk_size)
+            if not blob:
+                return
+
+            apply_counter_deltas(bucket, [(container_blob, 1, blob.size)])
+            log.info('Promoted %s/%s/%s', bucket.name, container, obj)
+        except Exception:
+            log.exception('Error promoting %s/%s/%s', bucket.name,
+                          container, obj)
+        finally:
+            self.running.discard(key)
+
+
+class Checkpoint:
+    """
+    Per account JSON file with the containers already copied, the last
+    listing marker of the container being copied and the listing items
+    of the objects that could not be copied, by container.
+    """
+
+    def __init__(self, path, account):
+        self.path = os.path.join(path, '{}.json'.format(account))
+        self.state = {'done': [], 'container': None, 'marker': '',
+                      'failed': {}}
+        mkdirs(path)
+
+        try:
+            with open(self.path) as fp:
+                self.state.update(json.load(fp))
+        except (IOError, ValueError):
+            pass
+
+    def marker(self, container):
+        if self.state['container'] == container:
+            return self.state['marker']
+        return ''
+
+    def save(self, container, marker=None, done=False):
+        if done:
+            self.state['done'].append(container)
+            container, marker = None, ''
+        self.state['container'] = container
+        self.state['marker'] = marker
+        self.write()
+
+    def set_failed(self, container, items):
+        """
+        Replaces the failed items of ``container``, saved with the next
+        :meth:`save` or :meth:`write`.
+        """
+        if items:
+            self.state['failed'][container] = items
+        else:
+            self.state['failed'].pop(container, None)
+
+    def write(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(self.state, fp)
+            fp.flush()
+            fsync(fp.fileno())
+        os.rename(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class AccountMigrator:
+    """
+    Copies whole accounts from Swift, reached through ``swift`` (an
+    :class:`InternalClient`), to GCS.
+    """
+
+    def __init__(self, swift, client, checkpoint_dir, concurrency=16,
+                 page_size=1000, chunk_size=32 * 1024 * 1024):
+        self.swift = swift
+        self.client = client
+        self.checkpoint_dir = checkpoint_dir
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+
+    def _bucket(self, account):
+        try:
+            return self.client.get_bucket(account.lower(), timeout=30)
+        except NotFound:
+            return self.client.create_bucket(account.lower(),
+                                             location=BUCKET_LOCATION)
+
+    def _container_blob(self, bucket, account, container):
+        headers = self.swift.make_request(
+            'HEAD', self.swift.make_path(account, container), {},
+            (2,)).headers
+
+        blob = bucket.get_blob(container + '/')
+        if not blob:
+            try:
+                bucket.blob(container + '/').upload_from_string(
+                    '', content_type='application/directory;charset=UTF-8',
+                    if_generation_match=0)
+                apply_counter_deltas(bucket, [], container_count=1)
+            except PreconditionFailed:
+                pass
+            blob = bucket.get_blob(container + '/')
+
+        def update(metadata):
+            metadata.update(container_metadata(headers))
+            return metadata
+
+        # counters are left alone, copied objects are added as deltas
+        update_metadata(blob, update)
+        return blob
+
+    def _copy(self, bucket, account, container, item, shards, existing):
+        """
+        :returns: ``(count, bytes_used)`` of what was added to GCS
+        """
+        name = sharding.blob_name(container, item['name'], shards)
+
+        if name in existing:
+            return 0, 0
+
+        if item.get('content_type', '').startswith(FOLDER_TYPE) and \
+                not item['bytes']:
+            try:
+                bucket.blob(name).upload_from_string(
+                    '', content_type=FOLDER_TYPE, if_generation_match=0)
+            except PreconditionFailed:
+                return 0, 0
+            return 1, 0
+
+        status, headers, body = self.swift.get_object(
+            account, container, item['name'], {})
+        blob = copy_object(bucket, name, headers, body, self.chunk_size)
+        if not blob:
+            return 0, 0
+        return 1, blob.size
+
+    def _existing(self, bucket, container, items, shards):
+        """
+        Names of the blobs of a listing page already in GCS, so a resumed
+        page only copies what is missing.
+        """
+        if shards or not items:
+            return set()
+
+        first = '{}/{}'.format(container, items[0]['name'])
+        last = '{}/{}'.format(container, items[-1]['name'])
+        existing = set()
+
+        for blob in bucket.list_blobs(prefix=container + '/',
+                                      start_offset=first):
+            if blob.name > last:
+                break
+            existing.add(blob.name)
+
+        return existing
+
+    def _copy_items(self, pool, bucket, account, container_blob, container,
+                    items, shards, existing=()):
+        """
+        Copies ``items`` and adds them to the GCS counters. Objects that
+        could not be copied are logged and returned, so the others go on.
+
+        :returns: ``(bytes_used, failed items)``
+        """
+        def copy(item):
+            try:
+                return self._copy(bucket, account, container, item, shards,
+                                  existing)
+            except Exception:
+                log.exception('Error copying %s/%s/%s', account, container,
+                              item['name'])
+                return None
+
+        results = list(pool.imap(copy, items))
+        failed = [item for item, result in zip(items, results)
+                  if result is None]
+        results = [result for result in results if result is not None]
+
+        count = sum(result[0] for result in results)
+        used = sum(result[1] for result in results)
+        if count or used:
+            apply_counter_deltas(bucket, [(container_blob, count, used)])
+
+        return used, failed
+
+    def migrate_container(self, bucket, account, container, checkpoint):
+        container_blob = self._container_blob(bucket, account, container)
+        shards = sharding.shard_count(container_blob.metadata)
+        marker = checkpoint.marker(container)
+        pool = GreenPool(self.concurrency)
+        copied = 0
+
+        while True:
+            items = []
+            for item in self.swift.iter_objects(account, container,
+                                                marker=marker):
+                items.append(item)
+                if len(items) >= self.page_size:
+                    break
+            if not items:
+                break
+
+            existing = self._existing(bucket, container, items, shards)
+            used, failed = self._copy_items(
+                pool, bucket, account, container_blob, container, items,
+                shards, existing)
+            copied += used
+
+            if failed:
+                checkpoint.set_failed(
+                    container,
+                    checkpoint.state['failed'].get(container, []) + failed)
+            marker = items[-1]['name']
+            checkpoint.save(container, marker)
+
+        checkpoint.save(container, done=True)
+        return copied
+
+    def migrate_account(self, account):
+        bucket = self._bucket(account)
+        checkpoint = Checkpoint(self.checkpoint_dir, account)
+        copied = 0
+
+        for item in self.swift.iter_containers(account):
+            container = item['name']
+            if container in checkpoint.state['done']:
+                continue
+            copied += self.migrate_container(bucket, account, container,
+                                             checkpoint)
+            log.info('Migrated %s/%s', account, container)
+
+        copied += self.retry_failed(bucket, account, checkpoint)
+        failed = sum(len(items)
+                     for items in checkpoint.state['failed'].values())
+        if failed:
+            log.error('Migrating %s: %d objects could not be copied, '
+                      'retried on the next run', account, failed)
+            return copied
+
+        def finish(labels):
+            labels['account-meta-cloud'] = 'gcp'
+            labels[MIGRATION_LABEL] = None
+            return labels
+
+        update_metadata(bucket, finish, 'labels')
+
+        checkpoint.clear()
+        log.info('Migrated %s, %d bytes copied', account, copied)
+        return copied
+
+    def retry_failed(self, bucket, account, checkpoint):
+        """
+        Copies again the objects recorded as failed in the checkpoint,
+        keeping those that fail again for the next run.
+
+        :returns: bytes copied
+        """
+        pool = GreenPool(self.concurrency)
+        copied = 0
+
+        for container, items in list(checkpoint.state['failed'].items()):
+            container_blob = bucket.get_blob(container + '/')
+            if not container_blob:
+                container_blob = self._container_blob(bucket, account,
+                                                      container)
+            shards = sharding.shard_count(container_blob.metadata)
+
+            used, failed = self._copy_items(
+                pool, bucket, account, container_blob, container, items,
+                shards)
+            copied += used
+
+            checkpoint.set_failed(container, failed)
+            checkpoint.write()
+
+        return copied
+
+    def pending_accounts(self):
+        return [bucket.name for bucket in self.client.list_buckets()
+                if (bucket.labels or {}).get(MIGRATION_LABEL)]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('accounts', nargs='*',
+                        help='accounts to migrate, all flagged if empty')
+    parser.add_argument('--credentials', required=True,
+                        help='GCP service account file')
+    parser.add_argument('--internal-client-conf',
+                        default='/etc/swift/internal-client.conf')
+    parser.add_argument('--checkpoint-dir',
+                        default='/var/cache/swift/swift_cloud_migration')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--chunk-size', type=int, default=32 * 1024 * 1024,
+                        help='resumable upload chunk size, multiple of 256KB')
+    options = parser.parse_args(args)
+
+    import eventlet
+    eventlet.monkey_patch()
+    logging.basicConfig(level=logging.INFO)
+
+    from swift.common.internal_client import InternalClient
+
+    swift = InternalClient(options.internal_client_conf,
+                           'swift-cloud-migration', 3)
+    credentials = Credentials.from_service_account_file(options.credentials)
+    migrator = AccountMigrator(
+        swift, storage.Client(credentials=credentials),
+        options.checkpoint_dir,
+        concurrency=options.concurrency,
+        chunk_size=options.chunk_size)
+
+    for account in options.accounts or migrator.pending_accounts():
+        try:
+            migrator.migrate_account(account)
+        except Exception:
+            log.exception('Error migrating %s', account)
+
+
+if __name__ == '__main__':
+    main()
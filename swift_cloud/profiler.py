@@ -0,0 +1,97 @@
+import os
+import time
+import random
+import signal
+import pstats
+import cProfile
+import logging
+import threading
+
+from swift.common.utils import mkdirs, config_true_value
+
+log = logging.getLogger(__name__)
+
+
+class ProfilingMiddleware(object):
+    """
+    Runs a sample of requests under cProfile and periodically writes the
+    aggregated statistics to ``profile_dir``, one file per process and
+    dump, readable with :mod:`pstats` or snakeviz.
+
+    Profiling is switched on with ``profile_enabled`` or at runtime by
+    sending ``profile_signal`` (e.g. SIGUSR2) to the proxy worker, which
+    also switches it off again and writes what was collected. Only one
+    request is profiled
+    at a time: greenthreads share the interpreter's profile hook, so work
+    done by other requests while a sampled one waits on IO is attributed
+    to it.
+    """
+
+    def __init__(self, app, conf):
+        self.app = app
+        self.enabled = config_true_value(conf.get('profile_enabled', 'false'))
+        self.sample_rate = float(conf.get('profile_sample_rate', 0.01))
+        self.interval = float(conf.get('profile_interval', 60))
+        self.path = conf.get('profile_dir',
+                             '/var/log/swift/swift_cloud_profile')
+
+        self.stats = None
+        self.samples = 0
+        self.last_dump = time.time()
+        self.lock = threading.Lock()
+
+        signame = conf.get('profile_signal')
+        if signame:
+            try:
+                signal.signal(getattr(signal, signame), self.toggle)
+            except (AttributeError, ValueError) as err:
+                log.error('Cannot install profiler signal %s: %s',
+                          signame, err)
+
+    def toggle(self, *args):
+        self.enabled = not self.enabled
+        log.info('Profiling %s', 'enabled' if self.enabled else 'disabled')
+        if not self.enabled:
+            self.dump()
+
+    def dump(self):
+        stats, samples = self.stats, self.samples
+        self.stats, self.samples = None, 0
+        self.last_dump = time.time()
+
+        if not stats:
+            return None
+
+        mkdirs(self.path)
+        filename = os.path.join(self.path, 'swift-cloud-{}-{:.0f}.prof'.format(
+            os.getpid(), self.last_dump))
+        stats.dump_stats(filename)
+        log.info('Wrote %d profiled requests to %s', samples, filename)
+        return filename
+
+    def _profile(self, environ, start_response):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(self.app, environ, start_response)
+        finally:
+            if self.stats:
+                self.stats.add(profile)
+            else:
+                self.stats = pstats.Stats(profile)
+            self.samples += 1
+
+            if time.time() - self.last_dump >= self.interval:
+                try:
+                    self.dump()
+                except (IOError, OSError) as err:
+                    log.error('Error writing profile: %s', err)
+
+    def __call__(self, environ, start_response):
+        if not self.enabled or random.random() >= self.sample_rate or \
+                not self.lock.acquire(False):
+            return self.app(environ, start_response)
+
+        try:
+            return self._profile(environ, start_response)
+        finally:
+            self.lock.release()
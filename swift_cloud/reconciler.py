@@ -0,0 +1,212 @@
+"""
+Recomputes account and container usage counters from blob listings.
+
+Object PUTs and DELETEs update ``object-count`` and ``bytes-used`` with a
+read-modify-write, so the counters drift when requests race. This worker
+lists every container in parallel key ranges and sums its objects without
+holding the listing in memory. Counters are then moved by the difference
+between the sums and their values read before listing, with
+metageneration preconditions, so that the updates requests made during
+the listing are kept. Progress is checkpointed per account, so an
+interrupted run resumes with the next container.
+
+Usage::
+
+    python -m swift_cloud.reconciler --credentials creds.json [account ...]
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+
+from swift.common.utils import mkdirs, fsync, ratelimit_sleep
+
+from google.cloud import storage
+from google.cloud.exceptions import NotFound, PreconditionFailed
+from google.oauth2.service_account import Credentials
+
+from swift_cloud.drivers.gcp import all_objects, update_metadata
+from swift_cloud.drivers.listing import usage_partitioned
+
+log = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Limits the rate of listed blobs across all listing greenthreads.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.running_time = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            self.running_time = ratelimit_sleep(self.running_time, self.rate)
+
+
+class Checkpoint:
+    """
+    Per account JSON file holding the totals of containers already
+    reconciled in the current pass.
+    """
+
+    def __init__(self, path, account):
+        self.path = os.path.join(path, '{}.json'.format(account))
+        self.containers = {}
+        mkdirs(path)
+
+        try:
+            with open(self.path) as fp:
+                self.containers = json.load(fp)['containers']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def save(self, container, count, used):
+        self.containers[container] = [count, used]
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump({'containers': self.containers}, fp)
+            fp.flush()
+            fsync(fp.fileno())
+        os.rename(tmp, self.path)
+
+    def clear(self):
+        self.containers = {}
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class CounterReconciler:
+
+    def __init__(self, client, checkpoint_dir, partitions=16, concurrency=8,
+                 rate=0):
+        self.client = client
+        self.checkpoint_dir = checkpoint_dir
+        self.partitions = partitions
+        self.concurrency = concurrency
+        self.throttle = RateLimiter(rate)
+
+    def _correct(self, resource, snapshot, totals, field='metadata'):
+        """
+        Moves the counters of ``resource`` by the difference between the
+        recomputed ``totals`` and the ``snapshot`` of them read before
+        listing, so that the updates requests made meanwhile are kept.
+        """
+        def update(values):
+            for key, total in totals.items():
+                values[key] = max(0, int(values.get(key) or 0) + total -
+                                  int(snapshot.get(key) or 0))
+            return values
+
+        try:
+            update_metadata(resource, update, field)
+        except PreconditionFailed:
+            log.error('Gave up updating %s', resource.name)
+
+    def reconcile_container(self, bucket, container):
+        blob = bucket.get_blob(container + '/')
+        snapshot = dict((blob.metadata if blob else None) or {})
+
+        count, used = usage_partitioned(
+            bucket, container + '/', all_objects,
+            count=self.partitions,
+            concurrency=self.concurrency,
+            throttle=self.throttle)
+
+        if blob:
+            self._correct(blob, snapshot,
+                          {'object-count': count, 'bytes-used': used})
+
+        return count, used
+
+    def reconcile_account(self, account):
+        try:
+            bucket = self.client.get_bucket(account, timeout=30)
+        except NotFound:
+            return None
+
+        snapshot = dict(bucket.labels or {})
+        checkpoint = Checkpoint(self.checkpoint_dir, account)
+        markers = bucket.list_blobs(prefix='', delimiter='/',
+                                    include_trailing_delimiter=True)
+        containers = [b.name[:-1] for b in markers if b.name.endswith('/')]
+
+        for container in containers:
+            if container in checkpoint.containers:
+                continue
+            count, used = self.reconcile_container(bucket, container)
+            checkpoint.save(container, count, used)
+            log.info('%s/%s: %d objects, %d bytes', account, container,
+                     count, used)
+
+        totals = [checkpoint.containers[c] for c in containers
+                  if c in checkpoint.containers]
+        count = sum(t[0] for t in totals)
+        used = sum(t[1] for t in totals)
+
+        self._correct(bucket, snapshot, {'container-count': len(containers),
+                                         'object-count': count,
+                                         'bytes-used': used}, 'labels')
+        checkpoint.clear()
+
+        return len(containers), count, used
+
+    def run(self, accounts=None, interval=0):
+        """
+        Reconciles ``accounts``, or every bucket of the project, once or
+        every ``interval`` seconds.
+        """
+        while True:
+            names = accounts or [b.name for b in self.client.list_buckets()]
+
+            for account in names:
+                try:
+                    self.reconcile_account(account)
+                except Exception:
+                    log.exception('Error reconciling %s', account)
+
+            if not interval:
+                return
+            time.sleep(interval)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('accounts', nargs='*',
+                        help='accounts to reconcile, all buckets if empty')
+    parser.add_argument('--credentials', required=True,
+                        help='GCP service account file')
+    parser.add_argument('--checkpoint-dir',
+                        default='/var/cache/swift/swift_cloud_reconciler')
+    parser.add_argument('--partitions', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0,
+                        help='maximum listed blobs per second, 0 for no limit')
+    parser.add_argument('--interval', type=int, default=0,
+                        help='seconds between passes, 0 to run once')
+    options = parser.parse_args(args)
+
+    import eventlet
+    eventlet.monkey_patch()
+    logging.basicConfig(level=logging.INFO)
+
+    credentials = Credentials.from_service_account_file(options.credentials)
+    reconciler = CounterReconciler(
+        storage.Client(credentials=credentials),
+        options.checkpoint_dir,
+        partitions=options.partitions,
+        concurrency=options.concurrency,
+        rate=options.rate)
+    reconciler.run([a.lower() for a in options.accounts], options.interval)
+
+
+if __name__ == '__main__':
+    main()
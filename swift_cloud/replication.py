@@ -0,0 +1,217 @@
+import time
+import logging
+
+from collections import OrderedDict
+
+import six
+
+from eventlet import GreenPool
+from six.moves.urllib.parse import quote
+
+from swift.common.http import is_success, HTTP_NOT_FOUND
+from swift.common.swob import Response
+from swift.common.utils import FileLikeIter, close_if_possible, \
+    config_true_value, split_path
+from swift.common.wsgi import make_pre_authed_request
+
+from swift_cloud.drivers.gcp import SwiftGCPDriver
+from swift_cloud.metrics import get_metrics
+from swift_cloud.spool import DurableSpool
+
+log = logging.getLogger(__name__)
+
+DUAL_WRITE_LABEL = 'account-meta-cloud-dual-write'
+BACKENDS = ('gcp', 'swift')
+REPLICATED_METHODS = ('PUT', 'POST', 'DELETE')
+REPLICATED_HEADERS = (
+    'x-object-meta-',
+    'x-container-meta-',
+    'x-account-meta-',
+    'x-remove-',
+    'x-container-read',
+    'x-container-write',
+    'x-versions-location',
+    'x-history-location',
+    'x-undelete-enabled',
+    'x-container-sharding',
+    'x-delete-at',
+    'x-delete-after',
+    'content-type',
+    'content-encoding',
+    'content-disposition',
+    'cache-control'
+)
+
+
+def replicated_headers(headers):
+    return dict((key, value) for key, value in headers.items()
+                if key.lower().startswith(REPLICATED_HEADERS))
+
+
+class Replicator:
+    """
+    Replays writes acknowledged by one backend on the other one.
+
+    Writes are spooled as records holding the method, path and headers of
+    the request; object bodies are not spooled, an object PUT is replayed
+    by streaming the current object from the backend that took the write.
+    Records of the same path are replayed in order, different paths
+    concurrently. Records that fail are retried on the next flush until
+    ``max_attempts`` is reached, holding back the later records of their
+    path. The lag is sent as the ``replication.lag`` timer.
+    """
+
+    def __init__(self, app, conf):
+        self.app = app
+        self.conf = conf
+        self.concurrency = int(conf.get('dual_write_concurrency', 8))
+        self.max_attempts = int(conf.get('dual_write_max_attempts', 10))
+        self.lag_warning = float(conf.get('dual_write_lag_warning', 60))
+
+        # replication lag, in seconds, of the last record replicated
+        self.lag = 0
+        self.replicated = 0
+        self.dropped = 0
+        self.metrics = get_metrics(conf)
+
+        self.spool = DurableSpool(
+            conf.get('dual_write_spool_dir',
+                     '/var/cache/swift/swift_cloud_replication'),
+            batch_size=int(conf.get('dual_write_batch_size', 100)),
+            interval=float(conf.get('dual_write_interval', 1)),
+            sync=config_true_value(conf.get('dual_write_fsync', 'true')),
+            key=lambda record: record['path'])
+        self.spool.start(self.replicate)
+
+    def enqueue(self, req, target):
+        if 'extract-archive' in req.params or 'bulk-delete' in req.params:
+            log.warning('Bulk request %s %s is not replicated to %s',
+                        req.method, req.path, target)
+            return
+
+        self.spool.put({
+            'method': req.method,
+            'path': req.environ['PATH_INFO'],
+            'headers': replicated_headers(req.headers),
+            'target': target,
+            'time': time.time(),
+            'attempts': 0
+        })
+
+    def stats(self):
+        return {
+            'lag': self.lag,
+            'pending': self.spool.pending(),
+            'replicated': self.replicated,
+            'dropped': self.dropped
+        }
+
+    def _request(self, backend, method, path, headers=None, body=None):
+        if isinstance(path, six.text_type):
+            path = path.encode('utf-8')
+        req = make_pre_authed_request(
+            {}, method, quote(path), headers=headers,
+            agent='SwiftCloudReplicator', swift_source='SCR')
+        if body is not None:
+            req.environ['wsgi.input'] = body
+
+        if backend == 'swift':
+            return req.get_response(self.app)
+
+        resp = SwiftGCPDriver(req, self.app, self.conf).response()
+        if not isinstance(resp, Response):
+            return Response(status=503)
+        return resp
+
+    def _put_object(self, record):
+        source = [b for b in BACKENDS if b != record['target']][0]
+        resp = self._request(source, 'GET', record['path'])
+
+        if resp.status_int == HTTP_NOT_FOUND:
+            # deleted since, the DELETE record follows
+            close_if_possible(resp.app_iter)
+            return resp
+        if not is_success(resp.status_int):
+            close_if_possible(resp.app_iter)
+            return resp
+
+        headers = replicated_headers(resp.headers)
+        headers['Content-Length'] = resp.content_length or 0
+        body = resp.app_iter if resp.app_iter is not None else [resp.body]
+        try:
+            return self._request(record['target'], 'PUT', record['path'],
+                                 headers, FileLikeIter(body))
+        finally:
+            close_if_possible(resp.app_iter)
+
+    def _replicate(self, record):
+        obj = split_path(record['path'], 1, 4, True)[3]
+
+        if record['method'] == 'PUT' and obj:
+            resp = self._put_object(record)
+        else:
+            resp = self._request(record['target'], record['method'],
+                                 record['path'], record['headers'])
+
+        status = resp.status_int
+        if is_success(status) or status == HTTP_NOT_FOUND:
+            return True
+
+        log.warning('Replicating %s %s to %s failed: %s', record['method'],
+                    record['path'], record['target'], status)
+        return False
+
+    def _replicate_path(self, records):
+        """
+        Replays the records of one path in order, stopping at the first
+        failure so later writes are not applied before it.
+        """
+        for index, record in enumerate(records):
+            try:
+                done = self._replicate(record)
+            except Exception:
+                log.exception('Error replicating %s %s', record['method'],
+                              record['path'])
+                done = False
+
+            if not done:
+                return records[index:]
+
+            self.replicated += 1
+            self.lag = time.time() - record['time']
+            self.metrics.timing('replication', 'lag', self.lag * 1000)
+            if self.lag > self.lag_warning:
+                log.warning('Replication to %s is %.1fs behind',
+                            record['target'], self.lag)
+
+        return []
+
+    def replicate(self, records):
+        """
+        Spool handler.
+
+        :returns: records that failed and are retried on the next flush
+        """
+        paths = OrderedDict()
+        for record in records:
+            paths.setdefault(record['path'], []).append(record)
+
+        # the spool hands over one record per path, direct callers may not
+        for path_records in paths.values():
+            path_records.sort(key=lambda record: record['time'])
+
+        pool = GreenPool(self.concurrency)
+        failed = []
+
+        for remaining in pool.imap(self._replicate_path, paths.values()):
+            for record in remaining:
+                record['attempts'] += 1
+                if record['attempts'] >= self.max_attempts:
+                    self.dropped += 1
+                    log.error('Giving up replicating %s %s to %s',
+                              record['method'], record['path'],
+                              record['target'])
+                else:
+                    failed.append(record)
+
+        return failed
@@ -0,0 +1,133 @@
+import time
+import random
+import logging
+import threading
+
+from google.api_core import exceptions
+
+from swift_cloud.metrics import get_metrics
+
+log = logging.getLogger(__name__)
+
+# errors worth trying again: write contention, rate limiting and
+# transient server side failures
+RETRYABLE_ERRORS = (
+    exceptions.Conflict,
+    exceptions.TooManyRequests,
+    exceptions.InternalServerError,
+    exceptions.BadGateway,
+    exceptions.ServiceUnavailable,
+    exceptions.GatewayTimeout,
+)
+
+# process-wide policy, configured by the first caller
+_policy = None
+
+
+def get_retry_policy(conf=None):
+    global _policy
+
+    if _policy is None:
+        _policy = RetryPolicy.from_conf(conf or {})
+    return _policy
+
+
+class RetryBudget:
+    """
+    Token bucket bounding the retries of a worker process: ``rate``
+    tokens are added per second, up to ``burst``, and every retry takes
+    one. Once it is empty, calls fail on their first error instead of
+    piling up behind a hot resource.
+    """
+
+    def __init__(self, rate=10, burst=100):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def withdraw(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """
+    Retries GCS calls on contention and transient errors with
+    exponential backoff and full jitter, within ``deadline`` seconds and
+    ``max_attempts`` attempts, and as long as the retry budget allows.
+    """
+
+    def __init__(self, initial=0.1, maximum=5, multiplier=2, deadline=30,
+                 max_attempts=8, budget=None, retry_on=RETRYABLE_ERRORS,
+                 metrics=None):
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.budget = budget
+        self.retry_on = retry_on
+        self.metrics = metrics
+
+    @classmethod
+    def from_conf(cls, conf):
+        return cls(
+            initial=float(conf.get('retry_initial_delay', 0.1)),
+            maximum=float(conf.get('retry_max_delay', 5)),
+            multiplier=float(conf.get('retry_multiplier', 2)),
+            deadline=float(conf.get('retry_deadline', 30)),
+            max_attempts=int(conf.get('retry_max_attempts', 8)),
+            budget=RetryBudget(
+                rate=float(conf.get('retry_budget_rate', 10)),
+                burst=float(conf.get('retry_budget_burst', 100))),
+            metrics=get_metrics(conf))
+
+    def delay(self, attempt):
+        return random.uniform(
+            0, min(self.maximum, self.initial * self.multiplier ** attempt))
+
+    def _count(self, name, outcome):
+        if self.metrics:
+            self.metrics.increment('retry', name, outcome)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls ``func`` until it succeeds or the policy gives up, in which
+        case the last error is raised.
+        """
+        name = getattr(func, '__name__', 'call')
+        start = time.time()
+        attempt = 0
+
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except self.retry_on as err:
+                delay = self.delay(attempt)
+                attempt += 1
+
+                if attempt >= self.max_attempts:
+                    reason = 'attempts'
+                elif time.time() + delay - start > self.deadline:
+                    reason = 'deadline'
+                elif self.budget and not self.budget.withdraw():
+                    reason = 'budget'
+                else:
+                    self._count(name, 'retry')
+                    time.sleep(delay)
+                    continue
+
+                self._count(name, 'exhausted_' + reason)
+                log.warning('Giving up %s after %d attempts (%s): %s',
+                            name, attempt, reason, err)
+                raise
@@ -0,0 +1,292 @@
+import os
+import json
+import errno
+import fcntl
+import time
+import logging
+import threading
+
+from swift.common.utils import mkdirs, fsync
+
+log = logging.getLogger(__name__)
+
+CURRENT_SUFFIX = '.current'
+BATCH_SUFFIX = '.batch'
+CLAIMED_SUFFIX = '.claimed'
+TMP_SUFFIX = '.tmp'
+LOCK_NAME = '.flush.lock'
+
+
+class DurableSpool:
+    """
+    Local append-only spool of JSON records.
+
+    Records are appended to a per-process segment file. Flushing seals the
+    current segment and hands its records to a handler in batches; records
+    the handler reports as failed are written back to the spool so they are
+    retried on the next flush. Sealed segments left by a crashed process are
+    picked up by any process sharing the same directory.
+
+    When ``key`` is given, records with the same key are delivered in the
+    order they were spooled: a batch holds at most one record per key, and
+    once a record fails the later records of its key are held back and
+    retried after it. Only one process flushes a spool directory at a
+    time, so records put back are delivered before the newer records
+    other processes spooled meanwhile.
+    """
+
+    def __init__(self, path, batch_size=100, interval=1.0, sync=True,
+                 key=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.sync = sync
+        self.key = key
+        self.lock = threading.Lock()
+        self.flusher = None
+        mkdirs(self.path)
+        self._recover()
+
+    def _recover(self):
+        # segments left behind by dead processes are sealed again so the
+        # next flush delivers them
+        for name in os.listdir(self.path):
+            if not name.endswith((CURRENT_SUFFIX, CLAIMED_SUFFIX,
+                                  CLAIMED_SUFFIX + TMP_SUFFIX)):
+                continue
+            try:
+                pid = int(name.split('-')[1].split('.')[0])
+                os.kill(pid, 0)
+                continue
+            except (IndexError, ValueError):
+                pass
+            except OSError as err:
+                # EPERM: alive, run by another user
+                if err.errno != errno.ESRCH:
+                    continue
+            src = os.path.join(self.path, name)
+            if name.endswith(TMP_SUFFIX):
+                self._recover_put_back(src)
+                continue
+            dst = os.path.join(self.path, '{}{}'.format(
+                name.rsplit('.', 1)[0], BATCH_SUFFIX))
+            try:
+                os.rename(src, dst)
+            except OSError:
+                continue
+
+    def _recover_put_back(self, tmp):
+        # failed records a dead process did not finish putting back; its
+        # claimed segment, sealed again or not yet, still holds them
+        base = tmp[:-len(CLAIMED_SUFFIX + TMP_SUFFIX)]
+        try:
+            if os.path.exists(base + CLAIMED_SUFFIX) or \
+                    os.path.exists(base + BATCH_SUFFIX):
+                os.unlink(tmp)
+            else:
+                os.rename(tmp, base + BATCH_SUFFIX)
+        except OSError:
+            pass
+
+    def _segment(self, suffix):
+        return os.path.join(self.path, 'spool-{}{}'.format(os.getpid(), suffix))
+
+    def put(self, record):
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            with open(self._segment(CURRENT_SUFFIX), 'a') as fp:
+                fp.write(line)
+                fp.flush()
+                if self.sync:
+                    fsync(fp.fileno())
+
+    def put_many(self, records):
+        if not records:
+            return
+        lines = ''.join(json.dumps(record) + '\n' for record in records)
+        with self.lock:
+            with open(self._segment(CURRENT_SUFFIX), 'a') as fp:
+                fp.write(lines)
+                fp.flush()
+                if self.sync:
+                    fsync(fp.fileno())
+
+    def _put_back(self, records, segment):
+        """
+        Writes failed records to a sealed segment named after ``segment``,
+        so they are delivered before the records spooled since.
+        """
+        if not records:
+            return
+        lines = ''.join(json.dumps(record) + '\n' for record in records)
+        tmp = segment + TMP_SUFFIX
+        with open(tmp, 'w') as fp:
+            fp.write(lines)
+            fp.flush()
+            if self.sync:
+                fsync(fp.fileno())
+        os.rename(tmp, segment[:-len(CLAIMED_SUFFIX)] + BATCH_SUFFIX)
+
+    def _seal(self):
+        current = self._segment(CURRENT_SUFFIX)
+        sealed = os.path.join(self.path, 'spool-{}-{:.6f}{}'.format(
+            os.getpid(), time.time(), BATCH_SUFFIX))
+        with self.lock:
+            if os.path.exists(current):
+                os.rename(current, sealed)
+
+    def _sealed_at(self, name):
+        # spool-<pid>-<time>.batch, recovered segments have no time
+        try:
+            return float(name.rsplit('.', 1)[0].split('-')[2])
+        except (IndexError, ValueError):
+            try:
+                return os.path.getmtime(os.path.join(self.path, name))
+            except OSError:
+                return 0
+
+    def _claim(self):
+        claimed = []
+        names = [name for name in os.listdir(self.path)
+                 if name.endswith(BATCH_SUFFIX)]
+        for name in sorted(names, key=lambda name: (self._sealed_at(name),
+                                                    name)):
+            if not name.endswith(BATCH_SUFFIX):
+                continue
+            src = os.path.join(self.path, name)
+            dst = src[:-len(BATCH_SUFFIX)] + CLAIMED_SUFFIX
+            try:
+                os.rename(src, dst)  # atomic, only one process wins
+            except OSError:
+                continue
+            claimed.append(dst)
+        return claimed
+
+    def _read(self, segment):
+        records = []
+        with open(segment) as fp:
+            for line in fp:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    log.error('Discarding corrupt spool record: %r', line)
+        return records
+
+    def _batches(self, records, blocked):
+        """
+        Splits ``records`` in batches of at most ``batch_size`` records and
+        one record per key, keeping the order of the records of each key.
+        Records of ``blocked`` keys are not delivered; keys of records that
+        fail while batches are consumed are added to ``blocked``.
+        """
+        if not self.key:
+            for start in range(0, len(records), self.batch_size):
+                yield records[start:start + self.batch_size], []
+            return
+
+        while records:
+            batch, held, rest, keys = [], [], [], set()
+            for record in records:
+                key = self.key(record)
+                if key in blocked:
+                    held.append(record)
+                elif key in keys or len(batch) >= self.batch_size:
+                    rest.append(record)
+                else:
+                    keys.add(key)
+                    batch.append(record)
+            yield batch, held
+            records = rest
+
+    def flush(self, handler):
+        """
+        Hands every spooled record to ``handler`` in lists of at most
+        ``batch_size`` records. ``handler`` returns the records that failed
+        and must be kept.
+
+        :returns: number of records delivered
+        """
+        self._seal()
+
+        with open(os.path.join(self.path, LOCK_NAME), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as err:
+                if err.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                # another process is flushing, its records come first
+                return 0
+            try:
+                return self._flush(handler)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _flush(self, handler):
+        delivered = 0
+
+        segments = self._claim()
+        if not segments:
+            return delivered
+
+        records = []
+        for segment in segments:
+            records.extend(self._read(segment))
+
+        failed = []
+        blocked = set()
+        for batch, held in self._batches(records, blocked):
+            failures = []
+            if batch:
+                try:
+                    failures = handler(batch) or []
+                except Exception as err:
+                    log.error(err)
+                    failures = batch
+            delivered += len(batch) - len(failures)
+            failed.extend(failures)
+            failed.extend(held)
+            if self.key:
+                blocked.update(self.key(record) for record in failures)
+
+        if self.key:
+            # later records of a key are held back after the failed one
+            order = dict((id(record), index)
+                         for index, record in enumerate(records))
+            failed.sort(key=lambda record: order.get(id(record), 0))
+
+        self._put_back(failed, segments[0])
+        for segment in segments:
+            os.unlink(segment)
+
+        return delivered
+
+    def pending(self):
+        count = 0
+        for name in os.listdir(self.path):
+            if name.endswith((CURRENT_SUFFIX, BATCH_SUFFIX, CLAIMED_SUFFIX)):
+                with open(os.path.join(self.path, name)) as fp:
+                    count += sum(1 for line in fp if line.strip())
+        return count
+
+    def start(self, handler):
+        """
+        Starts a daemon thread flushing the spool every ``interval`` seconds.
+        Under eventlet monkey patching this becomes a greenthread.
+        """
+        if self.flusher and self.flusher.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.flush(handler)
+                except Exception as err:
+                    log.error(err)
+
+        self.flusher = threading.Thread(target=run, name='swift-cloud-spool')
+        self.flusher.daemon = True
+        self.flusher.start()
@@ -1,54 +1,264 @@
 import logging
+import random
+import threading
+import time
 import requests
 import json
 
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+from swift.common.utils import config_true_value
+
+from swift_cloud.spool import DurableSpool
+from swift_cloud.batcher import RequestBatcher
+from swift_cloud.metrics import get_metrics
 
 log = logging.getLogger(__name__)
 
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def record_key(record):
+    # expirer registrations of one object are delivered in order
+    return (record.get('account'), record.get('container'),
+            record.get('object'))
+
 
 class SwiftCloudTools:
 
+    # sessions and spools are shared by every driver instance of a process,
+    # so connections are pooled across requests
+    _sessions = {}
+    _spools = {}
+    _batchers = {}
+    _batch_unsupported = set()
+    _lock = threading.Lock()
+
     def __init__(self, conf):
         self.api_token = conf.get('tools_api_token')
         self.api_url = conf.get('tools_api_url')
         self.expirer_url = self.api_url + '/v1/expirer/'
+        self.expirer_batch_url = self.api_url + conf.get(
+            'tools_api_batch_path', '/v1/expirer/batch/')
         self.container_info_url = self.api_url + '/v1/container-info/'
 
-    def add_delete_at(self, account, container, obj, date):
-        try:
-            res = requests.post(self.expirer_url,
-                data=json.dumps({
-                    'account': account,
-                    'container': container,
-                    'object': obj,
-                    'date': date
-                }),
-                headers={
+        self.timeout = (
+            float(conf.get('tools_api_connect_timeout', 2)),
+            float(conf.get('tools_api_read_timeout', 10))
+        )
+        self.retries = int(conf.get('tools_api_retries', 3))
+        self.backoff = float(conf.get('tools_api_backoff', 0.1))
+        self.backoff_max = float(conf.get('tools_api_backoff_max', 2))
+        self.pool_size = int(conf.get('tools_api_pool_size', 20))
+
+        self.session = self._get_session()
+        self.metrics = get_metrics(conf)
+
+        self.batch = config_true_value(conf.get('tools_api_batch', 'false'))
+
+        self.batcher = None
+        if self.batch:
+            self.batcher = self._get_batcher(conf)
+
+        self.spool = None
+        if config_true_value(conf.get('tools_api_async', 'false')):
+            self.spool = self._get_spool(conf)
+
+    def _get_session(self):
+        with self._lock:
+            session = self._sessions.get(self.api_url)
+            if not session:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.pool_size,
+                                      max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({
                     'Content-Type': 'application/json',
                     'X-Auth-Token': self.api_token
                 })
-            return True, res.text
+                self._sessions[self.api_url] = session
+            return session
+
+    def _get_spool(self, conf):
+        path = conf.get('tools_spool_dir', '/var/cache/swift/swift_cloud_spool')
+        with self._lock:
+            spool = self._spools.get(path)
+            if not spool:
+                spool = DurableSpool(
+                    path,
+                    batch_size=int(conf.get('tools_spool_batch_size', 100)),
+                    interval=float(conf.get('tools_spool_interval', 1)),
+                    sync=config_true_value(conf.get('tools_spool_fsync', 'true')),
+                    key=record_key)
+                self._spools[path] = spool
+        spool.start(self.deliver)
+        return spool
+
+    def _get_batcher(self, conf):
+        with self._lock:
+            batcher = self._batchers.get(self.api_url)
+            if not batcher:
+                batcher = RequestBatcher(
+                    self._batch_results,
+                    batch_size=int(conf.get('tools_batch_size', 100)),
+                    max_wait=float(conf.get('tools_batch_max_wait', 0.05)),
+                    queue_size=int(conf.get('tools_batch_queue_size', 10000)),
+                    enqueue_timeout=float(
+                        conf.get('tools_batch_enqueue_timeout', 1)),
+                    result_timeout=float(
+                        conf.get('tools_batch_result_timeout', 30)),
+                    workers=int(conf.get('tools_batch_workers', 2)),
+                    key=record_key)
+                self._batchers[self.api_url] = batcher
+            return batcher
+
+    def _sleep(self, attempt):
+        # exponential backoff with full jitter
+        delay = min(self.backoff_max, self.backoff * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+
+    def _operation(self, url):
+        if url == self.expirer_batch_url:
+            return 'expirer_batch'
+        if url.startswith(self.container_info_url):
+            return 'container_info'
+        return 'expirer'
+
+    def _request(self, method, url, payload):
+        data = json.dumps(payload)
+        attempt = 0
+
+        kwargs = {}
+        span = self.metrics.tracer.current()
+        if span:
+            kwargs['headers'] = {'traceparent': span.traceparent()}
+
+        while True:
+            start = time.time()
+            status = 'error'
+            try:
+                res = self.session.request(method, url, data=data,
+                                           timeout=self.timeout, **kwargs)
+                status = res.status_code
+                if res.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return res
+            except (requests.ConnectionError, requests.Timeout) as err:
+                if attempt >= self.retries:
+                    raise
+                log.warning('Tools API %s %s failed: %s', method, url, err)
+            finally:
+                self.metrics.record('tools', self._operation(url), status,
+                                    start, len(data))
+
+            self._sleep(attempt)
+            attempt += 1
+
+    def _send(self, record):
+        payload = dict((k, v) for k, v in record.items() if k != 'action')
+        method = 'POST' if record.get('action') == 'add' else 'DELETE'
+        return self._request(method, self.expirer_url, payload)
+
+    def _send_one(self, record):
+        try:
+            res = self._send(record)
+            return res.status_code, res.text
         except Exception as err:
             log.error(err)
-            return False, str(err)
+            return 0, str(err)
+
+    def _send_batch(self, records):
+        """
+        Sends records through the batch endpoint of the tools API.
+
+        :returns: one ``(status, message)`` tuple per record, status ``0``
+                  meaning the request could not be made at all
+        """
+        if self.api_url in self._batch_unsupported:
+            return [self._send_one(record) for record in records]
 
-    def remove_delete_at(self, account, container, obj):
         try:
-            res = requests.delete(self.expirer_url,
-                data=json.dumps({
-                    'account': account,
-                    'container': container,
-                    'object': obj
-                }),
-                headers={
-                    'Content-Type': 'application/json',
-                    'X-Auth-Token': self.api_token
-                })
-            return True, res.text
+            res = self._request('POST', self.expirer_batch_url,
+                                {'items': records})
         except Exception as err:
             log.error(err)
-            return False, str(err)
+            return [(0, str(err))] * len(records)
+
+        if res.status_code in (404, 405):
+            log.warning('Tools API has no batch endpoint, sending one by one')
+            self._batch_unsupported.add(self.api_url)
+            return [self._send_one(record) for record in records]
+
+        if not res.ok:
+            return [(res.status_code, res.text)] * len(records)
+
+        try:
+            results = res.json()['results']
+        except (ValueError, KeyError, TypeError):
+            return [(502, 'Invalid batch response')] * len(records)
+
+        if len(results) != len(records):
+            return [(502, 'Invalid batch response')] * len(records)
+
+        return [(int(item.get('status', 502)), item.get('message', ''))
+                for item in results]
+
+    def _batch_results(self, records):
+        return [(200 <= status < 300, msg)
+                for status, msg in self._send_batch(records)]
+
+    def _submit(self, record):
+        if self.spool:
+            try:
+                self.spool.put(record)
+                return True, 'queued'
+            except (IOError, OSError) as err:
+                log.error('Spool write failed, sending directly: %s', err)
+
+        if self.batcher:
+            return self.batcher.submit(record)
+
+        status, msg = self._send_one(record)
+        return 200 <= status < 300, msg
+
+    def deliver(self, records):
+        """
+        Sends spooled records to the tools API.
+
+        :returns: the records that failed with a transient error and must be
+                  retried; records rejected by the API are logged and dropped
+        """
+        if self.batch:
+            results = self._send_batch(records)
+        else:
+            results = [self._send_one(record) for record in records]
+
+        failed = []
+        for record, (status, msg) in zip(records, results):
+            if status == 0 or status in RETRY_STATUSES:
+                failed.append(record)
+            elif not 200 <= status < 300:
+                log.error('Expirer record %s rejected: %s', record, msg)
+        return failed
+
+    def add_delete_at(self, account, container, obj, date):
+        return self._submit({
+            'action': 'add',
+            'account': account,
+            'container': container,
+            'object': obj,
+            'date': date
+        })
+
+    def remove_delete_at(self, account, container, obj):
+        return self._submit({
+            'action': 'remove',
+            'account': account,
+            'container': container,
+            'object': obj
+        })
 
     def convert_timestamp_to_datetime(self, timestamp):
         try:
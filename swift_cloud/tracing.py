@@ -0,0 +1,288 @@
+"""
+Request tracing exported in the OpenTelemetry protocol (OTLP/JSON).
+
+A request sampled by the middleware opens a server span, continuing the
+trace of an incoming W3C ``traceparent`` header, and carries the Swift
+transaction id. Routing, driver handlers and every GCS and tools call
+timed by :class:`swift_cloud.metrics.Metrics` add child spans; GCS
+requests are sent with a ``traceparent`` header. Finished spans are
+buffered and written in batches, as JSON lines, to ``tracing_file`` or
+POSTed to an OTLP/HTTP collector at ``tracing_endpoint``.
+"""
+import os
+import json
+import time
+import random
+import logging
+import threading
+import contextlib
+
+from collections import deque
+
+import requests
+
+from swift.common.utils import close_if_possible, config_true_value
+
+from swift_cloud import context
+
+log = logging.getLogger(__name__)
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# process-wide tracer, configured by the first caller
+_tracer = None
+
+
+def get_tracer(conf):
+    global _tracer
+
+    if _tracer is None:
+        _tracer = Tracer(conf)
+    return _tracer
+
+
+def _random_id(bits):
+    return '{:0{}x}'.format(random.getrandbits(bits), bits // 4)
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def parse_traceparent(value):
+    """
+    :returns: ``(trace_id, parent_id, sampled)`` of a W3C traceparent
+              header, or None when it is missing or invalid
+    """
+    try:
+        version, trace_id, parent_id, flags = value.strip().split('-')
+        int(trace_id, 16), int(parent_id, 16)
+        sampled = bool(int(flags, 16) & 1)
+    except (AttributeError, ValueError):
+        return None
+    if len(trace_id) != 32 or len(parent_id) != 16 or \
+            trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id, sampled
+
+
+class Span:
+
+    def __init__(self, name, trace_id, parent_id=None, kind=KIND_INTERNAL,
+                 attributes=None, start=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _random_id(64)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start = start or time.time()
+        self.end = None
+        self.status = STATUS_OK
+
+    def traceparent(self):
+        return '00-{}-{}-01'.format(self.trace_id, self.span_id)
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(int(self.start * 1e9)),
+            'endTimeUnixNano': str(int((self.end or time.time()) * 1e9)),
+            'attributes': [_attribute(key, value) for key, value in
+                           sorted(self.attributes.items())],
+            'status': {'code': self.status}
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class SpanIter(object):
+    """
+    Response body iterator ending the request span once the body was
+    sent, or dropped by the server.
+    """
+
+    def __init__(self, app_iter, on_close):
+        self.app_iter = app_iter
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            yield chunk
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            close_if_possible(self.app_iter)
+            self.on_close()
+
+
+class Tracer:
+
+    def __init__(self, conf):
+        self.enabled = config_true_value(conf.get('tracing_enabled', 'false'))
+        self.sample_rate = float(conf.get('tracing_sample_rate', 1))
+        self.service = conf.get('tracing_service_name', 'swift-cloud')
+        self.path = conf.get('tracing_file')
+        self.endpoint = conf.get('tracing_endpoint')
+        self.batch_size = int(conf.get('tracing_batch_size', 512))
+        self.interval = float(conf.get('tracing_interval', 5))
+        self.max_queue = int(conf.get('tracing_max_queue', 10000))
+
+        self.queue = deque(maxlen=self.max_queue)
+        self.lock = threading.Lock()
+        self.flusher = None
+
+    def current(self):
+        return context.get('trace_span')
+
+    def start_request(self, environ):
+        """
+        Opens the server span of a request and makes it current, unless
+        the request is not sampled.
+        """
+        context.update(trace_span=None)
+        if not self.enabled:
+            return None
+
+        parent = parse_traceparent(environ.get('HTTP_TRACEPARENT'))
+        if parent:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = _random_id(128), None
+            sampled = random.random() < self.sample_rate
+        if not sampled:
+            return None
+
+        span = Span('swift_cloud.request', trace_id, parent_id, KIND_SERVER, {
+            'http.method': environ.get('REQUEST_METHOD'),
+            'http.target': environ.get('PATH_INFO'),
+            'swift.trans_id': environ.get('swift.trans_id', '')
+        })
+        context.update(trace_span=span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """
+        Child span of the current one, current while the block runs.
+        """
+        parent = self.current()
+        if not parent:
+            yield None
+            return
+
+        span = Span(name, parent.trace_id, parent.span_id,
+                    attributes=attributes)
+        context.update(trace_span=span)
+        try:
+            yield span
+        except Exception:
+            span.status = STATUS_ERROR
+            raise
+        finally:
+            context.update(trace_span=parent)
+            self.end(span)
+
+    def record(self, name, start, status=None, **attributes):
+        """
+        Adds a finished client span, under the current one, for a call
+        that started at ``start``.
+        """
+        parent = self.current()
+        if not parent:
+            return None
+
+        span = Span(name, parent.trace_id, parent.span_id, KIND_CLIENT,
+                    attributes, start)
+        if status is not None:
+            span.attributes['status'] = status
+            if status == 'error' or \
+                    (isinstance(status, int) and status >= 500):
+                span.status = STATUS_ERROR
+        self.end(span)
+        return span
+
+    def end(self, span, status=None):
+        span.end = time.time()
+        if status is not None:
+            span.attributes['http.status_code'] = status
+            if isinstance(status, int) and status >= 500:
+                span.status = STATUS_ERROR
+
+        # exported by the flusher, the oldest spans are dropped when the
+        # queue is full
+        self.queue.append(span)
+        self._start_flusher()
+
+    def _start_flusher(self):
+        if self.flusher and self.flusher.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.flush()
+                except Exception as err:
+                    log.error(err)
+
+        self.flusher = threading.Thread(target=run, name='swift-cloud-tracing')
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def _payload(self, spans):
+        return {'resourceSpans': [{
+            'resource': {'attributes': [
+                _attribute('service.name', self.service),
+                _attribute('process.pid', os.getpid())
+            ]},
+            'scopeSpans': [{
+                'scope': {'name': 'swift_cloud'},
+                'spans': [span.to_otlp() for span in spans]
+            }]
+        }]}
+
+    def _export(self, spans):
+        payload = json.dumps(self._payload(spans))
+        try:
+            if self.path:
+                with open(self.path, 'a') as fp:
+                    fp.write(payload + '\n')
+            if self.endpoint:
+                requests.post(self.endpoint, data=payload, timeout=5,
+                              headers={'Content-Type': 'application/json'})
+        except (IOError, OSError, requests.RequestException) as err:
+            log.error('Error exporting %d spans: %s', len(spans), err)
+
+    def flush(self):
+        """
+        Exports the queued spans in batches of ``batch_size``.
+
+        :returns: number of spans exported
+        """
+        exported = 0
+
+        with self.lock:
+            while self.queue:
+                spans = []
+                while self.queue and len(spans) < self.batch_size:
+                    spans.append(self.queue.popleft())
+                self._export(spans)
+                exported += len(spans)
+
+        return exported
@@ -0,0 +1,93 @@
+import json
+import threading
+
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+
+
+class FakeToolsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or '{}')
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _item_status(self, item):
+        if not item.get('object'):
+            return 400, 'Missing object'
+        if item.get('object') in self.server.reject:
+            return 400, 'Rejected'
+        return 200, 'ok'
+
+    def _handle(self, action):
+        server = self.server
+
+        if self.headers.get('X-Auth-Token') != server.token:
+            return self._reply(401, {'error': 'Unauthorized'})
+
+        if self.path == '/v1/expirer/batch/' and action == 'add':
+            if not server.batch:
+                return self._reply(404, {'error': 'Not Found'})
+            items = self._body().get('items', [])
+            server.batches.append(items)
+            results = []
+            for item in items:
+                status, msg = self._item_status(item)
+                results.append({'status': status, 'message': msg})
+            return self._reply(200, {'results': results})
+
+        if self.path == '/v1/expirer/':
+            item = self._body()
+            item['action'] = action
+            server.calls.append(item)
+            status, msg = self._item_status(item)
+            return self._reply(status, {'message': msg})
+
+        return self._reply(404, {'error': 'Not Found'})
+
+    def do_POST(self):
+        self._handle('add')
+
+    def do_DELETE(self):
+        self._handle('remove')
+
+
+class FakeToolsServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for the swift-cloud-tools API, serving the expirer
+    endpoints on a random port.
+    """
+    daemon_threads = True
+
+    def __init__(self, token='token', batch=True):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeToolsHandler)
+        self.token = token
+        self.batch = batch
+        self.reject = set()
+        self.calls = []
+        self.batches = []
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -1,8 +1,15 @@
+import io
+import json
+import time
+import tarfile
+
 from datetime import datetime, date
 from mock import patch, Mock
 from unittest import TestCase
 from swift.common.swob import Response, Request
-from swift_cloud.drivers.gcp import SwiftGCPDriver
+from google.cloud.exceptions import PreconditionFailed
+from swift_cloud.drivers.gcp import SwiftGCPDriver, is_expired, \
+    update_metadata, metadata_changes
 
 
 class FakeApp:
@@ -23,6 +30,7 @@ class FakeBlob:
         self.content_type = None
         self.etag = None
         self.metadata = {}
+        self.metageneration = 1
         self.cache_control = None
         self.content_encoding = None
         self.content_disposition = None
@@ -57,7 +65,7 @@ class FakeBlob:
     def upload_from_string(self, obj_data, content_type):
         pass
 
-    def delete(self):
+    def delete(self, **kwargs):
         pass
 
 
@@ -67,6 +75,8 @@ class FakeBucket:
         self.blob = blob
         self.blobs = blobs
         self.labels = labels
+        self.metageneration = 1
+        self.versioning_enabled = False
 
     def exists(self):
         return self._exists
@@ -105,6 +115,17 @@ class FakeReader(object):
         return x
 
 
+def make_driver(path, conf, method='GET', headers=None, body=None):
+    environ = {
+        'REQUEST_METHOD': method,
+        'swift.authorize': lambda req: False,
+        'wsgi.input': FakeReader()
+    }
+    req = Request.blank(path, environ=environ, headers=headers, body=body)
+
+    return SwiftGCPDriver(req, FakeApp(), conf)
+
+
 class SwiftGCPDriverTestCase(TestCase):
 
     @classmethod
@@ -459,3 +480,587 @@ class SwiftGCPDriverTestCase(TestCase):
         headers = {"x-delete-at": 1623767403}
         res = self._driver('/v1/account/container/object', 'PUT', headers).response()
         self.assertEquals(res.status_int, 500)
+
+
+class FakeExpiringBlob(FakeBlob):
+
+    def __init__(self, *args, **kwargs):
+        FakeBlob.__init__(self, *args, **kwargs)
+        self.custom_time = None
+        self.generation = None
+        self.rewrites = 0
+
+    def __setattr__(self, name, value):
+        # like GCS, merge metadata keys into the stored ones
+        if name == 'metadata' and value and self.__dict__.get('metadata'):
+            value = dict(self.__dict__['metadata'], **value)
+            value = dict((k, v) for k, v in value.items() if v is not None)
+        self.__dict__[name] = value
+
+    def upload_from_string(self, obj_data, content_type, **kwargs):
+        self.generation = 1
+
+    def patch(self, *args, **kwargs):
+        pass
+
+    def rewrite(self, source, token=None, **kwargs):
+        self.rewrites += 1
+        return None, 0, 0
+
+
+class FakeLifecycleBucket(FakeBucket):
+
+    def __init__(self, *args, **kwargs):
+        FakeBucket.__init__(self, *args, **kwargs)
+        self.name = 'account'
+        self.lifecycle_rules = []
+        self.patches = 0
+
+    def patch(self, *args, **kwargs):
+        self.patches += 1
+
+
+class SwiftGCPDriverExpirationTestCase(TestCase):
+
+    def setUp(self):
+        self.conf = {
+            'max_results': 999,
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token',
+            'expiration_mode': 'lifecycle'
+        }
+        self.bucket = FakeLifecycleBucket(blob=FakeExpiringBlob(), labels={})
+        self.mock_client = patch(
+            'swift_cloud.drivers.gcp.SwiftGCPDriver._get_client',
+            Mock()).start()
+        self.mock_client.return_value = FakeClient(bucket=self.bucket)
+        self.mock_add = patch(
+            'swift_cloud.tools.SwiftCloudTools.add_delete_at', Mock()).start()
+        self.mock_sweeper = patch(
+            'swift_cloud.drivers.gcp.ExpirySweeper', Mock()).start()
+        patch('swift_cloud.drivers.gcp._sweeper', None).start()
+        patch('swift_cloud.drivers.gcp._expiration_buckets', set()).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def _driver(self, path, method='GET', headers=None):
+        return make_driver(path, self.conf, method, headers)
+
+    def test_is_expired(self):
+        blob = FakeBlob()
+        self.assertFalse(is_expired(blob))
+        blob.metadata = {'x-delete-at': '100'}
+        self.assertTrue(is_expired(blob, now=100))
+        self.assertFalse(is_expired(blob, now=99))
+
+    def test_head_object_hides_expired_object(self):
+        self.bucket.blob.metadata = {'x-delete-at': str(int(time.time()) - 1)}
+        res = self._driver('/v1/account/container/object', 'HEAD').response()
+        self.assertEquals(res.status_int, 404)
+
+    def test_get_object_hides_expired_object(self):
+        self.bucket.blob.metadata = {'x-delete-at': str(int(time.time()) - 1)}
+        res = self._driver('/v1/account/container/object', 'GET').response()
+        self.assertEquals(res.status_int, 404)
+
+    def test_put_object_sets_custom_time_without_tools_api(self):
+        headers = {'X-Delete-After': '60'}
+        res = self._driver('/v1/account/container/object', 'PUT', headers).response()
+        self.assertEquals(res.status_int, 201)
+        self.assertFalse(self.mock_add.called)
+
+        blob = self.bucket.blob
+        delete_at = int(blob.metadata['x-delete-at'])
+        self.assertAlmostEqual(delete_at, time.time() + 60, delta=5)
+        self.assertEquals(blob.custom_time,
+                          datetime.utcfromtimestamp(delete_at))
+        self.assertIn({'action': {'type': 'Delete'},
+                       'condition': {'daysSinceCustomTime': 0}},
+                      self.bucket.lifecycle_rules)
+        self.mock_sweeper.return_value.schedule.assert_called_once_with(
+            delete_at, 'account', 'container', 'blob', 1)
+
+    def test_post_object_removing_deadline_rewrites_blob(self):
+        blob = self.bucket.blob
+        blob.generation = 1
+        blob.custom_time = datetime(2030, 1, 1)
+        blob.metadata = {'x-delete-at': '1893456000'}
+        headers = {'X-Remove-Delete-At': 'x'}
+        res = self._driver('/v1/account/container/object', 'POST', headers).response()
+        self.assertEquals(res.status_int, 202)
+        self.assertEquals(blob.rewrites, 1)
+        self.assertIsNone(blob.custom_time)
+
+
+class FakeBulkBlob:
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+        self.generation = None
+        self.metadata = None
+
+    def reload(self):
+        FakeBatch.current.calls.append(('reload', self))
+
+    def delete(self, **kwargs):
+        FakeBatch.current.calls.append(('delete', self))
+
+
+class FakeBulkBucket(FakeBucket):
+
+    def __init__(self, objects):
+        FakeBucket.__init__(self, blob=FakeBlob(folder=True),
+                            labels={'object-count': 10, 'bytes-used': 100})
+        self.objects = objects
+        self.patches = 0
+        self.blob = self._blob
+
+    def _blob(self, name):
+        return FakeBulkBlob(self, name)
+
+    def get_blob(self, name, *args, **kwargs):
+        if name.startswith('missing'):
+            return None
+        return self.container_blob
+
+    def patch(self, *args, **kwargs):
+        self.patches += 1
+
+
+class FakeBatch:
+    current = None
+    batches = []
+
+    def __init__(self, client):
+        self.calls = []
+        self.statuses = []
+
+    def __enter__(self):
+        FakeBatch.current = self
+        return self
+
+    def __exit__(self, *args):
+        FakeBatch.batches.append(self)
+        for op, blob in self.calls:
+            objects = blob.bucket.objects
+            if blob.name not in objects:
+                self.statuses.append(404)
+            elif op == 'reload':
+                blob.size = objects[blob.name]
+                blob.generation = 1
+                self.statuses.append(200)
+            else:
+                del objects[blob.name]
+                self.statuses.append(204)
+
+
+class SwiftGCPDriverBulkDeleteTestCase(TestCase):
+
+    def setUp(self):
+        self.conf = {
+            'max_results': 999,
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token'
+        }
+        self.bucket = FakeBulkBucket({
+            'container/a': 10,
+            'container/b': 20
+        })
+        self.bucket.container_blob = FakeExpiringBlob(folder=True)
+        self.bucket.container_blob.metadata = {
+            'object-count': 2, 'bytes-used': 30}
+        self.mock_client = patch(
+            'swift_cloud.drivers.gcp.SwiftGCPDriver._get_client',
+            Mock()).start()
+        self.mock_client.return_value = FakeClient(bucket=self.bucket)
+        patch('swift_cloud.drivers.gcp.TolerantBatch', FakeBatch).start()
+        FakeBatch.batches = []
+
+    def tearDown(self):
+        patch.stopall()
+
+    def _bulk_delete(self, names, headers=None):
+        body = '\n'.join(names)
+        headers = headers or {'Accept': 'application/json'}
+        driver = make_driver('/v1/account?bulk-delete', self.conf, 'POST',
+                             headers, body)
+        return driver.response()
+
+    def test_bulk_delete_objects(self):
+        res = self._bulk_delete(['/container/a', 'container/b',
+                                 '/container/c', '/missing/d'])
+        self.assertEquals(res.status_int, 200)
+        body = json.loads(res.body)
+        self.assertEquals(body['Number Deleted'], 2)
+        self.assertEquals(body['Number Not Found'], 2)
+        self.assertEquals(body['Response Status'], '200 OK')
+        self.assertEquals(body['Errors'], [])
+        self.assertEquals(self.bucket.objects, {})
+
+    def test_bulk_delete_updates_counters_once(self):
+        self._bulk_delete(['/container/a', '/container/b']).body
+        self.assertEquals(self.bucket.patches, 1)
+        self.assertEquals(self.bucket.labels['object-count'], 8)
+        self.assertEquals(self.bucket.labels['bytes-used'], 70)
+        self.assertEquals(self.bucket.container_blob.metadata,
+                          {'object-count': 0, 'bytes-used': 0})
+
+    def test_bulk_delete_uses_batches_of_100(self):
+        for i in range(150):
+            self.bucket.objects['container/{}'.format(i)] = 1
+        names = ['/container/{}'.format(i) for i in range(150)]
+        body = json.loads(self._bulk_delete(names).body)
+        self.assertEquals(body['Number Deleted'], 150)
+        self.assertEquals(len(FakeBatch.batches), 4)
+        self.assertEquals(max(len(b.calls) for b in FakeBatch.batches), 100)
+
+    def test_bulk_delete_plain_text_response(self):
+        res = self._bulk_delete(['/container/a'], {'Accept': 'text/plain'})
+        self.assertIn('Number Deleted: 1', res.body)
+
+    def test_bulk_delete_rejects_non_text_input(self):
+        headers = {'Accept': 'application/json',
+                   'Content-Type': 'application/json'}
+        body = json.loads(self._bulk_delete(['/container/a'], headers).body)
+        self.assertEquals(body['Response Status'], '406 Not Acceptable')
+
+
+class FakeUploadBlob:
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+        self.metadata = None
+        self.metageneration = 1
+
+    def upload_from_string(self, data, content_type=None,
+                           if_generation_match=None, **kwargs):
+        if if_generation_match == 0 and self.name in self.bucket.objects:
+            raise PreconditionFailed('exists')
+        self.size = len(data)
+        self.bucket.objects[self.name] = self
+        self.bucket.uploads.append(self.name)
+
+    def upload_from_file(self, file_obj, size=None, **kwargs):
+        self.bucket.streamed.append(self.name)
+        self.upload_from_string(file_obj.read(size), **kwargs)
+
+    def patch(self, *args, **kwargs):
+        pass
+
+
+class FakeUploadBucket(FakeBucket):
+
+    def __init__(self):
+        FakeBucket.__init__(self, labels={})
+        self.objects = {}
+        self.uploads = []
+        self.streamed = []
+        self.patches = 0
+        self.blob = self._blob
+
+    def _blob(self, name):
+        return FakeUploadBlob(self, name)
+
+    def get_blob(self, name, *args, **kwargs):
+        return self.objects.get(name)
+
+    def patch(self, *args, **kwargs):
+        self.patches += 1
+
+
+def make_tar(files, mode='w'):
+    buf = io.BytesIO()
+    tar = tarfile.open(fileobj=buf, mode=mode)
+    for name, data in files:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    tar.close()
+    return buf.getvalue()
+
+
+class SwiftGCPDriverBulkUploadTestCase(TestCase):
+
+    def setUp(self):
+        self.conf = {
+            'max_results': 999,
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token'
+        }
+        self.bucket = FakeUploadBucket()
+        self.mock_client = patch(
+            'swift_cloud.drivers.gcp.SwiftGCPDriver._get_client',
+            Mock()).start()
+        self.mock_client.return_value = FakeClient(bucket=self.bucket)
+
+    def tearDown(self):
+        patch.stopall()
+
+    def _extract(self, path, body, archive='tar'):
+        headers = {'Accept': 'application/json'}
+        driver = make_driver(path + '?extract-archive=' + archive, self.conf,
+                             'PUT', headers, body)
+        return json.loads(driver.response().body)
+
+    def test_extract_creates_objects_containers_and_folders(self):
+        body = make_tar([('cont/a/b/one.txt', b'one'),
+                         ('cont/a/two.txt', b'two'),
+                         ('other/three.txt', b'three')])
+        result = self._extract('/v1/account', body)
+        self.assertEquals(result['Response Status'], '201 Created')
+        self.assertEquals(result['Number Files Created'], 3)
+        self.assertEquals(sorted(self.bucket.uploads), [
+            'cont/', 'cont/a/', 'cont/a/b/', 'cont/a/b/one.txt',
+            'cont/a/two.txt', 'other/', 'other/three.txt'])
+
+    def test_extract_updates_counters_once(self):
+        body = make_tar([('cont/one.txt', b'one'), ('cont/two.txt', b'two')])
+        self._extract('/v1/account', body)
+        self.assertEquals(self.bucket.patches, 1)
+        self.assertEquals(self.bucket.labels['object-count'], 2)
+        self.assertEquals(self.bucket.labels['bytes-used'], 6)
+        self.assertEquals(self.bucket.labels['container-count'], 1)
+        self.assertEquals(self.bucket.objects['cont/'].metadata,
+                          {'object-count': 2, 'bytes-used': 6})
+
+    def test_extract_into_container_prefix_with_gzip(self):
+        body = make_tar([('one.txt', b'one')], mode='w:gz')
+        result = self._extract('/v1/account/cont/prefix', body, 'tar.gz')
+        self.assertEquals(result['Number Files Created'], 1)
+        self.assertIn('cont/prefix/one.txt', self.bucket.objects)
+
+    def test_extract_overwrite_counts_size_delta(self):
+        self._extract('/v1/account', make_tar([('cont/one.txt', b'one')]))
+        self._extract('/v1/account', make_tar([('cont/one.txt', b'longer')]))
+        self.assertEquals(self.bucket.labels['object-count'], 1)
+        self.assertEquals(self.bucket.labels['bytes-used'], 6)
+
+    def test_extract_streams_large_members(self):
+        self.conf['bulk_buffer_size'] = 4
+        body = make_tar([('cont/small.txt', b'one'),
+                         ('cont/large.txt', b'larger')])
+        result = self._extract('/v1/account', body)
+        self.assertEquals(result['Number Files Created'], 2)
+        self.assertEquals(self.bucket.streamed, ['cont/large.txt'])
+        self.assertEquals(self.bucket.objects['cont/large.txt'].size, 6)
+        self.assertEquals(self.bucket.labels['bytes-used'], 9)
+
+    def test_extract_counts_members_uploaded_before_error(self):
+        self.conf['bulk_max_containers_per_extraction'] = 1
+        body = make_tar([('cont/one.txt', b'one'), ('other/two.txt', b'two')])
+        result = self._extract('/v1/account', body)
+        self.assertEquals(result['Response Status'], '400 Bad Request')
+        self.assertEquals(self.bucket.labels['object-count'], 1)
+        self.assertEquals(self.bucket.labels['bytes-used'], 3)
+        self.assertEquals(self.bucket.labels['container-count'], 2)
+
+    def test_extract_invalid_archive(self):
+        result = self._extract('/v1/account', b'not a tar file')
+        self.assertEquals(result['Response Status'], '400 Bad Request')
+
+    def test_extract_unsupported_format(self):
+        driver = make_driver('/v1/account?extract-archive=zip', self.conf,
+                             'PUT', {}, b'')
+        self.assertEquals(driver.response().status_int, 400)
+
+
+class FakeVersionedBlob:
+    """
+    Blob whose stored metadata moves on under the driver: the first
+    conditional patch fails as if a concurrent update won.
+    """
+
+    def __init__(self, metadata, concurrent=None):
+        self.name = 'container/'
+        self.metadata = metadata
+        self.metageneration = 1
+        self.stored = dict(metadata)
+        self.concurrent = concurrent
+        self.patched = []
+
+    def patch(self, if_metageneration_match=None, **kwargs):
+        if self.concurrent:
+            self.stored.update(self.concurrent)
+            self.concurrent = None
+            self.metageneration += 1
+        if if_metageneration_match != self.metageneration:
+            raise PreconditionFailed('metageneration')
+        self.patched.append(self.metadata)
+        self.stored.update(self.metadata)
+        self.stored = dict((k, v) for k, v in self.stored.items()
+                           if v is not None)
+        self.metadata = dict(self.stored)
+        self.metageneration += 1
+
+    def reload(self, **kwargs):
+        self.metadata = dict(self.stored)
+
+
+class MetadataUpdateTestCase(TestCase):
+
+    def test_metadata_changes(self):
+        current = {'a': '1', 'b': '2', 'c': '3'}
+        self.assertEquals(
+            metadata_changes(current, {'a': 1, 'b': '20', 'c': None, 'd': 4}),
+            {'b': '20', 'c': None, 'd': 4})
+        self.assertEquals(metadata_changes(current, {'a': '1'}),
+                          {'b': None, 'c': None})
+
+    def test_patches_changed_keys(self):
+        blob = FakeVersionedBlob({'object-count': '1', 'meta-a': 'x'})
+
+        def update(metadata):
+            metadata['meta-b'] = 'y'
+            return metadata
+
+        self.assertTrue(update_metadata(blob, update))
+        self.assertEquals(blob.patched, [{'meta-b': 'y'}])
+        self.assertEquals(blob.stored, {'object-count': '1', 'meta-a': 'x',
+                                        'meta-b': 'y'})
+        self.assertFalse(update_metadata(blob, update))
+
+    def test_conflicting_update_is_merged(self):
+        blob = FakeVersionedBlob({'object-count': '1', 'bytes-used': '10'},
+                                 concurrent={'object-count': '5'})
+
+        def update(metadata):
+            metadata['object-count'] = int(metadata['object-count']) + 1
+            return metadata
+
+        self.assertTrue(update_metadata(blob, update))
+        self.assertEquals(blob.stored,
+                          {'object-count': 6, 'bytes-used': '10'})
+
+    def test_gives_up_on_a_hot_resource(self):
+        blob = FakeVersionedBlob({'object-count': '1'})
+        blob.patch = Mock(side_effect=PreconditionFailed('metageneration'))
+
+        def update(metadata):
+            metadata['object-count'] = 2
+            return metadata
+
+        with patch('swift_cloud.drivers.gcp.METADATA_UPDATE_ATTEMPTS', 3):
+            self.assertRaises(PreconditionFailed, update_metadata, blob,
+                              update)
+        self.assertEquals(blob.patch.call_count, 3)
+
+
+class FakeGenerationBlob(FakeBlob):
+
+    def __init__(self, bucket, name):
+        FakeBlob.__init__(self)
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+        self.content_encoding = None
+
+    def upload_from_string(self, data, content_type=None,
+                           if_generation_match=None, **kwargs):
+        self.bucket.uploads.append(if_generation_match)
+        current = self.bucket.objects.get(self.name)
+        generation = current.generation if current else 0
+        if if_generation_match not in (None, generation):
+            raise PreconditionFailed('generation')
+        self.generation = generation + 1
+        self.size = len(data)
+        self.bucket.objects[self.name] = self
+
+    def patch(self, *args, **kwargs):
+        pass
+
+
+class FakeGenerationBucket(FakeBucket):
+
+    def __init__(self):
+        FakeBucket.__init__(self, labels={})
+        self.objects = {}
+        self.uploads = []
+        self.reads = []
+        self.blob = self._blob
+        self._blob('container/').upload_from_string('')
+        self.uploads = []
+
+    def _blob(self, name):
+        return FakeGenerationBlob(self, name)
+
+    def get_blob(self, name, *args, **kwargs):
+        self.reads.append(name)
+        return self.objects.get(name)
+
+    def patch(self, *args, **kwargs):
+        pass
+
+
+class SwiftGCPDriverConditionalPutTestCase(TestCase):
+
+    def setUp(self):
+        self.conf = {
+            'max_results': 999,
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token'
+        }
+        self.bucket = FakeGenerationBucket()
+        self.mock_client = patch(
+            'swift_cloud.drivers.gcp.SwiftGCPDriver._get_client',
+            Mock()).start()
+        self.mock_client.return_value = FakeClient(bucket=self.bucket)
+        patch('swift_cloud.drivers.gcp._generations', None).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def _put(self, body, headers=None):
+        driver = make_driver('/v1/account/container/obj', self.conf, 'PUT',
+                             headers, body)
+        return driver.response()
+
+    def test_new_object_is_read_before_upload(self):
+        self.assertEquals(self._put(b'data').status_int, 201)
+        self.assertEquals(self.bucket.uploads, [0])
+        self.assertEquals(self.bucket.reads.count('container/obj'), 1)
+        self.assertEquals(self.bucket.labels['object-count'], 1)
+        self.assertEquals(self.bucket.labels['bytes-used'], 4)
+
+    def test_overwrite_of_cached_object(self):
+        self._put(b'data')
+        self.bucket.uploads = []
+        self.bucket.reads = []
+        self.assertEquals(self._put(b'longer data').status_int, 201)
+        self.assertEquals(self.bucket.uploads, [1])
+        self.assertNotIn('container/obj', self.bucket.reads)
+        self.assertEquals(self.bucket.labels['object-count'], 1)
+        self.assertEquals(self.bucket.labels['bytes-used'], 11)
+
+    def test_overwrite_of_uncached_object(self):
+        self.bucket.blob('container/obj').upload_from_string(
+            b'old')
+        self.bucket.uploads = []
+        self.assertEquals(self._put(b'data').status_int, 201)
+        # the body is sent once, on the generation read first
+        self.assertEquals(self.bucket.uploads, [1])
+        self.assertEquals(self.bucket.labels['object-count'], 0)
+        self.assertEquals(self.bucket.labels['bytes-used'], 1)
+
+    def test_stale_cache(self):
+        self._put(b'data')
+        self.bucket.blob('container/obj').upload_from_string(
+            b'other writer')
+        self.bucket.uploads = []
+        self.assertEquals(self._put(b'data').status_int, 201)
+        self.assertEquals(self.bucket.uploads, [1, 2])
+        self.assertEquals(self.bucket.labels['object-count'], 1)
+        self.assertEquals(self.bucket.labels['bytes-used'], 0)
+
+    def test_if_none_match(self):
+        headers = {'If-None-Match': '*'}
+        self.assertEquals(self._put(b'data', headers).status_int, 201)
+        self.assertEquals(self._put(b'data', headers).status_int, 412)
+        self.assertEquals(self.bucket.uploads, [0, 0])
+        self.assertNotIn('container/obj', self.bucket.reads)
+        self.assertEquals(self.bucket.objects['container/obj'].generation, 1)
+        self.assertEquals(self.bucket.labels['object-count'], 1)
@@ -0,0 +1,30 @@
+import time
+
+from mock import Mock
+from unittest import TestCase
+from swift_cloud.expirer import ExpirySweeper
+
+
+class ExpirySweeperTestCase(TestCase):
+
+    def test_expires_entries_when_deadline_passes(self):
+        expire = Mock()
+        sweeper = ExpirySweeper(expire)
+        self.assertTrue(sweeper.schedule(time.time() + 0.1, 'account', 'obj'))
+
+        for _ in range(50):
+            if expire.called:
+                break
+            time.sleep(0.05)
+
+        expire.assert_called_once_with('account', 'obj')
+
+    def test_ignores_deadlines_beyond_horizon(self):
+        sweeper = ExpirySweeper(Mock(), horizon=10)
+        self.assertFalse(sweeper.schedule(time.time() + 60, 'account', 'obj'))
+        self.assertEquals(sweeper.heap, [])
+
+    def test_bounded_number_of_entries(self):
+        sweeper = ExpirySweeper(Mock(), max_entries=1)
+        self.assertTrue(sweeper.schedule(time.time() + 60, 'account', 'a'))
+        self.assertFalse(sweeper.schedule(time.time() + 60, 'account', 'b'))
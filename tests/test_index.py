@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import shutil
+import tempfile
+
+from datetime import datetime
+from mock import patch, Mock
+from unittest import TestCase
+from swift_cloud.drivers import gcp
+from swift_cloud.drivers.index import ListingIndex
+from tests.test_driver_gcp import make_driver
+
+
+class FakeIndexBlob:
+
+    def __init__(self, name, size=1):
+        self.name = name
+        self.size = size
+        self.md5_hash = 'hash'
+        self.content_type = 'text/plain'
+        self.updated = datetime(2021, 4, 4)
+        self.metadata = {}
+        if name.endswith('/'):
+            self.content_type = 'application/directory'
+
+
+NAMES = ['container/', 'container/a/', 'container/a/1', 'container/a/2',
+         'container/b', 'container/c/d/e', 'container/f']
+
+
+class ListingIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.index = ListingIndex(self.tmp + '/index.db', max_age=60)
+        self.index.sync('account', 'container',
+                        [FakeIndexBlob(n) for n in NAMES])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _list(self, **kwargs):
+        return [item.get('name') or item.get('subdir')
+                for item in self.index.list('account', 'container', **kwargs)]
+
+    def test_listing(self):
+        self.assertEquals(self._list(), ['a/', 'a/1', 'a/2', 'b', 'c/d/e', 'f'])
+        self.assertEquals(self._list(limit=2), ['a/', 'a/1'])
+        self.assertEquals(self._list(marker='a/2', end_marker='f'),
+                          ['b', 'c/d/e'])
+
+    def test_delimiter_listing(self):
+        self.assertEquals(self._list(delimiter='/'), ['a/', 'b', 'c/', 'f'])
+        self.assertEquals(self._list(delimiter='/', prefix='a/'),
+                          ['a/', 'a/1', 'a/2'])
+        self.assertEquals(self._list(delimiter='/', prefix='c/'), ['c/d/'])
+        self.assertEquals(self._list(delimiter='/', marker='a/'),
+                          ['b', 'c/', 'f'])
+        self.assertEquals(self._list(delimiter='/', limit=3), ['a/', 'b', 'c/'])
+
+    def test_put_and_delete(self):
+        self.index.put('account', 'container', u'é', 1, 'hash', 'text/plain',
+                       '2021-04-04T00:00:00')
+        self.index.delete('account', 'container', 'b')
+        self.assertEquals(self._list(delimiter='/'), ['a/', 'c/', 'f', u'é'])
+
+    def test_put_ignores_containers_not_indexed(self):
+        self.index.put('account', 'other', 'obj', 1, 'hash', 'text/plain',
+                       '2021-04-04T00:00:00')
+        self.assertEquals(self.index.list('account', 'other'), [])
+
+    def test_sync_streams_listing(self):
+        def listing():
+            for i in range(5):
+                # written while the listing is read, nothing waits
+                self.index.put('account', 'container', 'new', 1, 'hash',
+                               'text/plain', '2021-04-04T00:00:00')
+                yield FakeIndexBlob('container/{}'.format(i))
+
+        index = ListingIndex(self.tmp + '/index.db', timeout=0.1)
+        with patch('swift_cloud.drivers.index.SYNC_CHUNK_SIZE', 2):
+            index.sync('account', 'container', listing())
+        self.assertEquals(self._list(), ['0', '1', '2', '3', '4'])
+
+    def test_staleness(self):
+        self.assertTrue(self.index.is_warm('account', 'container'))
+        self.assertFalse(self.index.needs_sync('account', 'container'))
+        self.index.sync('account', 'container', [], time.time() - 45)
+        self.assertTrue(self.index.is_warm('account', 'container'))
+        self.assertTrue(self.index.needs_sync('account', 'container'))
+        self.index.drop('account', 'container')
+        self.assertFalse(self.index.is_warm('account', 'container'))
+
+
+class SwiftGCPDriverIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.conf = {
+            'max_results': 999,
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token',
+            'listing_index': 'true',
+            'listing_index_path': self.tmp + '/index.db'
+        }
+        self.blobs = [FakeIndexBlob(n) for n in NAMES]
+        self.bucket = Mock()
+        self.bucket.get_blob = Mock(return_value=self.blobs[0])
+        self.bucket.list_blobs = Mock(return_value=self.blobs)
+        self.mock_client = patch(
+            'swift_cloud.drivers.gcp.SwiftGCPDriver._get_client',
+            Mock()).start()
+        self.mock_client.return_value = Mock(
+            get_bucket=Mock(return_value=self.bucket))
+        patch('swift_cloud.drivers.gcp.SwiftGCPDriver._shards',
+              Mock(return_value=0)).start()
+        gcp._listing_index = None
+
+    def tearDown(self):
+        patch.stopall()
+        gcp._listing_index = None
+        shutil.rmtree(self.tmp)
+
+    def test_cold_index_falls_back_and_syncs(self):
+        driver = make_driver('/v1/account/container?delimiter=/', self.conf)
+        index = driver._index()
+        index.sync_async = Mock()
+
+        res = driver.response()
+        self.assertEquals(res.status_int, 200)
+        self.assertTrue(self.bucket.list_blobs.called)
+        self.assertTrue(index.sync_async.called)
+
+    def test_warm_index_answers_locally(self):
+        driver = make_driver('/v1/account/container?delimiter=/&prefix=a/',
+                             self.conf)
+        driver._index().sync('account', 'container', self.blobs)
+
+        res = driver.response()
+        names = [item['name'] for item in json.loads(res.body)]
+        self.assertEquals(names, ['a/', 'a/1', 'a/2'])
+        self.assertFalse(self.bucket.list_blobs.called)
+
+    def test_prefix_is_a_folder_like_in_gcs(self):
+        driver = make_driver('/v1/account/container?delimiter=/&prefix=a',
+                             self.conf)
+        driver._index().sync('account', 'container', self.blobs)
+
+        res = driver.response()
+        names = [item['name'] for item in json.loads(res.body)]
+        self.assertEquals(names, ['a/', 'a/1', 'a/2'])
+
+    def test_expired_objects_leave_the_index(self):
+        index = make_driver('/v1/account/container', self.conf)._index()
+        index.sync('account', 'container', self.blobs)
+
+        blob = Mock(generation=1, size=1,
+                    metadata={'x-delete-at': str(int(time.time()) - 1)})
+        self.bucket.get_blob = Mock(side_effect=[blob, None])
+        self.assertTrue(gcp.expire_object(
+            Mock(get_bucket=Mock(return_value=self.bucket)), 'account',
+            'container', 'container/b', 1))
+        self.assertNotIn('b', [item['name'] for item in
+                               index.list('account', 'container')])
+
+    def test_bulk_changes_drop_the_index(self):
+        driver = make_driver('/v1/account/container', self.conf)
+        index = driver._index()
+        index.sync('account', 'container', self.blobs)
+
+        driver.account = 'account'
+        driver._index_drop('container')
+        self.assertFalse(index.is_warm('account', 'container'))
@@ -0,0 +1,141 @@
+from mock import patch, Mock
+from unittest import TestCase
+from swift_cloud.drivers.listing import partitions, list_partitioned, \
+    usage_partitioned, PageTokenCache
+from tests.test_driver_gcp import make_driver
+
+
+class FakeListingBlob:
+
+    def __init__(self, name, size=1):
+        self.name = name
+        self.size = size
+
+
+class FakeListingBucket:
+
+    def __init__(self, names):
+        self.names = sorted(names)
+        self.calls = []
+
+    def list_blobs(self, prefix='', start_offset=None, end_offset=None,
+                   **kwargs):
+        self.calls.append((start_offset, end_offset))
+        return [FakeListingBlob(n) for n in self.names
+                if n.startswith(prefix) and
+                (start_offset is None or n >= start_offset) and
+                (end_offset is None or n < end_offset)]
+
+
+class ListingTestCase(TestCase):
+
+    def setUp(self):
+        names = ['container/']
+        for first in '-0Aa_z~':
+            names += ['container/{}{}'.format(first, i) for i in range(5)]
+        names += ['other/a']
+        self.bucket = FakeListingBucket(names)
+
+    def test_partitions_are_contiguous(self):
+        ranges = partitions('c/', 4)
+        self.assertEquals(len(ranges), 4)
+        self.assertIsNone(ranges[0][0])
+        self.assertIsNone(ranges[-1][1])
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEquals(end, start)
+
+    def test_partitions_are_clipped_to_offsets(self):
+        ranges = partitions('c/', 16, 'c/b', 'c/d')
+        self.assertEquals(ranges[0][0], 'c/b')
+        self.assertEquals(ranges[-1][1], 'c/d')
+        self.assertTrue(all(start < end for start, end in ranges))
+
+    def test_list_partitioned_matches_sequential_listing(self):
+        expected = [b.name for b in self.bucket.list_blobs('container/')]
+        blobs = list_partitioned(self.bucket, 'container/', count=8)
+        self.assertEquals([b.name for b in blobs], expected)
+        self.assertEquals(len(self.bucket.calls), 1 + 8)
+
+    def test_list_partitioned_with_offsets(self):
+        blobs = list_partitioned(self.bucket, 'container/', count=8,
+                                 start_offset='container/A2',
+                                 end_offset='container/a1')
+        names = [b.name for b in blobs]
+        self.assertEquals(names[0], 'container/A2')
+        self.assertEquals(names[-1], 'container/a0')
+
+    def test_usage_partitioned(self):
+        usage = usage_partitioned(self.bucket, 'container/',
+                                  lambda b: not b.name.endswith('/'))
+        self.assertEquals(usage, (35, 35))
+
+
+class SwiftGCPDriverListAllTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = FakeListingBucket(
+            ['container/{}'.format(i) for i in range(36)])
+        patch('swift_cloud.drivers.gcp.SwiftGCPDriver._get_client',
+              Mock()).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def _list_all(self, object_count):
+        driver = make_driver('/v1/account/container', {
+            'max_results': 999,
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token',
+            'listing_partition_threshold': 100
+        })
+        return list(driver._list_all(self.bucket, 'container/',
+                                     object_count=object_count))
+
+    def test_small_containers_are_listed_in_one_call(self):
+        self.assertEquals(len(self._list_all(99)), 36)
+        self.assertEquals(self.bucket.calls, [(None, None)])
+
+    def test_large_containers_are_partitioned(self):
+        self.assertEquals(len(self._list_all(100)), 36)
+        self.assertEquals(len(self.bucket.calls), 16)
+
+
+class FakeMemcache:
+
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, time=0):
+        self.store[key] = value
+
+
+class PageTokenCacheTestCase(TestCase):
+
+    def test_get_and_set(self):
+        cache = PageTokenCache()
+        cache.set(('account', 'c/'), 'c/obj', 'token')
+        self.assertEquals(cache.get(('account', 'c/'), 'c/obj'), 'token')
+        self.assertIsNone(cache.get(('account', 'other/'), 'c/obj'))
+
+    def test_entries_expire(self):
+        cache = PageTokenCache(ttl=-1)
+        cache.set(('account',), 'c/obj', 'token')
+        self.assertIsNone(cache.get(('account',), 'c/obj'))
+
+    def test_oldest_entries_are_evicted(self):
+        cache = PageTokenCache(max_entries=2)
+        for name in ['a', 'b', 'c']:
+            cache.set(('account',), name, 'token-' + name)
+        self.assertIsNone(cache.get(('account',), 'a'))
+        self.assertEquals(cache.get(('account',), 'c'), 'token-c')
+
+    def test_uses_memcache(self):
+        cache = PageTokenCache()
+        memcache = FakeMemcache()
+        cache.set(('account',), 'c/obj', 'token', memcache)
+        self.assertEquals(len(memcache.store), 1)
+        self.assertEquals(cache.get(('account',), 'c/obj', memcache), 'token')
+        self.assertEquals(cache.entries, {})
@@ -0,0 +1,188 @@
+import time
+
+from mock import patch, Mock
+from unittest import TestCase
+from swift_cloud import context, metrics
+from swift.common.swob import Request, Response
+from swift_cloud.metrics import Metrics, SpanRecorder, gcs_operation, \
+    set_context, start_spans
+from swift_cloud.middleware import SwiftCloudMiddleware
+from swift_cloud.tools import SwiftCloudTools
+
+API = 'https://storage.googleapis.com'
+
+
+class FakeStatsdClient:
+
+    def __init__(self):
+        self.calls = []
+
+    def timing_since(self, name, start):
+        self.calls.append(('timing', name))
+
+    def increment(self, name):
+        self.calls.append(('increment', name))
+
+    def update_stats(self, name, value):
+        self.calls.append(('update_stats', name, value))
+
+    def timing(self, name, value):
+        self.calls.append(('timing', name, value))
+
+
+def make_metrics():
+    m = Metrics({})
+    m.client = FakeStatsdClient()
+    return m
+
+
+class GCSOperationTestCase(TestCase):
+
+    def test_operations(self):
+        cases = [
+            ('GET', '/storage/v1/b', 'list_buckets'),
+            ('POST', '/storage/v1/b?project=p', 'create_bucket'),
+            ('GET', '/storage/v1/b/bucket', 'get_bucket'),
+            ('PATCH', '/storage/v1/b/bucket', 'patch_bucket'),
+            ('GET', '/storage/v1/b/bucket/o?prefix=c/', 'list_blobs'),
+            ('GET', '/storage/v1/b/bucket/o/c%2Fo', 'get_blob'),
+            ('GET', '/storage/v1/b/bucket/o/c%2Fo?alt=media', 'download'),
+            ('GET', '/download/storage/v1/b/bucket/o/c%2Fo?alt=media',
+             'download'),
+            ('PATCH', '/storage/v1/b/bucket/o/c%2Fo', 'patch_blob'),
+            ('DELETE', '/storage/v1/b/bucket/o/c%2Fo', 'delete_blob'),
+            ('POST', '/storage/v1/b/bucket/o/c%2Fo/rewriteTo/b/bucket/o/x',
+             'rewriteto'),
+            ('POST', '/upload/storage/v1/b/bucket/o?uploadType=multipart',
+             'upload'),
+            ('POST', '/batch/storage/v1', 'batch'),
+        ]
+        for method, path, operation in cases:
+            self.assertEquals(gcs_operation(method, API + path), operation)
+
+
+class MetricsTestCase(TestCase):
+
+    def tearDown(self):
+        set_context(None, None)
+
+    def test_disabled_without_statsd_host(self):
+        self.assertIsNone(Metrics({}).client)
+        self.assertIsNone(Metrics({'log_statsd_host': 'localhost',
+                                   'metrics_enabled': 'false'}).client)
+        self.assertIsNotNone(Metrics({'log_statsd_host': 'localhost'}).client)
+
+        client = Mock()
+        self.assertEquals(Metrics({}).instrument(client), client)
+        self.assertFalse(client._http.called)
+
+    def test_record_names(self):
+        m = make_metrics()
+        set_context('GET', 'container')
+        m.record('gcs', 'list_blobs', 200, time.time(), 10)
+        self.assertEquals(m.client.calls, [
+            ('timing', 'gcs.list_blobs.GET.container.timing'),
+            ('increment', 'gcs.list_blobs.GET.container.200'),
+            ('update_stats', 'gcs.list_blobs.GET.container.bytes', 10)
+        ])
+
+    def test_timing(self):
+        m = make_metrics()
+        m.timing('replication', 'lag', 1500)
+        self.assertEquals(m.client.calls,
+                          [('timing', 'replication.lag', 1500)])
+
+    def test_instrument_session(self):
+        m = make_metrics()
+        session = Mock()
+        request = session.request
+        request.return_value = Mock(
+            status_code=200, headers={'content-length': '5'})
+        client = Mock(_http=session)
+        set_context('HEAD', 'object')
+
+        m.instrument(client)
+        client._http.request('GET', API + '/storage/v1/b/bucket',
+                             data=b'abc')
+        self.assertIn(('increment', 'gcs.get_bucket.HEAD.object.200'),
+                      m.client.calls)
+        self.assertIn(('update_stats', 'gcs.get_bucket.HEAD.object.bytes', 8),
+                      m.client.calls)
+
+        request.side_effect = IOError('boom')
+        m.client.calls = []
+        self.assertRaises(IOError, client._http.request, 'DELETE',
+                          API + '/storage/v1/b/bucket/o/obj')
+        self.assertIn(('increment', 'gcs.delete_blob.HEAD.object.error'),
+                      m.client.calls)
+
+    def test_tools_requests(self):
+        m = make_metrics()
+        with patch.object(metrics, '_metrics', m):
+            tools = SwiftCloudTools({'tools_api_url': 'http://tools',
+                                     'tools_api_token': 'token'})
+        tools.session = Mock()
+        tools.session.request.return_value = Mock(status_code=201)
+
+        tools.add_delete_at('account', 'container', 'obj', 'date')
+        self.assertIn(('increment', 'tools.expirer.NONE.none.201'),
+                      m.client.calls)
+
+
+class SpanRecorderTestCase(TestCase):
+
+    def tearDown(self):
+        context.update(spans=None)
+
+    def test_spans(self):
+        spans = SpanRecorder(max_spans=2)
+        spans.add('gcs.get_bucket', 10, 10.0125)
+        spans.add('tools.expirer', 10, 10.5)
+        spans.add('gcs.patch_blob', 10, 11)
+
+        self.assertTrue(spans.header().startswith(
+            'gcs.get_bucket;dur=12.5, tools.expirer;dur=500.0, total;dur='))
+        self.assertEquals(spans.summary(), 'gcs.get_bucket=12.5ms '
+                          'tools.expirer=500.0ms dropped=1')
+
+    def test_record_adds_spans_without_statsd(self):
+        spans = start_spans()
+        Metrics({}).record('gcs', 'list_blobs', 200, time.time())
+        self.assertEquals([name for name, _ in spans.spans],
+                          ['gcs.list_blobs'])
+
+    def test_instrument_when_only_spans_enabled(self):
+        client = Mock()
+        request = client._http.request
+        Metrics({'timing_header': 'true'}).instrument(client)
+        self.assertNotEquals(client._http.request, request)
+
+
+class TimingMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        patch('swift_cloud.middleware.Credentials', Mock()).start()
+        patch('swift_cloud.middleware.storage', Mock()).start()
+        self.conf = {'cloud_providers': 'gcp', 'timing_header': 'true',
+                     'slow_request_threshold': '0.000001'}
+
+    def tearDown(self):
+        patch.stopall()
+        context.update(spans=None)
+
+    def test_timing_header_and_slow_log(self):
+        app = SwiftCloudMiddleware(
+            lambda env, start_response: Response(body='ok')(
+                env, start_response), self.conf)
+        app.client.get_bucket.side_effect = Exception('no bucket')
+
+        with patch('swift_cloud.middleware.log') as mock_log:
+            resp = Request.blank('/v1/account/container/obj', headers={
+                'X-Cloud-Timing': 'true'}).get_response(app)
+        self.assertIn('middleware.label_lookup;dur=',
+                      resp.headers['X-Cloud-Timing'])
+        self.assertTrue(mock_log.warning.called)
+        self.assertIn('Slow request', mock_log.warning.call_args[0][0])
+
+        resp = Request.blank('/v1/account/container/obj').get_response(app)
+        self.assertNotIn('X-Cloud-Timing', resp.headers)
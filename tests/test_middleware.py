@@ -75,3 +75,78 @@ class MiddlewareTestCase(TestCase):
             'meta': {'cloud': 'gcp'}}
         res = Request(self.environ).get_response(self.app)
         self.assertEquals(res.body, "Fake GCP Driver")
+
+
+class FakeMissingGCPDriver:
+    def response(self):
+        return Response(status=404, body='Not Found')
+
+
+class MigrationReadThroughTestCase(TestCase):
+
+    def setUp(self):
+        patch('swift_cloud.middleware.Credentials', Mock()).start()
+        patch('swift_cloud.middleware.storage', Mock()).start()
+        patch('swift_cloud.middleware.SwiftGCPDriver',
+              Mock(return_value=FakeMissingGCPDriver())).start()
+        self.conf = {
+            'cloud_providers': 'gcp',
+            'gcp_credentials': 'credentials.json',
+            'migration_promote': 'true'
+        }
+        self.labels = {'account-meta-cloud': 'gcp',
+                       'account-meta-cloud-migration': 'gcp'}
+
+    def tearDown(self):
+        patch.stopall()
+
+    def _handler(self, path, method='GET', conf=None):
+        app = SwiftCloudMiddleware(FakeApp(), conf or self.conf)
+        app.promoter = Mock()
+        req = Request.blank(path, environ={'REQUEST_METHOD': method})
+        return app, app.gcp_handler(req, self.labels)
+
+    def test_object_miss_reads_from_swift_and_promotes(self):
+        app, handler = self._handler('/v1/account/container/obj')
+        self.assertEquals(handler, app.app)
+        self.assertEquals(app.promoter.promote.call_args[0][2:],
+                          ('container', 'obj'))
+
+    def test_promoted_name_is_unquoted(self):
+        app, handler = self._handler('/v1/account/container/a%20b.txt')
+        self.assertEquals(handler, app.app)
+        self.assertEquals(app.promoter.promote.call_args[0][2:],
+                          ('container', 'a b.txt'))
+
+    def test_head_is_not_promoted(self):
+        app, handler = self._handler('/v1/account/container/obj', 'HEAD')
+        self.assertEquals(handler, app.app)
+        self.assertFalse(app.promoter.promote.called)
+
+    def test_object_delete_is_sent_to_swift(self):
+        app, handler = self._handler('/v1/account/container/obj', 'DELETE')
+        self.assertEquals(handler.status_int, 200)
+        self.assertEquals(handler.body, b'Fake App')
+
+        patch('swift_cloud.middleware.SwiftGCPDriver',
+              Mock(return_value=FakeGCPDriver())).start()
+        swift = Mock(side_effect=FakeApp())
+        app = SwiftCloudMiddleware(swift, self.conf)
+        req = Request.blank('/v1/account/container/obj',
+                            environ={'REQUEST_METHOD': 'DELETE'})
+        handler = app.gcp_handler(req, self.labels)
+        self.assertEquals(handler.body, b'Fake GCP Driver')
+        self.assertTrue(swift.called)
+
+    def test_gcs_response_kept_for_writes_listings_and_trash(self):
+        for path, method in (('/v1/account/container/obj', 'PUT'),
+                             ('/v1/account/.trash-container/obj', 'DELETE'),
+                             ('/v1/account/container', 'GET'),
+                             ('/v1/account/.trash-container/obj', 'GET')):
+            app, handler = self._handler(path, method)
+            self.assertEquals(handler.status_int, 404)
+
+    def test_read_through_disabled(self):
+        conf = dict(self.conf, migration_read_through='false')
+        app, handler = self._handler('/v1/account/container/obj', conf=conf)
+        self.assertEquals(handler.status_int, 404)
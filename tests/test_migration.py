@@ -0,0 +1,373 @@
+import os
+import base64
+import shutil
+import hashlib
+import tempfile
+
+from unittest import TestCase
+from swift.common.swob import HeaderKeyDict, Response
+from google.cloud.exceptions import PreconditionFailed
+from swift_cloud.migration import AccountMigrator, Checkpoint, IterReader, \
+    MigrationError, Promoter, copy_object, object_metadata
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+class FakeMigrationBlob:
+
+    def __init__(self, bucket, name, chunk_size=None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+        self.metadata = None
+        self.cache_control = None
+        self.content_disposition = None
+        self.content_type = None
+        self.md5_hash = None
+        self.data = None
+        self.size = None
+        self.metageneration = 1
+        self.saved = {}
+
+    def _store(self, data, content_type, if_generation_match=None):
+        if if_generation_match == 0 and self.name in self.bucket.blobs:
+            raise PreconditionFailed('exists')
+        self.data = data
+        self.size = len(data)
+        self.saved = dict(self.metadata or {})
+        self.content_type = content_type
+        digest = hashlib.md5(self.bucket.corrupt or data).digest()
+        self.md5_hash = base64.b64encode(digest).decode('ascii')
+        self.bucket.blobs[self.name] = self
+
+    def upload_from_file(self, fp, size=None, content_type=None, **kwargs):
+        data = b''
+        while True:
+            chunk = fp.read(3)
+            if not chunk:
+                break
+            data += chunk
+        self._store(data, content_type, kwargs.get('if_generation_match'))
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        self._store(data.encode('utf-8'), content_type,
+                    kwargs.get('if_generation_match'))
+
+    def patch(self, **kwargs):
+        self.saved.update(self.metadata or {})
+        self.saved = dict((k, v) for k, v in self.saved.items()
+                          if v is not None)
+        self.metadata = dict(self.saved)
+        self.metageneration += 1
+
+    def delete(self):
+        self.bucket.blobs.pop(self.name, None)
+
+
+class FakeMigrationBucket:
+
+    def __init__(self):
+        self.name = 'account'
+        self.blobs = {}
+        self.labels = {'account-meta-cloud-migration': 'gcp'}
+        self.corrupt = None
+        self.patched = False
+        self.metageneration = 1
+
+    def blob(self, name, chunk_size=None):
+        return FakeMigrationBlob(self, name, chunk_size)
+
+    def get_blob(self, name):
+        return self.blobs.get(name)
+
+    def list_blobs(self, prefix='', start_offset='', **kwargs):
+        return [self.blobs[n] for n in sorted(self.blobs)
+                if n.startswith(prefix) and n >= start_offset]
+
+    def patch(self, **kwargs):
+        self.patched = True
+        self.metageneration += 1
+
+
+class FakeMigrationClient:
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get_bucket(self, *args, **kwargs):
+        return self.bucket
+
+    def list_buckets(self):
+        return [self.bucket]
+
+
+class FakeResponse:
+
+    def __init__(self, headers):
+        self.headers = HeaderKeyDict(headers)
+
+
+class FakeSwift:
+
+    def __init__(self, containers):
+        self.containers = containers
+        self.gets = []
+
+    def make_path(self, account, container=None):
+        return '/'.join(p for p in ('/v1', account, container) if p)
+
+    def make_request(self, method, path, headers, acceptable_statuses):
+        if path.count('/') == 3:
+            return FakeResponse({'X-Container-Object-Count': 2,
+                                 'X-Container-Bytes-Used': 10,
+                                 'X-Container-Meta-Color': 'blue'})
+        return FakeResponse({'X-Account-Container-Count': 1,
+                             'X-Account-Object-Count': 2,
+                             'X-Account-Bytes-Used': 10})
+
+    def iter_containers(self, account):
+        return [{'name': name} for name in sorted(self.containers)]
+
+    def iter_objects(self, account, container, marker=''):
+        for name, (content_type, data) in \
+                sorted(self.containers[container].items()):
+            if name > marker:
+                yield {'name': name, 'bytes': len(data), 'hash': md5(data),
+                       'content_type': content_type}
+
+    def get_object(self, account, container, obj, headers):
+        self.gets.append(obj)
+        content_type, data = self.containers[container][obj]
+        return 200, HeaderKeyDict({
+            'Content-Length': len(data),
+            'Content-Type': content_type,
+            'Etag': md5(data),
+            'X-Object-Meta-Owner': 'me'
+        }), iter([data[:4], data[4:]])
+
+
+class IterReaderTestCase(TestCase):
+
+    def test_read(self):
+        reader = IterReader([b'abc', b'defg', b'h'])
+        self.assertEquals(reader.read(2), b'ab')
+        self.assertEquals(reader.read(4), b'cdef')
+        self.assertEquals(reader.tell(), 6)
+        self.assertEquals(reader.read(), b'gh')
+        self.assertEquals(reader.read(1), b'')
+        self.assertEquals(reader.md5.hexdigest(), md5(b'abcdefgh'))
+
+    def test_seek(self):
+        reader = IterReader([b'abc'])
+        reader.read(1)
+        self.assertEquals(reader.seek(1), 1)
+        self.assertRaises(IOError, reader.seek, 0)
+
+
+class CopyObjectTestCase(TestCase):
+
+    def test_metadata(self):
+        headers = HeaderKeyDict({'X-Object-Meta-Owner': 'me',
+                                 'X-Delete-At': '1700000000',
+                                 'Content-Encoding': 'gzip',
+                                 'Content-Type': 'text/plain'})
+        self.assertEquals(object_metadata(headers), {
+            'owner': 'me',
+            'x-delete-at': '1700000000',
+            'Content-Encoding': 'gzip'
+        })
+
+    def test_copy_verifies_md5(self):
+        bucket = FakeMigrationBucket()
+        headers = HeaderKeyDict({'Content-Length': 5, 'Etag': md5(b'hello')})
+
+        blob = copy_object(bucket, 'c/o', headers, [b'hel', b'lo'])
+        self.assertEquals(blob.data, b'hello')
+
+        bucket.corrupt = b'oops'
+        self.assertRaises(MigrationError, copy_object, bucket, 'c/p',
+                          headers, [b'hel', b'lo'])
+        self.assertNotIn('c/p', bucket.blobs)
+
+    def test_copy_manifest_uses_streamed_md5(self):
+        bucket = FakeMigrationBucket()
+        headers = HeaderKeyDict({'Content-Length': 5, 'Etag': '"slo-etag"',
+                                 'X-Static-Large-Object': 'true'})
+        blob = copy_object(bucket, 'c/o', headers, [b'hello'])
+        self.assertEquals(blob.data, b'hello')
+
+
+class AccountMigratorTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.bucket = FakeMigrationBucket()
+        self.swift = FakeSwift({'c': {
+            'a': ('text/plain', b'hello'),
+            'dir/': ('application/directory', b''),
+            'dir/b': ('text/plain', b'world')
+        }})
+        self.migrator = AccountMigrator(
+            self.swift, FakeMigrationClient(self.bucket), self.tmp,
+            concurrency=2, page_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_migrate_account(self):
+        self.assertEquals(self.migrator.pending_accounts(), ['account'])
+        self.assertEquals(self.migrator.migrate_account('account'), 10)
+
+        self.assertEquals(sorted(self.bucket.blobs),
+                          ['c/', 'c/a', 'c/dir/', 'c/dir/b'])
+        self.assertEquals(self.bucket.blobs['c/a'].metadata, {'owner': 'me'})
+        self.assertEquals(self.bucket.blobs['c/dir/'].content_type,
+                          'application/directory')
+        self.assertEquals(self.bucket.blobs['c/'].metadata, {
+            'meta-color': 'blue', 'object-count': 3, 'bytes-used': 10})
+        self.assertEquals(self.swift.gets, ['a', 'dir/b'])
+
+        self.assertTrue(self.bucket.patched)
+        self.assertEquals(self.bucket.labels['account-meta-cloud'], 'gcp')
+        self.assertNotIn('account-meta-cloud-migration', self.bucket.labels)
+        self.assertEquals(self.bucket.labels['container-count'], 1)
+        self.assertEquals(self.bucket.labels['object-count'], 3)
+        self.assertEquals(self.bucket.labels['bytes-used'], 10)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp,
+                                                     'account.json')))
+
+    def test_resume_skips_copied_objects(self):
+        Checkpoint(self.tmp, 'account').save('c', 'a')
+        self.migrator.migrate_account('account')
+        self.assertEquals(self.swift.gets, ['dir/b'])
+
+        # objects already in GCS are not copied again
+        self.swift.gets = []
+        self.migrator.migrate_account('account')
+        self.assertEquals(self.swift.gets, ['a'])
+        self.assertEquals(self.bucket.labels['object-count'], 3)
+
+    def test_objects_written_to_gcs_are_kept_and_counted(self):
+        self.bucket.labels.update({'container-count': 1, 'object-count': 1,
+                                   'bytes-used': 3})
+        container = self.bucket.blob('c/')
+        container.upload_from_string('')
+        container.metadata = {'object-count': 1, 'bytes-used': 3}
+        container.patch()
+        newer = self.bucket.blob('c/a')
+        newer.upload_from_string('new')
+
+        self.migrator.migrate_account('account')
+        self.assertEquals(self.bucket.blobs['c/a'].data, b'new')
+        self.assertEquals(self.swift.gets, ['dir/b'])
+        self.assertEquals(self.bucket.blobs['c/'].metadata, {
+            'meta-color': 'blue', 'object-count': 3, 'bytes-used': 8})
+        self.assertEquals(self.bucket.labels['container-count'], 1)
+        self.assertEquals(self.bucket.labels['object-count'], 3)
+
+    def test_failed_objects_are_retried_on_next_run(self):
+        get_object = self.swift.get_object
+
+        def failing_get_object(account, container, obj, headers):
+            if obj == 'a':
+                raise IOError('connection reset')
+            return get_object(account, container, obj, headers)
+
+        self.swift.get_object = failing_get_object
+        self.assertEquals(self.migrator.migrate_account('account'), 5)
+        self.assertEquals(sorted(self.bucket.blobs),
+                          ['c/', 'c/dir/', 'c/dir/b'])
+        # not complete yet
+        self.assertIn('account-meta-cloud-migration', self.bucket.labels)
+        checkpoint = Checkpoint(self.tmp, 'account')
+        self.assertEquals(checkpoint.state['done'], ['c'])
+        self.assertEquals([item['name'] for item in
+                           checkpoint.state['failed']['c']], ['a'])
+
+        self.swift.get_object = get_object
+        self.swift.gets = []
+        self.assertEquals(self.migrator.migrate_account('account'), 5)
+        self.assertEquals(self.swift.gets, ['a'])
+        self.assertEquals(self.bucket.blobs['c/'].metadata['object-count'], 3)
+        self.assertNotIn('account-meta-cloud-migration', self.bucket.labels)
+        self.assertFalse(os.path.exists(checkpoint.path))
+
+    def test_copy_does_not_replace_newer_blobs(self):
+        headers = HeaderKeyDict({'Content-Length': 5, 'Etag': md5(b'hello')})
+        self.bucket.blob('c/a').upload_from_string('new')
+        self.assertIsNone(copy_object(self.bucket, 'c/a', headers,
+                                      [b'hello']))
+        self.assertEquals(self.bucket.blobs['c/a'].data, b'new')
+
+
+class FakeSwiftApp:
+
+    def __init__(self, body=b'hello', status=200):
+        self.body = body
+        self.status = status
+        self.requests = []
+
+    def __call__(self, environ, start_response):
+        self.requests.append(environ)
+        return Response(body=self.body, status=self.status,
+                        headers={'Etag': md5(self.body)})(
+            environ, start_response)
+
+
+class PromoterTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = FakeMigrationBucket()
+        self.bucket.blobs['c/'] = FakeMigrationBlob(self.bucket, 'c/')
+        self.env = {'PATH_INFO': '/v1/account/c/o', 'REQUEST_METHOD': 'GET'}
+
+    def test_promote(self):
+        app = FakeSwiftApp()
+        promoter = Promoter(app)
+        self.assertTrue(promoter.promote(self.env, self.bucket, 'c', 'o'))
+        promoter.pool.waitall()
+
+        self.assertEquals(self.bucket.blobs['c/o'].data, b'hello')
+        self.assertEquals(self.bucket.blobs['c/'].metadata, {
+            'object-count': 1, 'bytes-used': 5})
+        self.assertEquals(self.bucket.labels['object-count'], 1)
+        self.assertEquals(app.requests[0]['swift.source'], 'SCP')
+        self.assertFalse(promoter.running)
+
+    def test_promote_escaped_name(self):
+        app = FakeSwiftApp()
+        promoter = Promoter(app)
+        env = dict(self.env, PATH_INFO='/v1/account/c/a b.txt')
+        promoter.promote(env, self.bucket, 'c', 'a b.txt')
+        promoter.pool.waitall()
+
+        self.assertIn('c/a b.txt', self.bucket.blobs)
+        self.assertEquals(app.requests[0]['PATH_INFO'], '/v1/account/c/a b.txt')
+
+    def test_does_not_overwrite_client_writes(self):
+        self.bucket.blob('c/o').upload_from_string('new')
+        promoter = Promoter(FakeSwiftApp())
+        promoter.promote(self.env, self.bucket, 'c', 'o')
+        promoter.pool.waitall()
+
+        self.assertEquals(self.bucket.blobs['c/o'].data, b'new')
+        self.assertNotIn('object-count', self.bucket.labels)
+
+    def test_skips_large_and_missing_objects(self):
+        promoter = Promoter(FakeSwiftApp(status=404))
+        promoter.promote(self.env, self.bucket, 'c', 'o')
+        promoter.pool.waitall()
+        self.assertNotIn('c/o', self.bucket.blobs)
+
+        promoter = Promoter(FakeSwiftApp(), max_size=2)
+        promoter.promote(self.env, self.bucket, 'c', 'o')
+        promoter.pool.waitall()
+        self.assertNotIn('c/o', self.bucket.blobs)
+
+    def test_drops_promotions_when_busy(self):
+        promoter = Promoter(FakeSwiftApp(), concurrency=1)
+        self.assertTrue(promoter.promote(self.env, self.bucket, 'c', 'o'))
+        self.assertFalse(promoter.promote(self.env, self.bucket, 'c', 'p'))
+        promoter.pool.waitall()
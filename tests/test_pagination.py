@@ -0,0 +1,144 @@
+import json
+
+from datetime import datetime
+from mock import patch, Mock
+from unittest import TestCase
+from swift_cloud.drivers import gcp
+from tests.test_driver_gcp import make_driver
+
+
+class FakePageBlob:
+
+    def __init__(self, name):
+        self.name = name
+        self.size = 1
+        self.md5_hash = 'hash'
+        self.content_type = 'text/plain'
+        if name.endswith('/'):
+            self.content_type = 'application/directory'
+        self.updated = datetime(2021, 4, 4)
+        self.metadata = {'object-count': 1, 'bytes-used': 1}
+
+
+class FakePage(list):
+    next_page_token = None
+
+
+class FakePageBucket:
+    """
+    Bucket listing sorted names, with page tokens holding the position
+    of the next item.
+    """
+
+    def __init__(self, names):
+        self.names = sorted(names)
+        self.labels = {}
+        self.calls = []
+
+    def get_blob(self, name, *args, **kwargs):
+        if name in self.names:
+            return FakePageBlob(name)
+
+    def list_blobs(self, prefix='', delimiter=None, start_offset=None,
+                   end_offset=None, max_results=None, page_token=None,
+                   **kwargs):
+        self.calls.append({'start_offset': start_offset,
+                           'page_token': page_token,
+                           'max_results': max_results})
+        names = [n for n in self.names if n.startswith(prefix) and
+                 (end_offset is None or n < end_offset)]
+        if delimiter:
+            names = [n for n in names
+                     if delimiter not in n[len(prefix):].rstrip(delimiter)]
+
+        if page_token:
+            start = int(page_token)
+        else:
+            start = len([n for n in names if start_offset and n < start_offset])
+        end = start + max_results if max_results else len(names)
+
+        page = FakePage(FakePageBlob(n) for n in names[start:end])
+        if end < len(names):
+            page.next_page_token = str(end)
+        return page
+
+
+class SwiftGCPDriverPaginationTestCase(TestCase):
+
+    def setUp(self):
+        self.conf = {
+            'max_results': 999,
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token'
+        }
+        self.mock_client = patch(
+            'swift_cloud.drivers.gcp.SwiftGCPDriver._get_client',
+            Mock()).start()
+        gcp._page_tokens = None
+
+    def tearDown(self):
+        patch.stopall()
+
+    def _use(self, bucket):
+        self.mock_client.return_value = Mock(
+            get_bucket=Mock(return_value=bucket))
+        return bucket
+
+    def _names(self, path, key='name'):
+        res = make_driver(path, self.conf).response()
+        return [item[key] for item in json.loads(res.body or '[]')]
+
+    def test_container_paging_continues_cursor(self):
+        names = ['container/obj-{}'.format(i) for i in range(10)]
+        bucket = self._use(FakePageBucket(['container/'] + names))
+
+        page = self._names('/v1/account/container?limit=4')
+        self.assertEquals(page, ['obj-0', 'obj-1', 'obj-2', 'obj-3'])
+
+        page = self._names('/v1/account/container?limit=4&marker=obj-3')
+        self.assertEquals(page, ['obj-4', 'obj-5', 'obj-6', 'obj-7'])
+        self.assertEquals(bucket.calls[-1]['page_token'], '5')
+        self.assertIsNone(bucket.calls[-1]['start_offset'])
+
+        page = self._names('/v1/account/container?limit=4&marker=obj-7')
+        self.assertEquals(page, ['obj-8', 'obj-9'])
+
+    def test_unknown_marker_seeks(self):
+        names = ['container/obj-{}'.format(i) for i in range(10)]
+        bucket = self._use(FakePageBucket(['container/'] + names))
+
+        page = self._names('/v1/account/container?limit=2&marker=obj-5')
+        self.assertEquals(page, ['obj-6', 'obj-7'])
+        self.assertEquals(bucket.calls[-1]['start_offset'],
+                          'container/obj-5')
+
+    def test_account_paging_continues_cursor(self):
+        names = ['c{}/'.format(i) for i in range(6)]
+        bucket = self._use(FakePageBucket(names))
+
+        page = self._names('/v1/account?limit=3')
+        self.assertEquals(page, ['c0', 'c1', 'c2'])
+        self.assertEquals(bucket.calls[-1]['max_results'], 3)
+
+        page = self._names('/v1/account?limit=3&marker=c2')
+        self.assertEquals(page, ['c3', 'c4', 'c5'])
+        self.assertEquals(bucket.calls[-1]['page_token'], '3')
+
+    def test_account_listing_is_bounded(self):
+        names = ['c{}/'.format(i) for i in range(6)] + ['d0/']
+        bucket = self._use(FakePageBucket(names))
+
+        page = self._names('/v1/account')
+        self.assertEquals(len(page), 7)
+        self.assertEquals(bucket.calls[-1]['max_results'], 10000)
+
+        page = self._names('/v1/account?prefix=c&marker=c1&end_marker=c4')
+        self.assertEquals(page, ['c2', 'c3'])
+
+        res = make_driver('/v1/account?limit=10001', self.conf).response()
+        self.assertEquals(res.status_int, 412)
+
+    def test_account_listing_limit_zero(self):
+        bucket = self._use(FakePageBucket(['c0/']))
+        self.assertEquals(self._names('/v1/account?limit=0'), [])
+        self.assertEquals(bucket.calls, [])
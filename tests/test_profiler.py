@@ -0,0 +1,76 @@
+import os
+import signal
+import shutil
+import pstats
+import tempfile
+
+from mock import patch, Mock
+from unittest import TestCase
+from swift.common.swob import Request, Response
+from swift_cloud.profiler import ProfilingMiddleware
+from swift_cloud.middleware import filter_factory
+
+
+def fake_app(environ, start_response):
+    body = ''.join(str(i) for i in range(100))
+    return Response(body=body)(environ, start_response)
+
+
+class ProfilingMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.conf = {'profile_enabled': 'true', 'profile_sample_rate': '1',
+                     'profile_interval': '3600', 'profile_dir': self.tmp}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_samples_and_dumps(self):
+        app = ProfilingMiddleware(fake_app, self.conf)
+        for _ in range(3):
+            self.assertEquals(Request.blank('/').get_response(app).status_int,
+                              200)
+        self.assertEquals(app.samples, 3)
+
+        filename = app.dump()
+        self.assertTrue(filename.startswith(self.tmp))
+        self.assertIn('fake_app', str(pstats.Stats(filename).stats.keys()))
+        self.assertIsNone(app.stats)
+        self.assertIsNone(app.dump())
+
+    def test_dumps_after_interval(self):
+        app = ProfilingMiddleware(fake_app, dict(self.conf,
+                                                 profile_interval='0'))
+        Request.blank('/').get_response(app)
+        self.assertEquals(len(os.listdir(self.tmp)), 1)
+
+    def test_disabled_or_not_sampled(self):
+        app = ProfilingMiddleware(fake_app, dict(self.conf,
+                                                 profile_enabled='false'))
+        Request.blank('/').get_response(app)
+        app.enabled, app.sample_rate = True, 0
+        Request.blank('/').get_response(app)
+        self.assertEquals(app.samples, 0)
+
+    def test_signal_toggles(self):
+        handler = signal.getsignal(signal.SIGUSR2)
+        try:
+            app = ProfilingMiddleware(fake_app, dict(
+                self.conf, profile_enabled='false',
+                profile_signal='SIGUSR2'))
+            os.kill(os.getpid(), signal.SIGUSR2)
+            self.assertTrue(app.enabled)
+            Request.blank('/').get_response(app)
+            os.kill(os.getpid(), signal.SIGUSR2)
+            self.assertFalse(app.enabled)
+            self.assertEquals(len(os.listdir(self.tmp)), 1)
+        finally:
+            signal.signal(signal.SIGUSR2, handler)
+
+    @patch('swift_cloud.middleware.SwiftCloudMiddleware', Mock())
+    def test_filter_factory_wraps_only_when_configured(self):
+        app = filter_factory({})(fake_app)
+        self.assertNotIsInstance(app, ProfilingMiddleware)
+        app = filter_factory({}, **self.conf)(fake_app)
+        self.assertIsInstance(app, ProfilingMiddleware)
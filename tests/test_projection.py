@@ -0,0 +1,46 @@
+from mock import Mock
+from unittest import TestCase
+from google.cloud.exceptions import NotFound
+from swift_cloud.drivers.projection import ProjectedBucket, ProjectedClient, \
+    BLOB_FIELDS, LIST_FIELDS
+
+
+def fake_client(response=None, error=None):
+    client = Mock(spec=ProjectedClient)
+    client._connection = Mock()
+    client._connection.api_request = Mock(return_value=response,
+                                          side_effect=error)
+    return client
+
+
+class ProjectionTestCase(TestCase):
+
+    def test_get_blob_requests_fields(self):
+        client = fake_client({'name': 'container/obj', 'size': '10'})
+        bucket = ProjectedBucket(client, name='account')
+
+        blob = bucket.get_blob('container/obj', timeout=30)
+
+        self.assertEquals(blob.size, 10)
+        _, kwargs = client._connection.api_request.call_args
+        self.assertEquals(kwargs['query_params']['fields'], BLOB_FIELDS)
+        self.assertEquals(kwargs['query_params']['projection'], 'noAcl')
+        # later calls on the blob are not projected
+        self.assertNotIn('fields', blob._query_params)
+
+    def test_get_blob_not_found(self):
+        client = fake_client(error=NotFound('missing'))
+        bucket = ProjectedBucket(client, name='account')
+        self.assertIsNone(bucket.get_blob('container/obj'))
+
+    def test_list_blobs_requests_fields(self):
+        client = fake_client()
+        bucket = ProjectedBucket(client, name='account')
+
+        bucket.list_blobs(prefix='container/')
+        _, kwargs = client.list_blobs.call_args
+        self.assertEquals(kwargs['fields'], LIST_FIELDS)
+
+        bucket.list_blobs(prefix='container/', fields='items(name)')
+        _, kwargs = client.list_blobs.call_args
+        self.assertEquals(kwargs['fields'], 'items(name)')
@@ -0,0 +1,290 @@
+import json
+import time
+
+from mock import patch, Mock
+from unittest import TestCase
+from google.cloud.exceptions import PreconditionFailed
+from swift_cloud.drivers import purge
+from swift_cloud.drivers.purge import PurgeJob
+from tests.test_driver_gcp import make_driver
+
+
+class FakePurgeBlob:
+
+    def __init__(self, name, size=1, metadata=None, bucket=None,
+                 generation=1, time_deleted=None):
+        self.name = name
+        self.size = size
+        self.metadata = metadata
+        self.bucket = bucket
+        self.generation = generation
+        self.time_deleted = time_deleted
+
+    def patch(self, *args, **kwargs):
+        # metadata keys are merged into the stored blob
+        stored = self.bucket.objects[self.name]
+        stored.metadata = dict(stored.metadata or {}, **self.metadata)
+
+
+class FakePurgeBucket:
+
+    def __init__(self, names, fail=()):
+        self.objects = dict((name, FakePurgeBlob(name)) for name in names)
+        self.fail = set(fail)
+        self.labels = {'container-count': 0}
+        self.deleted = False
+        self.patches = 0
+        self.metageneration = 1
+        # labels written by another process, seen once reloaded
+        self.stored_labels = None
+        self.versioning_enabled = False
+        self.noncurrent = []
+
+    def list_blobs(self, prefix='', delimiter=None, start_offset=None,
+                   end_offset=None, versions=False, **kwargs):
+        names = sorted(n for n in self.objects if n.startswith(prefix) and
+                       (start_offset is None or n >= start_offset) and
+                       (end_offset is None or n < end_offset))
+        if delimiter:
+            names = [n for n in names if n.count('/') == 1 and n[-1] == '/']
+        blobs = [self.objects[name] for name in names]
+        if versions:
+            blobs += [blob for blob in self.noncurrent
+                      if blob.name.startswith(prefix)]
+            blobs.sort(key=lambda blob: blob.name)
+        return blobs
+
+    def get_blob(self, name, *args, **kwargs):
+        return self.objects.get(name)
+
+    def blob(self, name):
+        return FakePurgeBlob(name, bucket=self)
+
+    def delete_blob(self, name, generation=None):
+        FakePurgeBatch.current.names.append(name)
+        FakePurgeBatch.current.generations.append(generation)
+
+    def patch(self, if_metageneration_match=None, **kwargs):
+        if self.stored_labels is not None:
+            raise PreconditionFailed('metageneration changed')
+        self.patches += 1
+        self.metageneration += 1
+
+    def reload(self, *args, **kwargs):
+        if self.stored_labels is not None:
+            self.labels, self.stored_labels = self.stored_labels, None
+            self.metageneration += 1
+
+    def delete(self):
+        self.deleted = True
+
+
+class FakePurgeClient:
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get_bucket(self, *args, **kwargs):
+        return self.bucket
+
+
+class FakePurgeBatch:
+    current = None
+    bucket = None
+    sizes = []
+
+    def __init__(self, client):
+        self.names = []
+        self.generations = []
+        self.statuses = []
+
+    def __enter__(self):
+        FakePurgeBatch.current = self
+        return self
+
+    def __exit__(self, *args):
+        objects = FakePurgeBatch.bucket.objects
+        FakePurgeBatch.sizes.append(len(self.names))
+        noncurrent = FakePurgeBatch.bucket.noncurrent
+        for name, generation in zip(self.names, self.generations):
+            archived = [blob for blob in noncurrent
+                        if (blob.name, blob.generation) == (name, generation)]
+            if name in FakePurgeBatch.bucket.fail:
+                self.statuses.append(500)
+            elif archived:
+                noncurrent.remove(archived[0])
+                self.statuses.append(204)
+            elif objects.pop(name, None):
+                self.statuses.append(204)
+            else:
+                self.statuses.append(404)
+
+
+class PurgeJobTestCase(TestCase):
+
+    def setUp(self):
+        patch('swift_cloud.drivers.purge.TolerantBatch',
+              FakePurgeBatch).start()
+        FakePurgeBatch.sizes = []
+
+    def tearDown(self):
+        patch.stopall()
+
+    def _job(self, bucket, container='container'):
+        FakePurgeBatch.bucket = bucket
+        return PurgeJob(FakePurgeClient(bucket), 'account', container,
+                        rate=1000000)
+
+    def test_purge_container(self):
+        names = ['container/', 'container/dir/'] + \
+            ['container/dir/{}'.format(i) for i in range(250)]
+        bucket = FakePurgeBucket(names + ['other/', 'other/a'])
+        bucket.objects['other/'].metadata = {
+            'object-count': 1, 'bytes-used': 1}
+        job = self._job(bucket)
+        job.run()
+
+        self.assertEquals(job.status, 'done')
+        self.assertEquals(job.deleted, 252)
+        self.assertEquals(job.bytes_deleted, 252)
+        self.assertEquals(sorted(bucket.objects), ['other/', 'other/a'])
+        self.assertEquals(max(FakePurgeBatch.sizes), 100)
+        # container marker goes in its own batch, after the objects
+        self.assertEquals(FakePurgeBatch.sizes[-1], 1)
+        self.assertEquals(bucket.patches, 1)
+        self.assertEquals(bucket.labels, {'container-count': 1,
+                                          'object-count': 1,
+                                          'bytes-used': 1})
+
+    def test_purge_account_deletes_bucket(self):
+        bucket = FakePurgeBucket(['a/', 'a/1', 'b/', 'b/2'])
+        job = self._job(bucket, container=None)
+        job.run()
+        self.assertEquals(job.status, 'done')
+        self.assertEquals(bucket.objects, {})
+        self.assertTrue(bucket.deleted)
+
+    def test_purge_deletes_noncurrent_generations(self):
+        bucket = FakePurgeBucket(['a/', 'a/1'])
+        bucket.versioning_enabled = True
+        bucket.noncurrent = [
+            FakePurgeBlob('a/1', generation=0, time_deleted=time.time()),
+            FakePurgeBlob('a/2', generation=0, time_deleted=time.time())]
+        job = self._job(bucket, container=None)
+        job.run()
+
+        self.assertEquals(job.status, 'done')
+        self.assertEquals((bucket.objects, bucket.noncurrent), ({}, []))
+        self.assertTrue(bucket.deleted)
+        # only live objects are reported
+        self.assertEquals(job.deleted, 2)
+
+    def test_failed_deletes_keep_container(self):
+        bucket = FakePurgeBucket(['container/', 'container/a',
+                                  'container/b'], fail=['container/b'])
+        job = self._job(bucket)
+        job.run()
+        self.assertEquals(job.status, 'failed')
+        self.assertEquals(job.failed, 1)
+        self.assertIn('container/', bucket.objects)
+        self.assertEquals(bucket.patches, 0)
+
+        # saved for the other processes
+        state = purge.load_state(bucket, 'account', 'container')
+        self.assertEquals(state['status'], 'failed')
+        self.assertEquals(state['failed'], 1)
+        self.assertEquals(state['deleted'], 1)
+
+    def test_account_state_is_saved_in_labels(self):
+        bucket = FakePurgeBucket(['a/', 'a/1'])
+        bucket.delete = Mock(side_effect=Exception('not empty'))
+        job = self._job(bucket, container=None)
+        job.run()
+        self.assertEquals(job.status, 'failed')
+        self.assertEquals(bucket.labels['purge-status'], 'failed')
+
+        state = purge.load_state(bucket, 'account')
+        self.assertEquals((state['status'], state['deleted']), ('failed', 2))
+
+    def test_account_state_keeps_concurrent_label_updates(self):
+        bucket = FakePurgeBucket(['a/'])
+        bucket.labels = {'object-count': '5'}
+        bucket.stored_labels = {'object-count': '4'}
+        job = self._job(bucket, container=None)
+        job.save(bucket, force=True)
+        self.assertEquals(bucket.labels['object-count'], '4')
+        self.assertEquals(bucket.labels['purge-status'], 'pending')
+
+
+class SwiftGCPDriverPurgeTestCase(TestCase):
+
+    def setUp(self):
+        self.conf = {
+            'max_results': 999,
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token',
+            'purge_enabled': 'true'
+        }
+        self.bucket = FakePurgeBucket(['container/', 'container/a'])
+        FakePurgeBatch.bucket = self.bucket
+        patch('swift_cloud.drivers.purge.TolerantBatch',
+              FakePurgeBatch).start()
+        self.mock_client = patch(
+            'swift_cloud.drivers.gcp.SwiftGCPDriver._get_client',
+            Mock()).start()
+        self.mock_client.return_value = FakePurgeClient(self.bucket)
+        purge._jobs.clear()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def _wait(self, job):
+        for _ in range(100):
+            if job.status in ('done', 'failed'):
+                return
+            time.sleep(0.01)
+
+    def test_recursive_delete_starts_job(self):
+        headers = {'X-Recursive-Delete': 'true'}
+        res = make_driver('/v1/account/container', self.conf, 'DELETE',
+                          headers).response()
+        self.assertEquals(res.status_int, 202)
+        self.assertEquals(json.loads(res.body)['container'], 'container')
+
+        self._wait(purge.get_job('account', 'container'))
+        res = make_driver('/v1/account/container?purge-status',
+                          self.conf).response()
+        self.assertEquals(res.status_int, 200)
+        body = json.loads(res.body)
+        self.assertEquals(body['status'], 'done')
+        self.assertEquals(body['deleted'], 2)
+        self.assertEquals(self.bucket.objects, {})
+
+    def test_recursive_delete_needs_opt_in(self):
+        self.conf['purge_enabled'] = 'false'
+        headers = {'X-Recursive-Delete': 'true'}
+        driver = make_driver('/v1/account/container', self.conf, 'DELETE',
+                             headers)
+        self.assertFalse(driver._is_recursive_delete())
+
+    def test_purge_status_without_job(self):
+        res = make_driver('/v1/account?purge-status', self.conf).response()
+        self.assertEquals(res.status_int, 404)
+
+    def test_purge_status_of_job_in_other_process(self):
+        self.bucket.objects['container/'].metadata = {
+            'purge-job': json.dumps({'status': 'running', 'deleted': 5,
+                                     'updated_at': time.time()})}
+
+        res = make_driver('/v1/account/container?purge-status',
+                          self.conf).response()
+        self.assertEquals(res.status_int, 200)
+        self.assertEquals(json.loads(res.body)['deleted'], 5)
+
+        # not started twice
+        headers = {'X-Recursive-Delete': 'true'}
+        res = make_driver('/v1/account/container', self.conf, 'DELETE',
+                          headers).response()
+        self.assertEquals(res.status_int, 202)
+        self.assertIsNone(purge.get_job('account', 'container'))
+        self.assertIn('container/a', self.bucket.objects)
@@ -0,0 +1,168 @@
+import os
+import json
+import shutil
+import tempfile
+
+from unittest import TestCase
+from google.cloud.exceptions import PreconditionFailed
+from swift_cloud.reconciler import CounterReconciler, Checkpoint
+
+
+class FakeCounterBlob(object):
+    """
+    Keeps what GCS stores apart from the local copy, which patches
+    send and reloads refresh.
+    """
+
+    def __init__(self, name, size=0, metadata=None):
+        self.name = name
+        self.size = size
+        self.stored = metadata
+        self.values = dict(metadata) if metadata is not None else None
+        self.metageneration = 1
+        self.stored_metageneration = 1
+        self.content_type = 'text/plain'
+        self.conflicts = 0
+        self.patches = 0
+        if name.endswith('/'):
+            self.content_type = 'application/directory'
+
+    # like GCS, metadata keys are merged into the stored ones
+    @property
+    def metadata(self):
+        return self.values
+
+    @metadata.setter
+    def metadata(self, value):
+        self.values = dict(self.values or {}, **value)
+
+    def patch(self, timeout=None, if_metageneration_match=None, **kwargs):
+        if self.conflicts:
+            self.conflicts -= 1
+            raise PreconditionFailed('metageneration changed')
+        if if_metageneration_match != self.stored_metageneration:
+            raise PreconditionFailed('metageneration changed')
+        self.stored = dict(self.values)
+        self.stored_metageneration += 1
+        self.metageneration = self.stored_metageneration
+        self.patches += 1
+
+    def reload(self, *args, **kwargs):
+        self.values = dict(self.stored) if self.stored is not None else None
+        self.metageneration = self.stored_metageneration
+
+    def add(self, key, value):
+        """
+        A concurrent update, stored without touching the local copy.
+        """
+        self.stored = dict(self.stored or {})
+        self.stored[key] = self.stored.get(key, 0) + value
+        self.stored_metageneration += 1
+
+
+class FakeCounterBucket(FakeCounterBlob):
+
+    def __init__(self, blobs):
+        FakeCounterBlob.__init__(self, 'account', metadata={
+            'object-count': 99})
+        self.blobs = dict((b.name, b) for b in blobs)
+        self.listed = []
+        self.on_list = None
+
+    @property
+    def labels(self):
+        return self.values
+
+    @labels.setter
+    def labels(self, value):
+        self.values = value
+
+    def get_blob(self, name, *args, **kwargs):
+        return self.blobs.get(name)
+
+    def list_blobs(self, prefix='', delimiter=None, start_offset=None,
+                   end_offset=None, **kwargs):
+        names = sorted(n for n in self.blobs if n.startswith(prefix) and
+                       (start_offset is None or n >= start_offset) and
+                       (end_offset is None or n < end_offset))
+        if delimiter:
+            return [self.blobs[n] for n in names if n.count('/') == 1 and
+                    n.endswith('/')]
+        self.listed.append(prefix)
+        if self.on_list:
+            self.on_list(prefix)
+        return [self.blobs[n] for n in names]
+
+
+class FakeCounterClient:
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get_bucket(self, *args, **kwargs):
+        return self.bucket
+
+
+class CounterReconcilerTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.bucket = FakeCounterBucket([
+            FakeCounterBlob('a/', metadata={'object-count': 7}),
+            FakeCounterBlob('a/1', 10),
+            FakeCounterBlob('a/dir/', 0),
+            FakeCounterBlob('a/dir/2', 5),
+            FakeCounterBlob('b/', metadata={}),
+            FakeCounterBlob('b/3', 1)
+        ])
+        self.reconciler = CounterReconciler(
+            FakeCounterClient(self.bucket), self.tmp, partitions=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_reconcile_account(self):
+        result = self.reconciler.reconcile_account('account')
+        self.assertEquals(result, (2, 3, 16))
+        self.assertEquals(self.bucket.blobs['a/'].metadata,
+                          {'object-count': 2, 'bytes-used': 15})
+        self.assertEquals(self.bucket.blobs['b/'].metadata,
+                          {'object-count': 1, 'bytes-used': 1})
+        self.assertEquals(self.bucket.labels, {'container-count': 2,
+                                               'object-count': 3,
+                                               'bytes-used': 16})
+        self.assertFalse(os.path.exists(os.path.join(self.tmp,
+                                                     'account.json')))
+
+    def test_retries_on_precondition_failure(self):
+        self.bucket.blobs['a/'].conflicts = 2
+        self.reconciler.reconcile_account('account')
+        self.assertEquals(self.bucket.blobs['a/'].patches, 1)
+        self.assertEquals(self.bucket.blobs['a/'].metadata['object-count'], 2)
+
+    def test_keeps_updates_made_while_listing(self):
+        def put_object(prefix):
+            # a request adds an object and updates the counters
+            self.bucket.on_list = None
+            self.bucket.blobs['a/'].add('object-count', 1)
+            self.bucket.add('object-count', 1)
+
+        self.bucket.on_list = put_object
+        self.reconciler.reconcile_account('account')
+        self.assertEquals(self.bucket.blobs['a/'].metadata['object-count'], 3)
+        self.assertEquals(self.bucket.labels['object-count'], 4)
+
+    def test_resumes_from_checkpoint(self):
+        Checkpoint(self.tmp, 'account').save('a', 2, 15)
+        self.reconciler.reconcile_account('account')
+        self.assertNotIn('a/', self.bucket.listed)
+        self.assertIn('b/', self.bucket.listed)
+        self.assertEquals(self.bucket.labels['object-count'], 3)
+
+    def test_checkpoint_file(self):
+        checkpoint = Checkpoint(self.tmp, 'account')
+        checkpoint.save('a', 1, 2)
+        with open(checkpoint.path) as fp:
+            self.assertEquals(json.load(fp), {'containers': {'a': [1, 2]}})
+        self.assertEquals(Checkpoint(self.tmp, 'account').containers,
+                          {'a': [1, 2]})
@@ -0,0 +1,177 @@
+import shutil
+import tempfile
+
+from mock import patch, Mock
+from unittest import TestCase
+from swift.common.swob import Request, Response
+from swift_cloud.replication import Replicator, replicated_headers
+from swift_cloud.middleware import SwiftCloudMiddleware
+
+
+class FakeReplicaApp:
+
+    def __init__(self, status=201):
+        self.status = status
+        self.requests = []
+
+    def __call__(self, environ, start_response):
+        req = Request(environ)
+        self.requests.append((req.method, req.path, req.headers,
+                              req.body if req.method == 'PUT' else None))
+        return Response(status=self.status)(environ, start_response)
+
+
+class FakeSourceDriver:
+
+    def __init__(self, req, app, conf):
+        self.req = req
+
+    def response(self):
+        return Response(body=b'data', headers={
+            'Content-Type': 'text/plain',
+            'X-Object-Meta-Color': 'blue',
+            'Etag': 'etag'
+        })
+
+
+def record(method, path, time=1, headers=None, target='swift'):
+    return {'method': method, 'path': path, 'headers': headers or {},
+            'target': target, 'time': time, 'attempts': 0}
+
+
+class ReplicatorTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.app = FakeReplicaApp()
+        self.conf = {'dual_write_spool_dir': self.tmp,
+                     'dual_write_interval': 3600,
+                     'dual_write_max_attempts': 2}
+        patch('swift_cloud.replication.SwiftGCPDriver',
+              FakeSourceDriver).start()
+        self.replicator = Replicator(self.app, self.conf)
+
+    def tearDown(self):
+        patch.stopall()
+        shutil.rmtree(self.tmp)
+
+    def test_replicated_headers(self):
+        self.assertEquals(replicated_headers({
+            'X-Auth-Token': 'token',
+            'Content-Length': '10',
+            'X-Object-Meta-Color': 'blue',
+            'X-Delete-At': '1700000000'
+        }), {'X-Object-Meta-Color': 'blue', 'X-Delete-At': '1700000000'})
+
+    def test_object_put_streams_from_source(self):
+        failed = self.replicator.replicate([record('PUT', '/v1/a/c/o')])
+        self.assertEquals(failed, [])
+
+        method, path, headers, body = self.app.requests[0]
+        self.assertEquals((method, path, body), ('PUT', '/v1/a/c/o', b'data'))
+        self.assertEquals(headers['X-Object-Meta-Color'], 'blue')
+        self.assertEquals(self.replicator.replicated, 1)
+
+    def test_records_replayed_in_order_per_path(self):
+        self.replicator.replicate([
+            record('DELETE', '/v1/a/c/o', time=3),
+            record('POST', '/v1/a/c', time=2,
+                   headers={'X-Container-Meta-Color': 'red'}),
+            record('PUT', '/v1/a/c/o', time=1)
+        ])
+        calls = [(method, path) for method, path, _, _ in self.app.requests]
+        self.assertLess(calls.index(('PUT', '/v1/a/c/o')),
+                        calls.index(('DELETE', '/v1/a/c/o')))
+        self.assertIn(('POST', '/v1/a/c'), calls)
+
+    def test_failures_are_retried_then_dropped(self):
+        self.app.status = 503
+        records = [record('DELETE', '/v1/a/c/o', time=1),
+                   record('DELETE', '/v1/a/c/o', time=2)]
+
+        failed = self.replicator.replicate(records)
+        self.assertEquals([r['attempts'] for r in failed], [1, 1])
+        self.assertEquals(len(self.app.requests), 1)
+
+        self.assertEquals(self.replicator.replicate(failed), [])
+        self.assertEquals(self.replicator.dropped, 2)
+
+    def test_retried_record_replayed_before_newer_ones(self):
+        self.app.status = 503
+        self.replicator.spool.put(record('DELETE', '/v1/a/c/o', time=1))
+        self.replicator.spool.flush(self.replicator.replicate)
+
+        self.app.status = 201
+        self.replicator.spool.put(record('PUT', '/v1/a/c/o', time=2))
+        self.replicator.spool.flush(self.replicator.replicate)
+
+        calls = [method for method, _, _, _ in self.app.requests]
+        self.assertEquals(calls, ['DELETE', 'DELETE', 'PUT'])
+        self.assertEquals(self.replicator.stats()['pending'], 0)
+
+    def test_lag_is_sent_to_statsd(self):
+        self.replicator.metrics = Mock()
+        self.replicator.replicate([record('DELETE', '/v1/a/c/o')])
+        component, operation, lag = \
+            self.replicator.metrics.timing.call_args[0]
+        self.assertEquals((component, operation), ('replication', 'lag'))
+        self.assertEquals(lag, self.replicator.lag * 1000)
+
+    def test_enqueue(self):
+        req = Request.blank('/v1/a/c/o', environ={'REQUEST_METHOD': 'POST'},
+                            headers={'X-Object-Meta-Color': 'red'})
+        self.replicator.enqueue(req, 'gcp')
+        self.assertEquals(self.replicator.stats()['pending'], 1)
+
+        req = Request.blank('/v1/a?bulk-delete',
+                            environ={'REQUEST_METHOD': 'POST'})
+        self.replicator.enqueue(req, 'gcp')
+        self.assertEquals(self.replicator.stats()['pending'], 1)
+
+
+class DualWriteMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        patch('swift_cloud.middleware.Credentials', Mock()).start()
+        patch('swift_cloud.middleware.storage', Mock()).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_swift_primary_enqueues_successful_writes(self):
+        app = FakeReplicaApp()
+        middleware = SwiftCloudMiddleware(app, {'cloud_providers': 'gcp'})
+        middleware.replicator = Mock()
+
+        req = Request.blank('/v1/a/c/o', environ={'REQUEST_METHOD': 'PUT'})
+        resp = middleware.dual_write_handler(req, 'swift')
+        self.assertEquals(resp.status_int, 201)
+        middleware.replicator.enqueue.assert_called_once_with(req, 'gcp')
+
+        app.status = 503
+        middleware.replicator.reset_mock()
+        resp = middleware.dual_write_handler(req, 'swift')
+        self.assertFalse(middleware.replicator.enqueue.called)
+
+    @patch('swift_cloud.middleware.SwiftGCPDriver')
+    def test_gcp_primary_replicates_to_swift(self, mock_driver):
+        mock_driver.return_value.response.return_value = Response(status=204)
+        middleware = SwiftCloudMiddleware(FakeReplicaApp(),
+                                          {'cloud_providers': 'gcp'})
+        middleware.replicator = Mock()
+
+        req = Request.blank('/v1/a/c/o', environ={'REQUEST_METHOD': 'DELETE'})
+        middleware.dual_write_handler(req, 'gcp')
+        middleware.replicator.enqueue.assert_called_once_with(req, 'swift')
+
+    @patch('swift_cloud.middleware.SwiftGCPDriver')
+    def test_writes_left_to_swift_are_replicated_to_gcp(self, mock_driver):
+        app = FakeReplicaApp()
+        mock_driver.return_value.response.return_value = app
+        middleware = SwiftCloudMiddleware(app, {'cloud_providers': 'gcp'})
+        middleware.replicator = Mock()
+
+        req = Request.blank('/v1/a/c/o', environ={'REQUEST_METHOD': 'PUT'})
+        resp = middleware.dual_write_handler(req, 'gcp')
+        self.assertEquals(resp.status_int, 201)
+        middleware.replicator.enqueue.assert_called_once_with(req, 'gcp')
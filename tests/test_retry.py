@@ -0,0 +1,127 @@
+from mock import patch, Mock
+from unittest import TestCase
+from google.cloud.exceptions import Conflict, NotFound, ServiceUnavailable
+from swift_cloud.retry import RetryPolicy, RetryBudget
+from swift_cloud.drivers.gcp import apply_counter_deltas, retried, \
+    retried_delete
+
+
+class RetryPolicyTestCase(TestCase):
+
+    def setUp(self):
+        self.sleep = patch('swift_cloud.retry.time.sleep').start()
+        self.metrics = Mock()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def policy(self, **kwargs):
+        kwargs.setdefault('metrics', self.metrics)
+        return RetryPolicy(**kwargs)
+
+    def test_retries_until_success(self):
+        func = Mock(side_effect=[Conflict('busy'), ServiceUnavailable('down'),
+                                 'ok'], __name__='patch')
+        self.assertEquals(self.policy().call(func, timeout=10), 'ok')
+        self.assertEquals(func.call_count, 3)
+        func.assert_called_with(timeout=10)
+        self.assertEquals(self.sleep.call_count, 2)
+        self.metrics.increment.assert_called_with('retry', 'patch', 'retry')
+
+    def test_other_errors_are_not_retried(self):
+        func = Mock(side_effect=NotFound('gone'), __name__='patch')
+        self.assertRaises(NotFound, self.policy().call, func)
+        self.assertEquals(func.call_count, 1)
+
+    def test_backoff_is_jittered_and_capped(self):
+        policy = self.policy(initial=1, maximum=4)
+        with patch('swift_cloud.retry.random.uniform',
+                   side_effect=lambda low, high: high):
+            self.assertEquals([policy.delay(attempt) for attempt in range(5)],
+                              [1, 2, 4, 4, 4])
+
+    def test_gives_up_after_max_attempts(self):
+        func = Mock(side_effect=Conflict('busy'), __name__='patch')
+        self.assertRaises(Conflict, self.policy(max_attempts=3).call, func)
+        self.assertEquals(func.call_count, 3)
+        self.metrics.increment.assert_called_with(
+            'retry', 'patch', 'exhausted_attempts')
+
+    def test_gives_up_at_deadline(self):
+        func = Mock(side_effect=Conflict('busy'), __name__='patch')
+        policy = self.policy(initial=10, maximum=10, deadline=5)
+        with patch('swift_cloud.retry.random.uniform', return_value=10):
+            self.assertRaises(Conflict, policy.call, func)
+        self.assertEquals(func.call_count, 1)
+        self.metrics.increment.assert_called_with(
+            'retry', 'patch', 'exhausted_deadline')
+
+    def test_budget(self):
+        budget = RetryBudget(rate=0, burst=2)
+        func = Mock(side_effect=Conflict('busy'), __name__='patch')
+        self.assertRaises(Conflict, self.policy(budget=budget).call, func)
+        self.assertEquals(func.call_count, 3)
+        self.metrics.increment.assert_called_with(
+            'retry', 'patch', 'exhausted_budget')
+
+        # the empty budget fails the next call on its first error
+        func.reset_mock()
+        self.assertRaises(Conflict, self.policy(budget=budget).call, func)
+        self.assertEquals(func.call_count, 1)
+
+    def test_budget_refills(self):
+        budget = RetryBudget(rate=10, burst=1)
+        with patch('swift_cloud.retry.time.time', return_value=budget.updated):
+            self.assertTrue(budget.withdraw())
+            self.assertFalse(budget.withdraw())
+        with patch('swift_cloud.retry.time.time',
+                   return_value=budget.updated + 0.2):
+            self.assertTrue(budget.withdraw())
+
+    def test_counter_updates_are_retried(self):
+        bucket = Mock(labels={})
+        bucket.patch.side_effect = [Conflict('busy'), None]
+        bucket.patch.__name__ = 'patch'
+        container = Mock(metadata={})
+        container.patch.__name__ = 'patch'
+
+        with patch('swift_cloud.drivers.gcp.get_retry_policy',
+                   return_value=self.policy()):
+            apply_counter_deltas(bucket, [(container, 1, 10)])
+
+        self.assertEquals(bucket.patch.call_count, 2)
+        bucket.patch.assert_called_with(
+            timeout=10, retry=None,
+            if_metageneration_match=bucket.metageneration)
+        self.assertEquals(bucket.labels['object-count'], 1)
+        self.assertEquals(container.metadata['bytes-used'], 10)
+
+    def test_other_mutations_are_retried(self):
+        bucket = Mock()
+        bucket.delete_blob.side_effect = [ServiceUnavailable('busy'), None]
+        bucket.delete_blob.__name__ = 'delete_blob'
+
+        with patch('swift_cloud.drivers.gcp.get_retry_policy',
+                   return_value=self.policy()):
+            retried(bucket.delete_blob, 'c/o', generation=1, retry=None)
+
+        self.assertEquals(bucket.delete_blob.call_count, 2)
+        bucket.delete_blob.assert_called_with('c/o', generation=1, retry=None)
+
+    def test_deletes_gone_on_retry_succeed(self):
+        bucket = Mock()
+        bucket.delete_blob.side_effect = [ServiceUnavailable('busy'),
+                                          NotFound('gone')]
+
+        with patch('swift_cloud.drivers.gcp.get_retry_policy',
+                   return_value=self.policy()):
+            retried_delete(bucket.delete_blob, 'c/o', retry=None)
+
+        self.assertEquals(bucket.delete_blob.call_count, 2)
+
+        # the first attempt tells the object did not exist
+        bucket.delete_blob.side_effect = NotFound('missing')
+        with patch('swift_cloud.drivers.gcp.get_retry_policy',
+                   return_value=self.policy()):
+            self.assertRaises(NotFound, retried_delete, bucket.delete_blob,
+                              'c/o', retry=None)
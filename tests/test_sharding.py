@@ -0,0 +1,168 @@
+import json
+
+from datetime import datetime
+from mock import patch, Mock
+from unittest import TestCase
+from swift_cloud.drivers import sharding
+from tests.test_driver_gcp import make_driver
+
+
+class FakeShardBlob:
+
+    def __init__(self, name, metadata=None, content_type='text/plain'):
+        self.name = name
+        self.size = 1
+        self.generation = 1
+        self.md5_hash = 'hash'
+        self.content_type = content_type
+        self.updated = datetime(2021, 4, 4)
+        self.metadata = metadata
+        self.cache_control = None
+        self.content_disposition = None
+
+    def exists(self):
+        return True
+
+
+class FakeShardBucket:
+
+    def __init__(self, container_metadata):
+        self.objects = {
+            'container/': FakeShardBlob(
+                'container/', container_metadata, 'application/directory')
+        }
+        self.labels = {}
+
+    def add(self, name):
+        self.objects[name] = FakeShardBlob(name)
+
+    def get_blob(self, name, *args, **kwargs):
+        return self.objects.get(name)
+
+    def list_blobs(self, prefix='', start_offset=None, end_offset=None,
+                   max_results=None, **kwargs):
+        names = sorted(n for n in self.objects if n.startswith(prefix) and
+                       (start_offset is None or n >= start_offset) and
+                       (end_offset is None or n < end_offset))
+        return [FakeShardBlob(n) for n in names[:max_results]]
+
+
+class ShardingTestCase(TestCase):
+
+    def test_routing_is_deterministic(self):
+        name = sharding.blob_name('container', 'a/b.txt', 16)
+        self.assertEquals(name, sharding.blob_name('container', 'a/b.txt', 16))
+        self.assertTrue(name.startswith('container/.shard-'))
+        self.assertTrue(name.endswith('/a/b.txt'))
+        self.assertEquals(sharding.unshard_name(name), 'container/a/b.txt')
+
+    def test_unsharded_names(self):
+        self.assertEquals(sharding.blob_name('container', 'obj'),
+                          'container/obj')
+        self.assertEquals(sharding.unshard_name('container/obj'),
+                          'container/obj')
+
+    def test_objects_spread_over_shards(self):
+        shards = set(sharding.shard_of('obj-{}'.format(i), 16)
+                     for i in range(200))
+        self.assertEquals(len(shards), 16)
+
+    def test_shard_count(self):
+        self.assertEquals(sharding.shard_count(None), 0)
+        self.assertEquals(sharding.shard_count(
+            {'x-container-sharding': 'true',
+             sharding.SHARD_COUNT_META: '8'}), 8)
+
+    def test_merge_listings(self):
+        listings = [
+            [FakeShardBlob('c/.shard-00/a'), FakeShardBlob('c/.shard-00/d/')],
+            [FakeShardBlob('c/.shard-01/b'), FakeShardBlob('c/.shard-01/d/')]
+        ]
+        merged = list(sharding.merge_listings(listings))
+        self.assertEquals([b.name for b in merged], ['c/a', 'c/b', 'c/d/'])
+        # the GCS blobs keep their names
+        self.assertEquals(merged[1].blob.name, 'c/.shard-01/b')
+        self.assertEquals(listings[0][0].name, 'c/.shard-00/a')
+
+
+class SwiftGCPDriverShardingTestCase(TestCase):
+
+    def setUp(self):
+        self.conf = {
+            'max_results': 999,
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token'
+        }
+        self.bucket = FakeShardBucket({
+            'x-container-sharding': 'true',
+            sharding.SHARD_COUNT_META: '4'})
+        self.mock_client = patch(
+            'swift_cloud.drivers.gcp.SwiftGCPDriver._get_client',
+            Mock()).start()
+        self.mock_client.return_value = Mock(
+            get_bucket=Mock(return_value=self.bucket))
+        sharding._counts.clear()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_head_object_routes_to_shard(self):
+        self.bucket.add(sharding.blob_name('container', 'obj', 4))
+        res = make_driver('/v1/account/container/obj', self.conf,
+                          'HEAD').response()
+        self.assertEquals(res.status_int, 200)
+
+        res = make_driver('/v1/account/container/other', self.conf,
+                          'HEAD').response()
+        self.assertEquals(res.status_int, 404)
+
+    def test_get_container_merges_shards(self):
+        names = ['obj-{}'.format(i) for i in range(10)]
+        for name in names:
+            self.bucket.add(sharding.blob_name('container', name, 4))
+
+        res = make_driver('/v1/account/container', self.conf).response()
+        listing = json.loads(res.body)
+        self.assertEquals([o['name'] for o in listing], sorted(names))
+
+        res = make_driver('/v1/account/container?limit=3&marker=obj-1',
+                          self.conf).response()
+        listing = json.loads(res.body)
+        self.assertEquals([o['name'] for o in listing],
+                          ['obj-2', 'obj-3', 'obj-4'])
+
+    def test_sharding_is_fixed_on_empty_containers(self):
+        driver = make_driver('/v1/account/container', self.conf, 'POST',
+                             {'X-Container-Sharding': 'true'})
+        blob = FakeShardBlob('container/', {})
+        metadata = driver._set_container_metadata(blob)
+        self.assertEquals(metadata[sharding.SHARD_COUNT_META], 16)
+
+        blob.metadata = {'object-count': 3, sharding.SHARD_COUNT_META: 16}
+        driver = make_driver('/v1/account/container', self.conf, 'POST',
+                             {'X-Container-Sharding': 'false'})
+        metadata = driver._set_container_metadata(blob)
+        self.assertEquals(metadata[sharding.SHARD_COUNT_META], 16)
+
+    def test_stale_shard_count_is_refreshed_on_miss(self):
+        # another worker enabled sharding after this one cached 0
+        sharding.set_count('account', 'container', 0)
+        self.bucket.add(sharding.blob_name('container', 'obj', 4))
+
+        res = make_driver('/v1/account/container/obj', self.conf,
+                          'HEAD').response()
+        self.assertEquals(res.status_int, 200)
+        self.assertEquals(sharding._counts[('account', 'container')][0], 4)
+
+    def test_sharding_is_not_changed_when_objects_exist(self):
+        # the object is listed before the counters include it
+        self.bucket.objects['container/'].metadata = {'object-count': 0}
+        self.bucket.add('container/obj')
+        self.bucket.objects['container/'].patch = Mock()
+        self.bucket.objects['container/'].metageneration = 1
+
+        res = make_driver('/v1/account/container', self.conf, 'POST',
+                          {'X-Container-Sharding': 'true'}).response()
+        self.assertEquals(res.status_int, 204)
+        self.assertNotIn(sharding.SHARD_COUNT_META,
+                         self.bucket.objects['container/'].metadata)
@@ -0,0 +1,265 @@
+import os
+import errno
+import fcntl
+import shutil
+import tempfile
+import threading
+
+import requests
+
+from mock import patch, Mock
+from unittest import TestCase
+from swift_cloud.spool import DurableSpool
+from swift_cloud.tools import SwiftCloudTools
+from tests.fake_tools_api import FakeToolsServer
+
+
+def fake_response(status=200, text='ok'):
+    res = Mock()
+    res.status_code = status
+    res.ok = status < 400
+    res.text = text
+    return res
+
+
+class SwiftCloudToolsTestCase(TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.conf = {
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token',
+            'tools_spool_dir': self.spool_dir,
+            'tools_spool_interval': 3600
+        }
+        patch('swift_cloud.tools.SwiftCloudTools._sleep', Mock()).start()
+        SwiftCloudTools._sessions.clear()
+        SwiftCloudTools._spools.clear()
+
+    def tearDown(self):
+        patch.stopall()
+        shutil.rmtree(self.spool_dir)
+
+    def test_session_is_shared_between_instances(self):
+        tools = SwiftCloudTools(self.conf)
+        other = SwiftCloudTools(self.conf)
+        self.assertIs(tools.session, other.session)
+
+    def test_add_delete_at_uses_session_with_timeout(self):
+        tools = SwiftCloudTools(self.conf)
+        tools.session.request = Mock(return_value=fake_response())
+        result, msg = tools.add_delete_at('account', 'container', 'obj', 'date')
+        self.assertTrue(result)
+        args, kwargs = tools.session.request.call_args
+        self.assertEquals(args, ('POST', 'http://swift-cloud-tools/v1/expirer/'))
+        self.assertEquals(kwargs['timeout'], (2.0, 10.0))
+
+    def test_remove_delete_at_sends_delete(self):
+        tools = SwiftCloudTools(self.conf)
+        tools.session.request = Mock(return_value=fake_response())
+        tools.remove_delete_at('account', 'container', 'obj')
+        args, _ = tools.session.request.call_args
+        self.assertEquals(args[0], 'DELETE')
+
+    def test_retries_connection_errors(self):
+        tools = SwiftCloudTools(self.conf)
+        tools.session.request = Mock(side_effect=[
+            requests.ConnectionError('boom'), fake_response(503), fake_response()])
+        result, _ = tools.add_delete_at('account', 'container', 'obj', 'date')
+        self.assertTrue(result)
+        self.assertEquals(tools.session.request.call_count, 3)
+
+    def test_gives_up_after_retries(self):
+        tools = SwiftCloudTools(self.conf)
+        tools.session.request = Mock(side_effect=requests.Timeout('slow'))
+        result, msg = tools.add_delete_at('account', 'container', 'obj', 'date')
+        self.assertFalse(result)
+        self.assertEquals(tools.session.request.call_count, 4)
+
+    def test_async_mode_spools_and_flushes(self):
+        self.conf['tools_api_async'] = 'true'
+        tools = SwiftCloudTools(self.conf)
+        tools.session.request = Mock(return_value=fake_response())
+
+        result, msg = tools.add_delete_at('account', 'container', 'obj', 'date')
+        self.assertEquals((result, msg), (True, 'queued'))
+        self.assertFalse(tools.session.request.called)
+        self.assertEquals(tools.spool.pending(), 1)
+
+        self.assertEquals(tools.spool.flush(tools.deliver), 1)
+        self.assertEquals(tools.spool.pending(), 0)
+        self.assertEquals(tools.session.request.call_count, 1)
+
+    def test_async_mode_keeps_records_on_transient_errors(self):
+        self.conf['tools_api_async'] = 'true'
+        tools = SwiftCloudTools(self.conf)
+        tools.session.request = Mock(return_value=fake_response(503))
+
+        tools.add_delete_at('account', 'container', 'obj', 'date')
+        self.assertEquals(tools.spool.flush(tools.deliver), 0)
+        self.assertEquals(tools.spool.pending(), 1)
+
+
+class DurableSpoolTestCase(TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.spool = DurableSpool(self.spool_dir, sync=False,
+                                  key=lambda record: record['key'])
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def test_failed_records_keep_their_order(self):
+        self.spool.put_many([{'key': 'a', 'action': 'add'},
+                             {'key': 'b', 'action': 'add'},
+                             {'key': 'a', 'action': 'remove'}])
+        batches = []
+
+        def fail_first_add(batch):
+            batches.append([(r['key'], r['action']) for r in batch])
+            return [r for r in batch if r == {'key': 'a', 'action': 'add'}]
+
+        self.assertEquals(self.spool.flush(fail_first_add), 1)
+        # the remove is held back behind the failed add
+        self.assertEquals(batches, [[('a', 'add'), ('b', 'add')]])
+
+        # newer records are delivered after the retried ones
+        self.spool.put({'key': 'a', 'action': 'add'})
+        batches[:] = []
+        self.assertEquals(self.spool.flush(lambda batch: batches.append(
+            [(r['key'], r['action']) for r in batch])), 3)
+        self.assertEquals(batches, [[('a', 'add')], [('a', 'remove')],
+                                    [('a', 'add')]])
+        self.assertEquals(self.spool.pending(), 0)
+
+    def test_flush_skipped_while_another_process_flushes(self):
+        self.spool.put({'key': 'a', 'action': 'add'})
+        with open(os.path.join(self.spool_dir, '.flush.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.assertEquals(self.spool.flush(lambda batch: []), 0)
+        self.assertEquals(self.spool.pending(), 1)
+        self.assertEquals(self.spool.flush(lambda batch: []), 1)
+
+    def test_recover_keeps_segments_of_live_processes(self):
+        with open(os.path.join(self.spool_dir, 'spool-1.current'), 'w') as fp:
+            fp.write('{"key": "a"}\n')
+
+        with patch('swift_cloud.spool.os.kill',
+                   side_effect=OSError(errno.EPERM, 'not permitted')):
+            DurableSpool(self.spool_dir)
+        self.assertEquals(os.listdir(self.spool_dir), ['spool-1.current'])
+
+        with patch('swift_cloud.spool.os.kill',
+                   side_effect=OSError(errno.ESRCH, 'no such process')):
+            DurableSpool(self.spool_dir)
+        self.assertEquals(os.listdir(self.spool_dir), ['spool-1.batch'])
+
+    def test_recover_put_back_left_by_dead_process(self):
+        def write(name, lines):
+            with open(os.path.join(self.spool_dir, name), 'w') as fp:
+                fp.write(lines)
+
+        # died before renaming: the claimed segment still has the records
+        write('spool-1-1.000000.claimed', '{"key": "a"}\n{"key": "b"}\n')
+        write('spool-1-1.000000.claimed.tmp', '{"key": "b"}\n')
+        # claimed segment already gone
+        write('spool-2-1.000000.claimed.tmp', '{"key": "c"}\n')
+
+        with patch('swift_cloud.spool.os.kill',
+                   side_effect=OSError(errno.ESRCH, 'no such process')):
+            spool = DurableSpool(self.spool_dir)
+        self.assertEquals(sorted(os.listdir(self.spool_dir)),
+                          ['spool-1-1.000000.batch', 'spool-2-1.000000.batch'])
+        self.assertEquals(spool.pending(), 3)
+
+
+class SwiftCloudToolsBatchTestCase(TestCase):
+
+    def setUp(self):
+        self.server = FakeToolsServer().start()
+        self.spool_dir = tempfile.mkdtemp()
+        self.conf = {
+            'tools_api_url': self.server.url,
+            'tools_api_token': 'token',
+            'tools_api_batch': 'true',
+            'tools_batch_max_wait': 0.2,
+            'tools_spool_dir': self.spool_dir,
+            'tools_spool_interval': 3600
+        }
+        SwiftCloudTools._sessions.clear()
+        SwiftCloudTools._spools.clear()
+        SwiftCloudTools._batchers.clear()
+        SwiftCloudTools._batch_unsupported.clear()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.spool_dir)
+
+    def _register(self, names):
+        results = {}
+
+        def register(name):
+            tools = SwiftCloudTools(self.conf)
+            results[name] = tools.add_delete_at('account', 'container', name, 'date')
+
+        threads = [threading.Thread(target=register, args=(name,))
+                   for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_registrations_are_batched(self):
+        names = ['obj-{}'.format(i) for i in range(20)]
+        results = self._register(names)
+        self.assertTrue(all(result for result, _ in results.values()))
+        self.assertEquals(sum(len(b) for b in self.server.batches), 20)
+        self.assertLess(len(self.server.batches), 20)
+        self.assertEquals(self.server.calls, [])
+
+    def test_batch_reports_errors_per_item(self):
+        self.server.reject.add('bad')
+        results = self._register(['good', 'bad'])
+        self.assertEquals(results['good'], (True, 'ok'))
+        self.assertEquals(results['bad'], (False, 'Rejected'))
+
+    def test_falls_back_to_single_requests_without_batch_endpoint(self):
+        self.server.batch = False
+        results = self._register(['obj'])
+        self.assertTrue(results['obj'][0])
+        self.assertEquals(len(self.server.calls), 1)
+
+    def test_spool_delivers_through_batch_endpoint(self):
+        self.conf['tools_api_async'] = 'true'
+        tools = SwiftCloudTools(self.conf)
+        for i in range(5):
+            tools.add_delete_at('account', 'container', 'obj-{}'.format(i), 'date')
+        tools.remove_delete_at('account', 'container', '')
+        self.assertEquals(tools.spool.flush(tools.deliver), 6)
+        self.assertEquals(len(self.server.batches), 1)
+        self.assertEquals(tools.spool.pending(), 0)
+
+    def test_records_of_one_object_use_one_worker(self):
+        batcher = SwiftCloudTools(self.conf).batcher
+        self.assertEquals(len(batcher.queues), 2)
+
+        add = {'account': 'a', 'container': 'c', 'object': 'o',
+               'action': 'add'}
+        remove = dict(add, action='remove')
+        self.assertIs(batcher._queue(add), batcher._queue(remove))
+
+        results = self._register(['obj-{}'.format(i) for i in range(10)])
+        self.assertTrue(all(result for result, _ in results.values()))
+        self.assertEquals(set(batcher.threads), set([0, 1]))
+
+    def test_full_queue_pushes_back(self):
+        tools = SwiftCloudTools(self.conf)
+        tools.batcher.enqueue_timeout = 0
+        tools.batcher.workers = 0
+        for queue in tools.batcher.queues:
+            queue.maxsize = 1
+            queue.put(Mock())
+        result, msg = tools.add_delete_at('account', 'container', 'obj', 'date')
+        self.assertEquals((result, msg), (False, 'Batch queue full'))
@@ -0,0 +1,144 @@
+import json
+import shutil
+import tempfile
+
+from eventlet import GreenPool
+from mock import patch, Mock
+from unittest import TestCase
+from swift.common.swob import Request, Response
+from swift_cloud import context
+from swift_cloud.tracing import Tracer, parse_traceparent, KIND_SERVER, \
+    KIND_CLIENT, STATUS_ERROR
+from swift_cloud.middleware import SwiftCloudMiddleware
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+class TracerTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tracer = Tracer({'tracing_enabled': 'true',
+                              'tracing_file': self.tmp + '/spans.json',
+                              'tracing_batch_size': '2'})
+        self.tracer._start_flusher = Mock()
+
+    def tearDown(self):
+        context.update(trace_span=None)
+        shutil.rmtree(self.tmp)
+
+    def test_parse_traceparent(self):
+        self.assertEquals(
+            parse_traceparent('00-{}-{}-01'.format(TRACE_ID, PARENT_ID)),
+            (TRACE_ID, PARENT_ID, True))
+        self.assertEquals(
+            parse_traceparent('00-{}-{}-00'.format(TRACE_ID, PARENT_ID)),
+            (TRACE_ID, PARENT_ID, False))
+        for value in (None, '', 'garbage', '00-123-456-01',
+                      '00-{}-{}-01'.format('0' * 32, PARENT_ID)):
+            self.assertIsNone(parse_traceparent(value))
+
+    def test_start_request(self):
+        root = self.tracer.start_request({
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/v1/account',
+            'swift.trans_id': 'tx123',
+            'HTTP_TRACEPARENT': '00-{}-{}-01'.format(TRACE_ID, PARENT_ID)})
+        self.assertEquals((root.trace_id, root.parent_id, root.kind),
+                          (TRACE_ID, PARENT_ID, KIND_SERVER))
+        self.assertEquals(root.attributes['swift.trans_id'], 'tx123')
+        self.assertEquals(self.tracer.current(), root)
+
+        self.assertIsNone(self.tracer.start_request({
+            'HTTP_TRACEPARENT': '00-{}-{}-00'.format(TRACE_ID, PARENT_ID)}))
+        self.assertIsNone(self.tracer.current())
+
+        self.tracer.sample_rate = 0
+        self.assertIsNone(self.tracer.start_request({}))
+
+    def test_nested_spans_and_export(self):
+        root = self.tracer.start_request({})
+
+        with self.tracer.span('driver.object') as handler:
+            self.assertEquals(self.tracer.current(), handler)
+            call = self.tracer.record('gcs.get_blob', 0, 503)
+        self.assertEquals(self.tracer.current(), root)
+        self.tracer.end(root, 200)
+
+        self.assertEquals(handler.parent_id, root.span_id)
+        self.assertEquals(call.parent_id, handler.span_id)
+        self.assertEquals((call.kind, call.status), (KIND_CLIENT, STATUS_ERROR))
+
+        self.assertEquals(self.tracer.flush(), 3)
+        with open(self.tmp + '/spans.json') as fp:
+            batches = [json.loads(line) for line in fp]
+        self.assertEquals(len(batches), 2)
+        spans = [span for batch in batches
+                 for span in batch['resourceSpans'][0]['scopeSpans'][0]['spans']]
+        self.assertEquals([span['name'] for span in spans],
+                          ['gcs.get_blob', 'driver.object',
+                           'swift_cloud.request'])
+        self.assertEquals(spans[1]['parentSpanId'], root.span_id)
+
+    def test_exports_to_collector(self):
+        self.tracer.path = None
+        self.tracer.endpoint = 'http://collector:4318/v1/traces'
+        self.tracer.end(self.tracer.start_request({}))
+
+        with patch('swift_cloud.tracing.requests.post') as post:
+            self.tracer.flush()
+        args, kwargs = post.call_args
+        self.assertEquals(args, ('http://collector:4318/v1/traces',))
+        self.assertIn('resourceSpans', json.loads(kwargs['data']))
+
+    def test_disabled(self):
+        tracer = Tracer({})
+        self.assertIsNone(tracer.start_request({}))
+        with tracer.span('driver.object') as span:
+            self.assertIsNone(span)
+        self.assertIsNone(tracer.record('gcs.get_blob', 0))
+
+    def test_context_propagates_to_greenthreads(self):
+        root = self.tracer.start_request({})
+
+        def child(_):
+            return self.tracer.record('gcs.list_blobs', 0).parent_id
+
+        pool = GreenPool(2)
+        parents = list(pool.imap(context.propagate(child), range(2)))
+        self.assertEquals(parents, [root.span_id] * 2)
+
+
+class TracingMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        patch('swift_cloud.middleware.Credentials', Mock()).start()
+        patch('swift_cloud.middleware.storage', Mock()).start()
+
+    def tearDown(self):
+        patch.stopall()
+        context.update(trace_span=None)
+
+    def test_request_span(self):
+        app = SwiftCloudMiddleware(
+            lambda env, start_response: Response(status=201)(
+                env, start_response), {'cloud_providers': 'gcp',
+                                       'x_cloud_bypass': 'secret'})
+        app.client.get_bucket.return_value.labels = {}
+        app.tracer = Tracer({'tracing_enabled': 'true'})
+        app.tracer._start_flusher = Mock()
+
+        req = Request.blank('/v1/account/container/obj',
+                            environ={'swift.trans_id': 'tx1'})
+        resp = req.get_response(app)
+        self.assertEquals(resp.status_int, 201)
+        self.assertEquals(len(app.tracer.queue), 1)
+        resp.app_iter.close()
+
+        names = [span.name for span in app.tracer.queue]
+        self.assertEquals(names, ['middleware.route', 'swift_cloud.request'])
+        root = app.tracer.queue[-1]
+        self.assertEquals(root.attributes['http.status_code'], 201)
+        self.assertEquals(root.attributes['swift.trans_id'], 'tx1')
+        self.assertEquals(root.attributes['swift_cloud.backend'], 'swift')
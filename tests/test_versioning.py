@@ -0,0 +1,634 @@
+import json
+import hashlib
+import itertools
+
+from datetime import datetime
+from mock import patch, Mock
+from unittest import TestCase
+from google.cloud.exceptions import Conflict, NotFound, PreconditionFailed
+from swift_cloud.drivers import sharding, versioning
+from tests.test_driver_gcp import make_driver, make_tar
+
+_generations = itertools.count(1617500000000001)
+
+
+class FakeVersionedBlob(object):
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+        self.metageneration = 1
+        self.time_deleted = None
+        self.data = b''
+        self.size = 0
+        self.md5_hash = None
+        self.content_type = 'application/octet-stream'
+        self.updated = datetime(2021, 4, 4)
+        self.cache_control = None
+        self.content_disposition = None
+        self.content_encoding = None
+        self.custom_time = None
+        self._metadata = {}
+
+    # like GCS, metadata keys are merged into the stored ones
+    @property
+    def metadata(self):
+        return dict(self._metadata)
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata.update(value or {})
+        self._metadata = dict((k, v) for k, v in self._metadata.items()
+                              if v is not None)
+
+    def upload_from_string(self, data, content_type=None,
+                           if_generation_match=None, **kwargs):
+        self.data = data
+        self.size = len(data)
+        self.md5_hash = hashlib.md5(data).hexdigest()
+        if content_type:
+            self.content_type = content_type
+        self.bucket.write(self, if_generation_match)
+
+    def download_as_bytes(self):
+        return self.data
+
+    def exists(self):
+        return True
+
+    def patch(self, *args, **kwargs):
+        self.metageneration += 1
+
+    def reload(self, *args, **kwargs):
+        live = self.bucket._live(self.name)
+        if live and live is not self:
+            self.__dict__.update(live.__dict__)
+            self._metadata = dict(live._metadata)
+        if self.bucket.batch is not None:
+            self.bucket.batch.statuses.append(200 if live else 404)
+
+    def rewrite(self, source, token=None, **kwargs):
+        # the rewritten object becomes a new generation of itself
+        old = FakeVersionedBlob(self.bucket, self.name)
+        old.__dict__.update(self.__dict__)
+        old._metadata = dict(self._metadata)
+        self.bucket.versions[self.bucket.versions.index(self)] = old
+        self.bucket.write(self)
+        return None, self.size, self.size
+
+    def delete(self, **kwargs):
+        self.bucket.delete_blob(self.name, generation=self.generation)
+
+
+class FakeVersionedBucket(object):
+
+    def __init__(self):
+        self.name = 'account'
+        self.labels = {}
+        self.metageneration = 1
+        self.versioning_enabled = False
+        self.lifecycle_rules = []
+        self.versions = []
+        self.batch = None
+
+    def blob(self, name):
+        return FakeVersionedBlob(self, name)
+
+    def exists(self):
+        return True
+
+    def _live(self, name):
+        for blob in self.versions:
+            if blob.name == name and blob.time_deleted is None:
+                return blob
+        return None
+
+    def get_blob(self, name, generation=None, **kwargs):
+        if generation is None:
+            return self._live(name)
+        for blob in self.versions:
+            if blob.name == name and blob.generation == generation:
+                return blob
+        return None
+
+    def write(self, blob, if_generation_match=None):
+        live = self._live(blob.name)
+        if if_generation_match is not None and \
+                if_generation_match != (live.generation if live else 0):
+            raise PreconditionFailed('generation')
+        if live:
+            self._archive(live)
+        blob.generation = next(_generations)
+        self.versions.append(blob)
+
+    def _archive(self, blob):
+        if self.versioning_enabled:
+            blob.time_deleted = datetime.now()
+        else:
+            self.versions.remove(blob)
+
+    def delete_blob(self, name, generation=None, **kwargs):
+        blob = self.get_blob(name, generation)
+        if not blob:
+            if self.batch is not None:
+                self.batch.statuses.append(404)
+                return
+            raise NotFound('blob')
+        if generation:
+            self.versions.remove(blob)
+        else:
+            self._archive(blob)
+        if self.batch is not None:
+            self.batch.statuses.append(204)
+
+    def list_blobs(self, prefix='', versions=False, start_offset=None,
+                   end_offset=None, **kwargs):
+        return sorted((blob for blob in self.versions
+                       if blob.name.startswith(prefix) and
+                       (versions or blob.time_deleted is None) and
+                       (not start_offset or blob.name >= start_offset) and
+                       (not end_offset or blob.name < end_offset)),
+                      key=lambda blob: (blob.name, blob.generation))
+
+    def copy_blob(self, blob, bucket, new_name, source_generation=None,
+                  if_generation_match=None, **kwargs):
+        source = self.get_blob(blob.name, source_generation)
+        copy = FakeVersionedBlob(self, new_name)
+        copy.data, copy.size = source.data, source.size
+        copy.md5_hash = source.md5_hash
+        copy.metadata = source.metadata
+        self.write(copy, if_generation_match)
+        return copy
+
+    def patch(self, *args, **kwargs):
+        self.metageneration += 1
+
+    def reload(self, *args, **kwargs):
+        pass
+
+    def noncurrent(self, name):
+        return [blob.data for blob in self.versions
+                if blob.name == name and blob.time_deleted]
+
+
+class FakeVersionedBatch(object):
+    """
+    Runs the calls made within it at once, recording their statuses.
+    """
+    bucket = None
+
+    def __init__(self, client):
+        self.statuses = []
+
+    def __enter__(self):
+        FakeVersionedBatch.bucket.batch = self
+        return self
+
+    def __exit__(self, *args):
+        FakeVersionedBatch.bucket.batch = None
+
+
+class VersionNameTestCase(TestCase):
+
+    def test_round_trip(self):
+        name = versioning.version_name('a/b.txt', 1617500000123456)
+        self.assertEquals(name, '007a/b.txt/1617500000123456')
+        self.assertEquals(versioning.parse_version_name(name),
+                          ('a/b.txt', 1617500000123456))
+
+    def test_unicode_names(self):
+        name = versioning.version_name(u'\xe9', 1)
+        self.assertEquals(name, '002\xc3\xa9/0000000000000001')
+        self.assertEquals(versioning.parse_version_name(name),
+                          ('\xc3\xa9', 1))
+
+    def test_invalid_names(self):
+        for name in ('', 'obj', '00zobj/1', '005obj/1', '003obj1',
+                     '003obj/x'):
+            self.assertIsNone(versioning.parse_version_name(name))
+
+    def test_version_length(self):
+        self.assertEquals(versioning.version_length('003obj/1'), 3)
+        self.assertEquals(versioning.version_length('00a'), 10)
+        for name in (None, '', '00', '0x1', 'obj'):
+            self.assertIsNone(versioning.version_length(name))
+
+    def test_prefix(self):
+        self.assertEquals(versioning.parse_version_prefix('003obj/'), 'obj')
+        self.assertIsNone(versioning.parse_version_prefix('003ob'))
+        self.assertIsNone(versioning.parse_version_prefix(''))
+
+    def test_versioned_container(self):
+        self.assertEquals(versioning.versioned_container('_version_c'), 'c')
+        self.assertIsNone(versioning.versioned_container('_version_'))
+        self.assertIsNone(versioning.versioned_container('c'))
+
+    def test_trashed_container(self):
+        self.assertEquals(versioning.trashed_container('.trash-c'), 'c')
+        self.assertIsNone(versioning.trashed_container('.trash-'))
+        self.assertIsNone(versioning.trashed_container('c'))
+
+
+class SwiftGCPDriverVersioningTestCase(TestCase):
+
+    def setUp(self):
+        self.conf = {
+            'max_results': 999,
+            'tools_api_url': 'http://swift-cloud-tools',
+            'tools_api_token': 'token'
+        }
+        self.bucket = FakeVersionedBucket()
+        self.bucket.blob('container/').upload_from_string(b'')
+        self.mock_client = patch(
+            'swift_cloud.drivers.gcp.SwiftGCPDriver._get_client',
+            Mock()).start()
+        self.mock_client.return_value = Mock(
+            get_bucket=Mock(return_value=self.bucket))
+        patch('swift_cloud.drivers.gcp._generations', None).start()
+        patch('swift_cloud.drivers.gcp.TolerantBatch',
+              FakeVersionedBatch).start()
+        FakeVersionedBatch.bucket = self.bucket
+        sharding._counts.clear()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def _request(self, path, method='GET', headers=None, body=None):
+        return make_driver(path, self.conf, method, headers, body).response()
+
+    def _bulk_delete(self, *names):
+        res = self._request('/v1/account?bulk-delete', 'POST',
+                            {'Accept': 'application/json'}, '\n'.join(names))
+        return json.loads(res.body)
+
+    def _enable(self, header='X-Versions-Location'):
+        res = self._request('/v1/account/container', 'POST',
+                            {header: 'archive'})
+        self.assertEquals(res.status_int, 204)
+
+    def test_enable_versioning(self):
+        self._enable()
+        self.assertTrue(self.bucket.versioning_enabled)
+
+        res = self._request('/v1/account/container', 'HEAD')
+        self.assertEquals(res.headers['X-Versions-Location'],
+                          '_version_container')
+
+        # hidden from versioned_writes, GCS archives the versions
+        driver = make_driver('/v1/account/container', self.conf, 'HEAD')
+        driver.req.environ['swift.source'] = 'GET_CONTAINER_INFO'
+        self.assertNotIn('X-Versions-Location', driver.response().headers)
+
+        self._request('/v1/account/container', 'POST',
+                      {'X-Remove-Versions-Location': 'x'})
+        res = self._request('/v1/account/container', 'HEAD')
+        self.assertNotIn('X-Versions-Location', res.headers)
+
+    def test_enable_history_from_sysmeta(self):
+        self._request('/v1/account/container', 'POST', {
+            'X-Versions-Location': '',
+            'X-Container-Sysmeta-Versions-Location': 'archive',
+            'X-Container-Sysmeta-Versions-Mode': 'history'})
+        res = self._request('/v1/account/container', 'HEAD')
+        self.assertEquals(res.headers['X-History-Location'],
+                          '_version_container')
+        self.assertNotIn('X-Versions-Location', res.headers)
+
+    def test_overwrite_is_archived_without_copy(self):
+        self._enable()
+        self._request('/v1/account/container/obj', 'PUT', body=b'one')
+        self._request('/v1/account/container/obj', 'PUT', body=b'two')
+
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [b'one'])
+        self.assertEquals(self.bucket.labels['object-count'], 1)
+        self.assertEquals(self.bucket.labels['bytes-used'], 3)
+
+    def test_unversioned_container_keeps_no_versions(self):
+        self._enable()
+        self.bucket.blob('other/').upload_from_string(b'')
+        self._request('/v1/account/other/obj', 'PUT', body=b'one')
+        self._request('/v1/account/other/obj', 'PUT', body=b'two')
+        self.assertEquals(self.bucket.noncurrent('other/obj'), [])
+
+        self._request('/v1/account/other/obj', 'DELETE')
+        self.assertIsNone(self.bucket.get_blob('other/obj'))
+        self.assertEquals(self.bucket.noncurrent('other/obj'), [])
+
+    def test_list_and_read_versions(self):
+        self._enable()
+        for data in (b'one', b'two', b'three'):
+            self._request('/v1/account/container/obj', 'PUT', body=data)
+        self._request('/v1/account/container/other', 'PUT', body=b'x')
+        self._request('/v1/account/container/other', 'PUT', body=b'y')
+
+        res = self._request('/v1/account/_version_container')
+        listing = json.loads(res.body)
+        self.assertEquals(len(listing), 3)
+        self.assertTrue(listing[0]['name'].startswith('003obj/'))
+        self.assertEquals([item['bytes'] for item in listing], [3, 3, 1])
+
+        res = self._request('/v1/account/_version_container?prefix=003obj/')
+        names = [item['name'] for item in json.loads(res.body)]
+        self.assertEquals(len(names), 2)
+
+        res = self._request('/v1/account/_version_container/' + names[0])
+        self.assertEquals(res.body, b'one')
+        res = self._request('/v1/account/_version_container/' + names[1],
+                            'HEAD')
+        self.assertEquals(res.status_int, 200)
+
+        res = self._request('/v1/account/_version_container/' + names[0],
+                            'DELETE')
+        self.assertEquals(res.status_int, 204)
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [b'two'])
+
+    def test_stack_delete_restores_previous_version(self):
+        self._enable()
+        self._request('/v1/account/container/obj', 'PUT', body=b'one')
+        self._request('/v1/account/container/obj', 'PUT', body=b'second')
+
+        res = self._request('/v1/account/container/obj', 'DELETE')
+        self.assertEquals(res.status_int, 204)
+        self.assertEquals(self.bucket.get_blob('container/obj').data, b'one')
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [])
+        self.assertEquals(self.bucket.labels['object-count'], 1)
+        self.assertEquals(self.bucket.labels['bytes-used'], 3)
+
+        self._request('/v1/account/container/obj', 'DELETE')
+        self.assertIsNone(self.bucket.get_blob('container/obj'))
+        self.assertEquals(self.bucket.labels['object-count'], 0)
+
+    def test_version_listing_pages(self):
+        self._enable()
+        for obj in ('a', 'b', 'cc'):
+            for data in (b'1', b'2', b'3'):
+                self._request('/v1/account/container/' + obj, 'PUT',
+                              body=data)
+
+        def names(query):
+            res = self._request('/v1/account/_version_container?' + query)
+            if res.status_int == 204:
+                return []
+            return [item['name'][:4] for item in json.loads(res.body)]
+
+        self.assertEquals(names('limit=3'), ['001a', '001a', '001b'])
+        self.assertEquals(names('prefix=001&limit=3'),
+                          ['001a', '001a', '001b'])
+        listing = json.loads(self._request(
+            '/v1/account/_version_container?prefix=001').body)
+        marker = listing[1]['name']
+        self.assertEquals(names('prefix=001&marker=' + marker),
+                          ['001b', '001b'])
+        self.assertEquals(names('prefix=001&end_marker=001b'),
+                          ['001a', '001a'])
+        self.assertEquals(names('prefix=001&marker=002cc'), [])
+        self.assertEquals(names('marker=' + marker + '&limit=3'),
+                          ['001b', '001b', '002c'])
+
+    def test_versions_container_created_before_gcs_versioning(self):
+        self.bucket.blob('_version_container/').upload_from_string(b'')
+        self._enable()
+        res = self._request('/v1/account/_version_container/old', 'PUT',
+                            body=b'archived by versioned_writes')
+        self.assertEquals(res.status_int, 201)
+        self.assertEquals(
+            self.bucket.get_blob('_version_container/old').data,
+            b'archived by versioned_writes')
+
+        get_bucket = self.mock_client.return_value.get_bucket
+        get_bucket.reset_mock()
+        res = self._request('/v1/account/_version_container/old')
+        self.assertEquals(res.body, b'archived by versioned_writes')
+        # read once for the check and the regular object
+        self.assertEquals(get_bucket.call_count, 1)
+
+    def test_version_object_of_missing_account(self):
+        self.mock_client.return_value.get_bucket.side_effect = \
+            NotFound('bucket')
+        res = self._request('/v1/account/_version_container/001a/1')
+        self.assertEquals(res.status_int, 404)
+
+    def test_client_container_named_like_versions(self):
+        res = self._request('/v1/account/_version_other', 'PUT')
+        self.assertEquals(res.status_int, 201)
+        self.assertIsNotNone(self.bucket.get_blob('_version_other/'))
+
+    def test_bulk_delete_restores_previous_version(self):
+        self._enable()
+        self._request('/v1/account/container/obj', 'PUT', body=b'one')
+        self._request('/v1/account/container/obj', 'PUT', body=b'second')
+
+        result = self._bulk_delete('/container/obj')
+        self.assertEquals(result['Number Deleted'], 1)
+        self.assertEquals(self.bucket.get_blob('container/obj').data, b'one')
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [])
+        self.assertEquals(self.bucket.labels['object-count'], 1)
+        self.assertEquals(self.bucket.labels['bytes-used'], 3)
+
+    def test_bulk_delete_in_history_mode_archives(self):
+        self._enable('X-History-Location')
+        self._request('/v1/account/container/obj', 'PUT', body=b'one')
+
+        self.assertEquals(self._bulk_delete('/container/obj')[
+            'Number Deleted'], 1)
+        self.assertIsNone(self.bucket.get_blob('container/obj'))
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [b'one'])
+        self.assertEquals(self.bucket.labels['object-count'], 0)
+
+    def test_extract_overwrite_keeps_no_versions(self):
+        self._enable()
+        self.bucket.blob('other/').upload_from_string(b'')
+        for data in (b'one', b'two'):
+            res = self._request('/v1/account?extract-archive=tar', 'PUT',
+                                {'Accept': 'application/json'},
+                                make_tar([('other/obj', data)]))
+            self.assertEquals(json.loads(res.body)['Number Files Created'],
+                              1)
+        self.assertEquals(self.bucket.get_blob('other/obj').data, b'two')
+        self.assertEquals(self.bucket.noncurrent('other/obj'), [])
+
+    def test_custom_time_rewrite_is_no_version(self):
+        self.conf['expiration_mode'] = 'lifecycle'
+        self._enable()
+        self._request('/v1/account/container/obj', 'PUT',
+                      {'X-Delete-At': '4000000000'}, b'one')
+        res = self._request('/v1/account/container/obj', 'POST',
+                            {'X-Delete-At': '3000000000'})
+        self.assertEquals(res.status_int, 202)
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [])
+
+    def test_delete_account_with_versions_only(self):
+        self.bucket.delete = Mock(side_effect=[Conflict('versions'), None])
+        self._enable()
+        self._request('/v1/account/container/obj', 'PUT', body=b'one')
+        self._request('/v1/account/container/obj', 'PUT', body=b'two')
+        for name in ('container/obj', 'container/'):
+            self.bucket.delete_blob(name)
+
+        res = self._request('/v1/account', 'DELETE')
+        self.assertEquals(res.status_int, 204)
+        self.assertEquals(self.bucket.versions, [])
+        self.assertEquals(self.bucket.delete.call_count, 2)
+
+    def test_history_delete_archives(self):
+        self._enable('X-History-Location')
+        self._request('/v1/account/container/obj', 'PUT', body=b'one')
+
+        self._request('/v1/account/container/obj', 'DELETE')
+        self.assertIsNone(self.bucket.get_blob('container/obj'))
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [b'one'])
+        self.assertEquals(self.bucket.labels['object-count'], 0)
+
+
+class SwiftGCPDriverUndeleteTestCase(SwiftGCPDriverVersioningTestCase):
+
+    def setUp(self):
+        super(SwiftGCPDriverUndeleteTestCase, self).setUp()
+        res = self._request('/v1/account/container', 'POST',
+                            {'X-Undelete-Enabled': 'true'})
+        self.assertEquals(res.status_int, 204)
+
+    def _put(self, obj, data):
+        res = self._request('/v1/account/container/' + obj, 'PUT', body=data)
+        self.assertEquals(res.status_int, 201)
+
+    def test_enable_undelete(self):
+        self.assertTrue(self.bucket.versioning_enabled)
+        self.assertEquals(self.bucket.lifecycle_rules, [{
+            'action': {'type': 'Delete'},
+            'condition': {'isLive': False,
+                          'matchesPrefix': ['container/'],
+                          'daysSinceNoncurrentTime': 90}}])
+
+        # hidden from undelete, GCS keeps the deleted objects
+        driver = make_driver('/v1/account/container', self.conf, 'HEAD')
+        driver.req.environ['swift.source'] = 'GET_CONTAINER_INFO'
+        headers = driver.response().headers
+        self.assertNotIn('x-container-sysmeta-undelete-enabled', headers)
+        self.assertNotIn('x-undelete-enabled', headers)
+
+        res = self._request('/v1/account/container', 'HEAD')
+        self.assertEquals(res.headers['x-undelete-enabled'], 'true')
+
+    def test_trash_rule_is_shared_and_pruned(self):
+        expiration = {'action': {'type': 'Delete'},
+                      'condition': {'daysSinceCustomTime': 0}}
+        # one rule per container, as written by earlier versions
+        self.bucket.lifecycle_rules = [expiration] + [{
+            'action': {'type': 'Delete'},
+            'condition': {'isLive': False,
+                          'matchesPrefix': [prefix],
+                          'daysSinceNoncurrentTime': days}}
+            for prefix, days in (('container/', 90), ('old/', 30))]
+
+        self._request('/v1/account/other', 'PUT',
+                      {'X-Undelete-Enabled': 'true'})
+        self.assertEquals(self.bucket.lifecycle_rules, [expiration, {
+            'action': {'type': 'Delete'},
+            'condition': {'isLive': False,
+                          'matchesPrefix': ['container/', 'old/', 'other/'],
+                          'daysSinceNoncurrentTime': 90}}])
+
+        # undelete disabled, then container deleted
+        self._request('/v1/account/other', 'POST',
+                      {'X-Undelete-Enabled': 'false'})
+        res = self._request('/v1/account/old', 'PUT',
+                            {'X-Undelete-Enabled': 'true'})
+        self.assertEquals(res.status_int, 201)
+        res = self._request('/v1/account/old', 'DELETE')
+        self.assertEquals(res.status_int, 204)
+        self.assertEquals(self.bucket.lifecycle_rules, [expiration, {
+            'action': {'type': 'Delete'},
+            'condition': {'isLive': False,
+                          'matchesPrefix': ['container/'],
+                          'daysSinceNoncurrentTime': 90}}])
+
+        self._request('/v1/account/container', 'POST',
+                      {'X-Undelete-Enabled': 'false'})
+        self.assertEquals(self.bucket.lifecycle_rules, [expiration])
+
+    def test_delete_moves_to_trash(self):
+        self._put('obj', b'one')
+        self._put('obj', b'two')
+        # overwrites are not kept
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [])
+
+        res = self._request('/v1/account/container/obj', 'DELETE')
+        self.assertEquals(res.status_int, 204)
+        self.assertIsNone(self.bucket.get_blob('container/obj'))
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [b'two'])
+        self.assertEquals(self.bucket.labels['object-count'], 0)
+
+        res = self._request('/v1/account/.trash-container/obj')
+        self.assertEquals(res.status_int, 200)
+        self.assertEquals(res.body, b'two')
+
+    def test_list_trash(self):
+        for obj in ('a/1', 'a/2', 'b/1', 'live'):
+            self._put(obj, obj.encode('ascii'))
+        for obj in ('a/1', 'a/2', 'b/1'):
+            self._request('/v1/account/container/' + obj, 'DELETE')
+        self._put('a/1', b'again')
+        self._request('/v1/account/container/a/1', 'DELETE')
+
+        res = self._request('/v1/account/.trash-container')
+        listing = json.loads(res.body)
+        self.assertEquals([item['name'] for item in listing],
+                          ['a/1', 'a/2', 'b/1'])
+        self.assertEquals(listing[0]['bytes'], 5)
+
+        res = self._request('/v1/account/.trash-container?prefix=a/&limit=1')
+        self.assertEquals([item['name'] for item in json.loads(res.body)],
+                          ['a/1'])
+
+        res = self._request('/v1/account/.trash-container?marker=a/1'
+                            '&end_marker=b/1')
+        self.assertEquals([item['name'] for item in json.loads(res.body)],
+                          ['a/2'])
+
+        res = self._request('/v1/account/.trash-other')
+        self.assertEquals(res.status_int, 404)
+
+    def test_trash_object_of_missing_account(self):
+        self.mock_client.return_value.get_bucket.side_effect = \
+            NotFound('bucket')
+        res = self._request('/v1/account/.trash-container/obj')
+        self.assertEquals(res.status_int, 404)
+
+    def test_restore(self):
+        self._put('obj', b'data')
+        self._request('/v1/account/container/obj', 'DELETE')
+
+        res = self._request('/v1/account/.trash-container/obj', 'POST')
+        self.assertEquals(res.status_int, 201)
+        self.assertEquals(self.bucket.get_blob('container/obj').data, b'data')
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [])
+        self.assertEquals(self.bucket.labels['object-count'], 1)
+        self.assertEquals(self.bucket.labels['bytes-used'], 4)
+
+        res = self._request('/v1/account/.trash-container/obj', 'POST')
+        self.assertEquals(res.status_int, 404)
+
+    def test_restore_conflicts_with_live_object(self):
+        self._put('obj', b'old')
+        self._request('/v1/account/container/obj', 'DELETE')
+        self._put('obj', b'new')
+
+        res = self._request('/v1/account/.trash-container/obj', 'POST')
+        self.assertEquals(res.status_int, 409)
+        self.assertEquals(self.bucket.get_blob('container/obj').data, b'new')
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [b'old'])
+
+    def test_purge(self):
+        self._put('obj', b'one')
+        self._request('/v1/account/container/obj', 'DELETE')
+        self._put('obj', b'two')
+        self._request('/v1/account/container/obj', 'DELETE')
+
+        res = self._request('/v1/account/.trash-container/obj', 'DELETE')
+        self.assertEquals(res.status_int, 204)
+        self.assertEquals(self.bucket.noncurrent('container/obj'), [])
+
+        res = self._request('/v1/account/.trash-container/obj', 'DELETE')
+        self.assertEquals(res.status_int, 404)